@@ -0,0 +1,238 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import numpy as np
+
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from game.players import Arm
+
+CONFIG_FILE = 'config.json'
+POSITIONS_FILE = 'actions.json'
+STASH = ['A', 'B', 'C', 'D', 'E', 'F']
+BOARD = [str(i) for i in range(9)]
+METHODS = ['move_piece', 'move_piece_precise', 'clean_board']
+# The fixed 2 s sleep before the grasp, reported as a sleep phase by older reports, is now a settle wait and counted
+# as settle
+PHASES = ['motion', 'settle', 'vision', 'other']
+
+
+class PhaseTimer:
+    """
+    Splits the duration of a call into phases. Phases nest: while an inner phase runs, the outer one is paused, so the
+    phase durations add up to the total.
+    """
+    def __init__(self, clock=time.perf_counter):
+        """
+        :param clock: function returning the current time in seconds, the robot clock for a simulated robot
+        """
+        self.clock = clock
+        self.durations = defaultdict(float)
+        self._stack = []
+        self._since = None
+
+    @property
+    def current(self):
+        return self._stack[-1] if self._stack else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        self._switch()
+        self._stack.append(name)
+        try:
+            yield
+        finally:
+            self._switch()
+            self._stack.pop()
+
+    def wrap(self, fn, name):
+        """
+        :param name: phase name, or function of the current phase returning the phase name
+        :return: fn, timed as the phase
+        """
+        def timed(*args, **kwargs):
+            with self.phase(name(self.current) if callable(name) else name):
+                return fn(*args, **kwargs)
+        return timed
+
+    def reset(self):
+        self.durations = defaultdict(float)
+
+    def _switch(self):
+        now = self.clock()
+        if self._stack:
+            self.durations[self._stack[-1]] += now - self._since
+        self._since = now
+
+
+class NullVision:
+    """
+    Stands in for the board camera, so the precise path runs its adjust loop without finding anything to adjust.
+    """
+    last_predictions_clean = []
+
+
+def instrument(arm, timer):
+    """
+    Times the phases of the moves of an Arm by wrapping the methods of the instance.
+    The streamed trajectory is motion. A set_and_wait_goal_pos during a trajectory only waits for the arm to stop at a
+    waypoint and is settling, on its own it is a point-to-point motion. Waiting for the arm to settle before a grasp,
+    which replaced a fixed sleep, is settling too.
+    """
+    robot = arm.arm
+    arm.trajectory.execute = timer.wrap(arm.trajectory.execute, 'motion')
+    robot.set_and_wait_goal_pos = timer.wrap(robot.set_and_wait_goal_pos,
+                                             lambda current: 'settle' if current == 'motion' else 'motion')
+    arm.adjust_loop = timer.wrap(arm.adjust_loop, 'vision')
+    arm.settle.wait = timer.wrap(arm.settle.wait, 'settle')
+
+
+def bus_io_seconds(stats):
+    """
+    :return: total round-trip time of the transactions recorded by a BusStats, in seconds
+    """
+    if stats is None:
+        return None
+    return sum(hist['count'] * hist['mean_us'] for hist in stats.to_dict()['latency'].values()) / 1e6
+
+
+def run_move(arm, timer, stats, method, start, end):
+    """
+    Runs one move and measures it.
+    :return: dictionary with the total and per-phase durations in seconds
+    """
+    timer.reset()
+    if stats is not None:
+        stats.reset()
+    wall_start = time.perf_counter()
+    # The player and the piece tracking print a lot, keep the report readable
+    with contextlib.redirect_stdout(io.StringIO()), timer.phase('other'):
+        if method == 'clean_board':
+            arm.used_pieces = [end]
+            arm.clean_board([arm.piece if square == start else None for square in BOARD])
+        else:
+            getattr(arm, method)(start, end)
+    phases = {phase: timer.durations.get(phase, 0.0) for phase in PHASES}
+    return {
+        'method': method,
+        'start': start,
+        'end': end,
+        'total': sum(phases.values()),
+        'wall': time.perf_counter() - wall_start,
+        'phases': phases,
+        'bus_io': bus_io_seconds(stats),
+    }
+
+
+def summarize(moves):
+    """
+    :return: dictionary mapping each method to the mean, median and max total duration and the mean phase durations
+    """
+    summary = {}
+    for method in METHODS:
+        results = [move for move in moves if move['method'] == method]
+        if not results:
+            continue
+        totals = np.array([move['total'] for move in results])
+        summary[method] = {
+            'count': len(results),
+            'mean': float(totals.mean()),
+            'p50': float(np.percentile(totals, 50)),
+            'max': float(totals.max()),
+            'phases': {phase: float(np.mean([move['phases'][phase] for move in results])) for phase in PHASES},
+        }
+        if results[0]['bus_io'] is not None:
+            summary[method]['bus_io'] = float(np.mean([move['bus_io'] for move in results]))
+    return summary
+
+
+def format_table(report, baseline=None):
+    """
+    :param report: benchmark report
+    :param baseline: earlier report to compare the mean totals with
+    :return: table of the mean durations per method, in seconds
+    """
+    clock = 'simulated' if report['backend'] == 'sim' else 'wall-clock'
+    lines = [f'backend {report["backend"]}, {clock} seconds',
+             f'{"method":<20}{"count":>6}{"mean":>8}{"p50":>8}{"max":>8}'
+             + ''.join(f'{phase:>8}' for phase in PHASES) + f'{"bus io":>8}'
+             + (f'{"vs base":>9}' if baseline is not None else '')]
+    for method, result in report['summary'].items():
+        line = (f'{method:<20}{result["count"]:>6}{result["mean"]:>8.2f}{result["p50"]:>8.2f}{result["max"]:>8.2f}'
+                + ''.join(f'{result["phases"][phase]:>8.2f}' for phase in PHASES)
+                + (f'{result["bus_io"]:>8.2f}' if 'bus_io' in result else f'{"-":>8}'))
+        if baseline is not None:
+            base = baseline['summary'].get(method)
+            line += f'{(result["mean"] - base["mean"]) / base["mean"]:>+9.1%}' if base else f'{"-":>9}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Time the pick-and-place moves of the arm for every start and end '
+                                                 'square on a virtual or simulated robot.')
+    parser.add_argument('--backend', choices=['sim', 'virtual'], default='sim',
+                        help='Simulated robot (timed in simulated time) or virtual servo bus (timed in real time).')
+    parser.add_argument('--methods', nargs='+', choices=METHODS, default=METHODS,
+                        help='Moves to time. The precise path runs without a camera.')
+    parser.add_argument('--starts', nargs='+', default=STASH, help='Stash squares to pick pieces from.')
+    parser.add_argument('--ends', nargs='+', default=BOARD, help='Board squares to place pieces on.')
+    parser.add_argument('--output', default=None, help='File to write the JSON report to.')
+    parser.add_argument('--baseline', default=None, help='Earlier JSON report to compare with.')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_arguments()
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    if args.backend == 'sim':
+        config['arm']['backend'] = 'sim'
+    else:
+        config['arm']['transport'] = 'virtual'
+
+    # The player loads its arm from a config file
+    with tempfile.NamedTemporaryFile('w', suffix='.json', delete=False) as f:
+        json.dump(config, f)
+    try:
+        arm = Arm('x', config_path=f.name, positions_path=os.path.abspath(POSITIONS_FILE),
+                  vision=NullVision() if 'move_piece_precise' in args.methods else None)
+    finally:
+        os.remove(f.name)
+    timer = PhaseTimer(getattr(arm.arm, 'clock', time.perf_counter))
+    instrument(arm, timer)
+    stats = arm.arm.enable_instrumentation() if hasattr(arm.arm, 'enable_instrumentation') else None
+
+    moves = []
+    for method in args.methods:
+        # Without vision the moves take the plain path
+        arm.vision = NullVision() if method == 'move_piece_precise' else None
+        for stash in args.starts:
+            for square in args.ends:
+                # clean_board brings a piece from the board back to the stash
+                start, end = (square, stash) if method == 'clean_board' else (stash, square)
+                move = run_move(arm, timer, stats, method, start, end)
+                moves.append(move)
+                print(f'{method} {start} -> {end}: {move["total"]:.2f} s')
+
+    report = {'backend': args.backend, 'moves': moves, 'summary': summarize(moves)}
+    baseline = None
+    if args.baseline is not None:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print(format_table(report, baseline))
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    arm.arm.stop_control_loop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import threading
+import time
+
+import numpy as np
+
+
+class FrameGrabber:
+    """
+    Reads a camera on its own thread into a small ring of preallocated frames.
+
+    The camera is read as fast as it delivers, so frames never pile up in the driver while processing is busy. A
+    consumer always gets the newest frame; frames it was too slow for are overwritten and counted as dropped. Frames
+    are decoded straight into the ring buffer (cap.read(image=...)), and the consumer gets a view of its slot instead
+    of a copy. The slot of the frame the consumer holds is never written, so the view stays valid until the next read.
+    Made for a single consumer.
+    """
+    def __init__(self, cap, slots=3):
+        """
+        :param cap: opened cv2.VideoCapture
+        :param slots: number of frames in the ring, at least 3 so one is free while one is read and one is latest
+        """
+        self.cap = cap
+        self.slots = max(slots, 3)
+        self._frames = None
+        self._stamps = np.zeros(self.slots)
+        # Slot and sequence number of the newest frame and of the frame the consumer holds
+        self._latest_slot = None
+        self._latest = 0
+        self._held_slot = None
+        self._held = 0
+        self._ended = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+        # Counters: frames read from the camera, and frames overwritten before the consumer got them
+        self.captured = 0
+        self.dropped = 0
+        # Sequence number and time.perf_counter() capture time of the frame returned by the last read
+        self.sequence = 0
+        self.stamp = None
+
+    def start(self):
+        """
+        Starts the capture thread.
+        """
+        if self._thread is not None:
+            return self
+        self._ended = False
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stops the capture thread after its current frame. The camera is not released.
+        """
+        if self._thread is None:
+            return
+        with self._condition:
+            self._ended = True
+            self._condition.notify_all()
+        self._thread.join()
+        self._thread = None
+
+    def read(self, timeout=None):
+        """
+        Blocks until a frame newer than the last one read is available.
+        :param timeout: maximum time to wait in seconds
+        :return: the newest frame, a view into the ring that is valid until the next read. None if the camera
+                 stopped delivering frames or the timeout passed
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._latest > self._held or self._ended, timeout):
+                return None
+            if self._latest <= self._held:
+                return None
+            self._held_slot, self._held = self._latest_slot, self._latest
+            self.sequence = self._held
+            self.stamp = self._stamps[self._held_slot]
+            return self._frames[self._held_slot]
+
+    def stats(self):
+        """
+        :return: dictionary with the number of captured and dropped frames
+        """
+        return {'captured': self.captured, 'dropped': self.dropped}
+
+    def _next_slot(self):
+        # The slot after the newest frame that the consumer does not hold
+        slot = 0 if self._latest_slot is None else (self._latest_slot + 1) % self.slots
+        while slot == self._held_slot or slot == self._latest_slot:
+            slot = (slot + 1) % self.slots
+        return slot
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if self._ended:
+                    return
+                slot = self._next_slot()
+            if self._frames is None:
+                ret, frame = self.cap.read()
+                if ret:
+                    self._frames = np.empty((self.slots,) + frame.shape, dtype=frame.dtype)
+                    self._frames[slot] = frame
+            else:
+                # Indexing the ring makes a new view object each time, keep the one the camera decodes into
+                buf = self._frames[slot]
+                ret, frame = self.cap.read(image=buf)
+                if ret and frame is not buf:
+                    # The camera changed its resolution, or did not decode in place
+                    if frame.shape != self._frames.shape[1:]:
+                        self._frames = np.empty((self.slots,) + frame.shape, dtype=frame.dtype)
+                    self._frames[slot] = frame
+            stamp = time.perf_counter()
+
+            with self._condition:
+                if not ret:
+                    self._ended = True
+                    self._condition.notify_all()
+                    return
+                self.captured += 1
+                if self._latest > self._held:
+                    # The consumer never got the previous frame
+                    self.dropped += 1
+                self._stamps[slot] = stamp
+                self._latest_slot = slot
+                self._latest += 1
+                self._condition.notify_all()
@@ -523,8 +523,9 @@ class TicTacToeUI:
                     elif event.type == pygame.KEYDOWN and event.key in (pygame.K_q, pygame.K_ESCAPE):
                         self.quit_game()
 
-                vision.wait_for_move()
-                time.sleep(0.1)
+                # Come back to the window events every 100 ms while no move is confirmed
+                if vision.wait_for_move(timeout=0.1) is None:
+                    continue
                 tile, new_piece = vision.get_piece_change()
                 if tile is None or tile > 8:
                     continue
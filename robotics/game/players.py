@@ -1,7 +1,8 @@
 import json
-import time
 import random
 from robotics.robot.robot import Robot
+from robotics.robot.trajectory import TrajectoryExecutor, pick_and_place_waypoints
+from robotics.robot.settle import SettleDetector
 from robotics.utils.track_piece import track_piece_ml
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
@@ -85,13 +86,10 @@ class Arm(Player):
             self.positions = json.load(f)
 
         # Initialize the robotic arm with the loaded configuration
-        self.arm = Robot(device_name=self.arm_config['device_name'], 
-                         servo_ids=self.arm_config['servo_ids'],
-                         velocity_limit=self.arm_config['velocity_limit'],
-                         max_position_limit=self.arm_config['max_position_limit'],
-                         min_position_limit=self.arm_config['min_position_limit'],
-                         position_p_gain=self.arm_config['position_p_gain'],
-                         position_i_gain=self.arm_config['position_i_gain'],)
+        self.arm = Robot.from_config(self.arm_config)
+        self.arm.start_control_loop()
+        self.trajectory = TrajectoryExecutor(self.arm)
+        self.settle = SettleDetector(self.arm)
 
         # Move the arm to the home start position
         self.arm.set_and_wait_goal_pos(self.arm_config['home_pos'])
@@ -120,15 +118,9 @@ class Arm(Player):
             self.move_piece_precise(start, end)
             return
 
-        valid_poses = ['hover', 'pre-grasp', 'grasp', 'post-grasp']
-
-        for pose in valid_poses:
-            self.arm.set_and_wait_goal_pos(self.positions[start][pose])
-
-        for pose in reversed(valid_poses):
-            self.arm.set_and_wait_goal_pos(self.positions[end][pose])
-
-        self.arm.set_and_wait_goal_pos(self.arm_config['home_pos'])
+        # Blend through every pose except grasp, where the claw has to finish closing or opening
+        waypoints, stops = pick_and_place_waypoints(self.positions, start, end, self.arm_config['home_pos'])
+        self.trajectory.execute(waypoints, stops)
 
     def adjust_loop(self):
         for i in range(20):
@@ -175,7 +167,9 @@ class Arm(Player):
             self.arm.set_and_wait_goal_pos(self.positions[start]['hover'])
             self.arm.set_and_wait_goal_pos(self.positions[start]['pre-grasp'])
             self.adjust_loop()
-            time.sleep(2.0)
+            # Wait until the arm and the handle seen by the camera are still before grasping
+            frame = (lambda: self.vision.frame_sequence) if hasattr(self.vision, 'frame_sequence') else None
+            self.settle.wait(target=getattr(self.vision, 'get_handle_info', None), frame=frame)
             self.close_claw()
             self.arm.set_and_wait_goal_pos(self.positions[start]['post-grasp'])
     
@@ -1,6 +1,7 @@
 import json, time, sys, os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from robot.robot import Robot
+from robot.trajectory import TrajectoryExecutor, pick_and_place_waypoints
 
 base_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -14,27 +15,18 @@ with open(os.path.abspath(os.path.join(base_dir, '../actions.json'))) as f:
     positions = json.load(f)
 
 # Dynamixel configuration
-arm = Robot(device_name=arm_config['device_name'], 
-            servo_ids=arm_config['servo_ids'],
-            velocity_limit=arm_config['velocity_limit'],
-            max_position_limit=arm_config['max_position_limit'],
-            min_position_limit=arm_config['min_position_limit'],
-            position_p_gain=arm_config['position_p_gain'],
-            position_i_gain=arm_config['position_i_gain'])
+arm = Robot.from_config(arm_config)
+
+trajectory = TrajectoryExecutor(arm)
 
 # Go to home start position 
 arm.set_and_wait_goal_pos(arm_config['home_pos'])
 
 def move_piece(start, end):
-    arm.set_and_wait_goal_pos(positions[start]['hover'])
-    arm.set_and_wait_goal_pos(positions[start]['pre-grasp'])
-    arm.set_and_wait_goal_pos(positions[start]['grasp'])
-    arm.set_and_wait_goal_pos(positions[start]['post-grasp'])
-    arm.set_and_wait_goal_pos(positions[end]['post-grasp'])
-    arm.set_and_wait_goal_pos(positions[end]['grasp'])
-    arm.set_and_wait_goal_pos(positions[end]['pre-grasp'])
-    arm.set_and_wait_goal_pos(positions[end]['hover'])
-    arm.set_and_wait_goal_pos(arm_config['home_pos'])
+    # hover -> pre-grasp -> grasp -> post-grasp at start, the reverse at end, then home.
+    # Only stops at grasp, where the claw has to finish closing or opening.
+    waypoints, stops = pick_and_place_waypoints(positions, start, end, arm_config['home_pos'])
+    trajectory.execute(waypoints, stops)
 
 
 # Sample game
@@ -291,6 +291,7 @@ class TicTacToe:
         """
         # If the board is reset and an Arm is one of the players,
         # the robotic arm should clean up its own pieces.
+        # The arms reach over the same squares, so they clean up one at a time.
         curr_board = self.history[-1].copy()
         if isinstance(self.p1, Arm):
             self.p1.clean_board(curr_board)
@@ -303,6 +304,14 @@ class TicTacToe:
 
         print("The game has been reset to an empty board.")
 
+    def close(self):
+        """
+        Stops the control loops of the arms.
+        """
+        for player in (self.p1, self.p2):
+            if isinstance(player, Arm):
+                player.arm.stop_control_loop()
+
     def initial(self):
         """
         Reset the game to its initial state.
@@ -356,4 +365,7 @@ if __name__ == '__main__':
     p1 = SmartArm('x', lvl=2)
     p2 = SmartArm('o', lvl=1)
     game = TicTacToe(p1, p2)
-    game.reset()
+    try:
+        game.reset()
+    finally:
+        game.close()
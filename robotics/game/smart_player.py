@@ -3,6 +3,7 @@ import random
 import sys, os
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from robot.robot import Robot
+from robot.trajectory import TrajectoryExecutor, pick_and_place_waypoints
 from players import Player
 
 
@@ -49,23 +50,12 @@ class Arm(Player):
         # Initialize the robotic arm with the loaded configuration
         if piece == 'x':
             self.positions = positions['arm1']
-            self.arm = Robot(device_name=self.arm_config_1['device_name'], 
-                            servo_ids=self.arm_config_1['servo_ids'],
-                            velocity_limit=self.arm_config_1['velocity_limit'],
-                            max_position_limit=self.arm_config_1['max_position_limit'],
-                            min_position_limit=self.arm_config_1['min_position_limit'],
-                            position_p_gain=self.arm_config_1['position_p_gain'],
-                            position_i_gain=self.arm_config_1['position_i_gain'],)
+            self.arm = Robot.from_config(self.arm_config_1)
         elif piece == 'o':
             self.positions = positions['arm2']
-            self.arm = Robot(device_name=self.arm_config_2['device_name'], 
-                            servo_ids=self.arm_config_2['servo_ids'],
-                            velocity_limit=self.arm_config_2['velocity_limit'],
-                            max_position_limit=self.arm_config_2['max_position_limit'],
-                            min_position_limit=self.arm_config_2['min_position_limit'],
-                            position_p_gain=self.arm_config_2['position_p_gain'],
-                            position_i_gain=self.arm_config_2['position_i_gain'],)
-
+            self.arm = Robot.from_config(self.arm_config_2)
+        self.arm.start_control_loop()
+        self.trajectory = TrajectoryExecutor(self.arm)
 
         # Move the arm to the home start position
         self.arm.set_and_wait_goal_pos(self.positions['home_pos'])
@@ -94,15 +84,9 @@ class Arm(Player):
         if self.piece == 'o' and clean:
             start = str(8 - int(start))
 
-        valid_poses = ['hover', 'pre-grasp', 'grasp', 'post-grasp']
-
-        for pose in valid_poses:
-            self.arm.set_and_wait_goal_pos(self.positions[start][pose])
-
-        for pose in reversed(valid_poses):
-            self.arm.set_and_wait_goal_pos(self.positions[end][pose])
-
-        self.arm.set_and_wait_goal_pos(self.positions['home_pos'])
+        # Blend through every pose except grasp, where the claw has to finish closing or opening
+        waypoints, stops = pick_and_place_waypoints(self.positions, start, end, self.positions['home_pos'])
+        self.trajectory.execute(waypoints, stops)
 
     def clean_board(self, curr_board):
         """
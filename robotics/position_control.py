@@ -3,11 +3,11 @@ import time
 import os
 import sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
-import threading
 import argparse
 import numpy as np
 import pandas as pd
 from robot.robot import Robot
+from robot.teleop import TeleopEngine
 
 CONVERSION_FACTOR = 4096 / 360
 VALID_POSE_TYPES = ['hover', 'pre-grasp', 'grasp', 'post-grasp']
@@ -117,25 +117,15 @@ def initialize_robot(arm_config, lead_config):
     Returns:
         tuple: Initialized robotic arm and leader arm (if any).
     """
-    arm = Robot(
-        arm_config['device_name'],
-        arm_config['baudrate'], 
-        arm_config['servo_ids'],
-        arm_config['velocity_limit'],
-        arm_config['max_position_limit'],
-        arm_config['min_position_limit'],
-        arm_config['position_p_gain'],
-        arm_config['position_i_gain']
-    )
+    arm = Robot.from_config(arm_config)
 
     lead = None
     if lead_config:
-        lead = Robot(
-            lead_config['device_name'], 
-            lead_config['baudrate'], 
-            lead_config['servo_ids']
-        )
+        lead = Robot.from_config(lead_config)
         lead.set_trigger_torque()
+    else:
+        # Without teleoperation the arm only moves pose to pose, so let the control loop own the bus
+        arm.start_control_loop()
     return arm, lead
 
 
@@ -153,19 +143,11 @@ def record_position_with_leader(arm, lead, action, pose_type):
         list: Recorded positions.
     """
     print(f'Move the arm to the {pose_type} position of the action called "{action}"')
-    stop = threading.Event()
-
-    def wait_for_input(stop_event):
-        input('Press enter to record. ')
-        stop_event.set()
-
-    thread = threading.Thread(target=wait_for_input, args=(stop,))
-    thread.start()
-
-    while not stop.is_set():
-        positions = lead.read_position()
-        arm.set_goal_pos(positions)
-    thread.join()
+    teleop = TeleopEngine(lead, arm)
+    teleop.start()
+    input('Press enter to record. ')
+    positions = teleop.stop()
+    print(teleop.summary())
 
     positions = [int(p) for p in positions]
     print(f'{action}: {pose_type} recorded successfully')
@@ -0,0 +1,61 @@
+import os, json, argparse, sys
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+from robot.robot import Robot
+from robot.teleop import TeleopEngine
+from robot.joint_log import JointLogWriter, JointLogPlayer, read_joint_log
+
+CONFIG_FILE = 'config.json'
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='Record a teleoperated motion at the control rate and replay it.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record = subparsers.add_parser('record', help='Teleoperate the arm with the leader arm and record the motion.')
+    record.add_argument('log', help='Joint log file to write.')
+    record.add_argument('--rate', type=float, default=200, help='Leader read rate in Hz.')
+    replay = subparsers.add_parser('replay', help='Replay a recorded motion on the arm.')
+    replay.add_argument('log', help='Joint log file to replay.')
+    replay.add_argument('--speed', type=float, default=1.0, help='Playback speed, 2 replays twice as fast.')
+    replay.add_argument('--source', choices=['follower', 'leader'], default='follower',
+                        help='Replay the goals the arm got or the positions of the leader.')
+    return parser.parse_args()
+
+
+def record(arm, leader, path, rate_hz):
+    leader.set_trigger_torque()
+    with JointLogWriter(path, len(leader.servo_ids)) as writer:
+        teleop = TeleopEngine(leader, arm, rate_hz=rate_hz, recorder=writer)
+        teleop.start()
+        input('Recording. Press enter to stop.')
+        teleop.stop()
+    print(teleop.summary())
+    header, records = read_joint_log(path)
+    duration = records['time'][-1] if len(records) else 0.0
+    print(f'Recorded {len(records)} samples over {duration:.1f} s to {path}')
+
+
+def replay(arm, path, speed, source):
+    player = JointLogPlayer(arm, path, speed=speed, source=source)
+    print(f'Replaying {len(player.times)} samples at {speed}x')
+    player.play()
+    print(f'Sent {player.sent} goals')
+
+
+def main():
+    args = parse_arguments()
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    arm = Robot.from_config(config['arm'])
+    try:
+        if args.command == 'record':
+            leader = Robot.from_config(config['leader'])
+            record(arm, leader, args.log, args.rate)
+        else:
+            replay(arm, args.log, args.speed, args.source)
+    finally:
+        arm.set_and_wait_goal_pos(config['arm']['rest_pos'])
+        arm._disable_torque()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,7 @@
-import os, json, threading, argparse, sys
+import os, json, argparse, sys
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 from robot.robot import Robot
+from robot.teleop import TeleopEngine
 
 # Square and pose types
 SQUARES = ['A', 'B', 'C', 'D', 'E', 'F', '0', '1', '2', '3', '4', '5', '6', '7', '8']
@@ -20,17 +21,10 @@ def load_robot_settings(args):
     return arm_config, leader_config
 
 def initialize_robots(arm_config, leader_config):
-    arm = Robot(device_name=arm_config['device_name'], 
-                servo_ids=arm_config['servo_ids'],
-                velocity_limit=arm_config['velocity_limit'],
-                max_position_limit=arm_config['max_position_limit'],
-                min_position_limit=arm_config['min_position_limit'],
-                position_p_gain=arm_config['position_p_gain'],
-                position_i_gain=arm_config['position_i_gain'])
+    arm = Robot.from_config(arm_config)
     leader = None
     if leader_config:
-        leader = Robot(device_name=leader_config['device_name'], 
-                       servo_ids=leader_config['servo_ids'])
+        leader = Robot.from_config(leader_config)
         leader.set_trigger_torque()
     return arm, leader
 
@@ -53,18 +47,12 @@ def record_position(arm, square, pose_type):
 # Function to record positions with leader arm
 def record_position_with_leader(arm, leader, square, pose_type):
     print(f'Move the arm to the {pose_type} position of square {square}.')
-    # Wait for user input to stop teleoperation
-    stop = threading.Event()
-    def wait_for_input(stop):
-        input('Press enter to record.')
-        stop.set()
-    thread = threading.Thread(target=wait_for_input, args=(stop,))
-    thread.start()
-    # Teleoperation
-    while not stop.is_set():
-        pos = leader.read_position()
-        arm.set_goal_pos(pos)
-    thread.join()
+    # Teleoperation until the user presses enter
+    teleop = TeleopEngine(leader, arm)
+    teleop.start()
+    input('Press enter to record.')
+    pos = teleop.stop()
+    print(teleop.summary())
     # Record position
     pos = [int(p) for p in pos]
     return pos
@@ -0,0 +1,118 @@
+import queue
+import threading
+from concurrent.futures import Future
+
+from robot.robot import Robot
+
+
+class BusManager:
+    """
+    Drives several Robot chains, each on its own port, from one process.
+
+    Every port gets an I/O thread with a job queue, so commands for different arms run concurrently while the
+    commands for one arm still run in the order they were submitted. The coordinated calls (set_goal_pos,
+    read_position, read_state) dispatch to all ports at once and return when every port has answered, so both arms
+    are commanded and sampled in the same tick. The I/O thread is the only one talking to its port, so the robots
+    must not run their own control loop.
+    """
+    def __init__(self, robots: dict):
+        """
+        :param robots: dictionary mapping a name, e.g. 'arm1', to a Robot on its own port
+        """
+        for name, robot in robots.items():
+            if robot.control_loop is not None:
+                raise ValueError(f'robot {name} runs its own control loop on the port, stop it first')
+        self.robots = robots
+        self._queues = {}
+        self._threads = {}
+        for name in robots:
+            self._queues[name] = queue.Queue()
+            self._threads[name] = threading.Thread(target=self._run, args=(self._queues[name],), daemon=True,
+                                                   name=f'bus-{name}')
+            self._threads[name].start()
+
+    @classmethod
+    def from_config(cls, configs: dict):
+        """
+        Creates the robots of a config file with several arms, e.g. smart_config.json.
+        :param configs: dictionary mapping a name to the config of an arm, see Robot.from_config
+        """
+        return cls({name: Robot.from_config(config) for name, config in configs.items()})
+
+    def submit(self, name, fn, *args, **kwargs) -> Future:
+        """
+        Runs fn(*args, **kwargs) on the I/O thread of a port.
+        :param name: name of the robot whose thread runs the job
+        :return: future resolving to the return value of fn
+        """
+        if self._threads.get(name) is None:
+            raise RuntimeError(f'bus manager has no running port {name}')
+        future = Future()
+        self._queues[name].put((future, fn, args, kwargs))
+        return future
+
+    def map(self, fn, names=None) -> dict:
+        """
+        Runs fn(robot) on the I/O thread of every port concurrently and waits for all of them.
+        :param fn: function taking a Robot
+        :param names: names of the robots, all of them by default
+        :return: dictionary mapping each name to the return value of fn
+        """
+        names = list(self.robots) if names is None else names
+        futures = {name: self.submit(name, fn, self.robots[name]) for name in names}
+        return {name: future.result() for name, future in futures.items()}
+
+    def set_goal_pos(self, actions: dict):
+        """
+        Sends the goal positions of several arms in the same tick.
+        :param actions: dictionary mapping a name to a list or numpy array of joint positions in range [0, 4096]
+        """
+        futures = [self.submit(name, self.robots[name].set_goal_pos, action) for name, action in actions.items()]
+        for future in futures:
+            future.result()
+
+    def set_and_wait_goal_pos(self, actions: dict, threshold=1):
+        """
+        Moves several arms at the same time and waits until all of them reached their goal.
+        :param actions: dictionary mapping a name to a list or numpy array of joint positions in range [0, 4096]
+        :param threshold: threshold for the velocity to consider a robot has reached the goal position
+        """
+        futures = [self.submit(name, self.robots[name].set_and_wait_goal_pos, action, threshold)
+                   for name, action in actions.items()]
+        for future in futures:
+            future.result()
+
+    def read_position(self, names=None) -> dict:
+        """
+        :return: dictionary mapping each name to the joint positions of the robot
+        """
+        return self.map(lambda robot: robot.read_position(), names)
+
+    def read_state(self, names=None) -> dict:
+        """
+        :return: dictionary mapping each name to the state of the robot, see Robot.read_state
+        """
+        return self.map(lambda robot: robot.read_state(), names)
+
+    def close(self):
+        """
+        Finishes the queued jobs and stops the I/O threads.
+        """
+        for name, thread in self._threads.items():
+            if thread is not None:
+                self._queues[name].put(None)
+                thread.join()
+                self._threads[name] = None
+
+    def _run(self, jobs: queue.Queue):
+        while True:
+            job = jobs.get()
+            if job is None:
+                return
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
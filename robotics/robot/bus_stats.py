@@ -0,0 +1,168 @@
+import json
+import math
+import threading
+
+# Upper edges of the latency histogram buckets in microseconds, doubling from 32 us to about 0.5 s
+LATENCY_BUCKETS_US = [2 ** k for k in range(5, 20)] + [math.inf]
+
+# Approximate packet sizes of Protocol 2.0 without byte stuffing:
+# header (4) + id (1) + length (2) + instruction (1) + crc (2) = 10, plus the parameters
+INSTRUCTION_OVERHEAD = 10
+# header (4) + id (1) + length (2) + instruction (1) + error (1) + crc (2) = 11, plus the data
+STATUS_OVERHEAD = 11
+
+
+def packet_bytes(kind, num_bytes, num_servos=1):
+    """
+    Number of bytes a transaction puts on the bus, in both directions.
+    :param kind: 'read', 'write', 'sync_read' or 'sync_write'
+    :param num_bytes: width of the register(s) accessed
+    :param num_servos: number of servos addressed by a sync transaction
+    :return: bytes sent, bytes received
+    """
+    if kind == 'read':
+        return INSTRUCTION_OVERHEAD + 4, STATUS_OVERHEAD + num_bytes
+    if kind == 'write':
+        return INSTRUCTION_OVERHEAD + 2 + num_bytes, STATUS_OVERHEAD
+    if kind == 'sync_read':
+        return INSTRUCTION_OVERHEAD + 4 + num_servos, (STATUS_OVERHEAD + num_bytes) * num_servos
+    if kind == 'sync_write':
+        return INSTRUCTION_OVERHEAD + 4 + num_servos * (1 + num_bytes), 0
+    raise ValueError(f'unknown transaction kind {kind}')
+
+
+class LatencyHistogram:
+    """
+    Log-spaced histogram of round-trip latencies.
+    """
+    def __init__(self):
+        self.counts = [0] * len(LATENCY_BUCKETS_US)
+        self.total_us = 0.0
+        self.min_us = math.inf
+        self.max_us = 0.0
+
+    def add(self, latency_us):
+        for i, edge in enumerate(LATENCY_BUCKETS_US):
+            if latency_us <= edge:
+                self.counts[i] += 1
+                break
+        self.total_us += latency_us
+        self.min_us = min(self.min_us, latency_us)
+        self.max_us = max(self.max_us, latency_us)
+
+    @property
+    def count(self):
+        return sum(self.counts)
+
+    def percentile(self, q):
+        """
+        :param q: percentile in range [0, 100]
+        :return: upper edge of the bucket holding the q-th percentile, in microseconds
+        """
+        target = self.count * q / 100
+        seen = 0
+        for edge, count in zip(LATENCY_BUCKETS_US, self.counts):
+            seen += count
+            if count and seen >= target:
+                return min(edge, self.max_us)
+        return 0.0
+
+    def to_dict(self):
+        count = self.count
+        return {
+            'count': count,
+            'mean_us': self.total_us / count if count else 0.0,
+            'min_us': self.min_us if count else 0.0,
+            'max_us': self.max_us,
+            'p50_us': self.percentile(50),
+            'p99_us': self.percentile(99),
+            'buckets_us': {str(edge): n for edge, n in zip(LATENCY_BUCKETS_US, self.counts) if n},
+        }
+
+
+class BusStats:
+    """
+    Opt-in counters for the traffic on one Dynamixel bus.
+
+    Counts packets, bytes, retries and failures per servo and per register, and keeps a latency histogram per
+    transaction kind and register. Enable it with Dynamixel.enable_instrumentation or Robot.enable_instrumentation.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.per_servo = {}
+        self.per_register = {}
+        self.latency = {}
+
+    def record(self, kind, servo_ids, address, num_bytes, latency, success=True, retry=False):
+        """
+        Records one transaction on the bus.
+        :param kind: 'read', 'write', 'sync_read' or 'sync_write'
+        :param servo_ids: list of servo ids addressed by the transaction
+        :param address: control table address of the register
+        :param num_bytes: width of the register
+        :param latency: round-trip time of the transaction in seconds
+        :param success: False if the transaction failed
+        :param retry: True if the transaction is a retry of a failed one
+        """
+        tx_bytes, rx_bytes = packet_bytes(kind, num_bytes, len(servo_ids))
+        with self._lock:
+            self._count(self._counters(self.per_register, address), tx_bytes, rx_bytes, success, retry)
+            # Each servo gets its share of the bytes of a sync transaction
+            for servo_id in servo_ids:
+                self._count(self._counters(self.per_servo, servo_id), tx_bytes // len(servo_ids),
+                            rx_bytes // len(servo_ids), success, retry)
+            key = f'{kind} {address}'
+            if key not in self.latency:
+                self.latency[key] = LatencyHistogram()
+            self.latency[key].add(latency * 1e6)
+
+    def _count(self, counter, tx_bytes, rx_bytes, success, retry):
+        counter['packets'] += 1
+        counter['bytes_tx'] += tx_bytes
+        counter['bytes_rx'] += rx_bytes
+        counter['retries'] += int(retry)
+        counter['failures'] += int(not success)
+
+    def _counters(self, table, key):
+        if key not in table:
+            table[key] = {'packets': 0, 'bytes_tx': 0, 'bytes_rx': 0, 'retries': 0, 'failures': 0}
+        return table[key]
+
+    def reset(self):
+        with self._lock:
+            self.per_servo.clear()
+            self.per_register.clear()
+            self.latency.clear()
+
+    def to_dict(self):
+        with self._lock:
+            return {
+                'per_servo': {str(k): dict(v) for k, v in sorted(self.per_servo.items())},
+                'per_register': {str(k): dict(v) for k, v in sorted(self.per_register.items())},
+                'latency': {k: v.to_dict() for k, v in sorted(self.latency.items())},
+            }
+
+    def to_json(self, path=None):
+        """
+        :param path: file to write the statistics to. If None, the JSON string is returned instead
+        """
+        data = json.dumps(self.to_dict(), indent=4)
+        if path is None:
+            return data
+        with open(path, 'w') as f:
+            f.write(data)
+
+    def summary(self):
+        """
+        :return: human readable table of the latency and failure statistics
+        """
+        stats = self.to_dict()
+        lines = [f'{"transaction":<18}{"count":>8}{"mean us":>10}{"p50 us":>10}{"p99 us":>10}{"max us":>10}']
+        for key, hist in stats['latency'].items():
+            lines.append(f'{key:<18}{hist["count"]:>8}{hist["mean_us"]:>10.0f}{hist["p50_us"]:>10.0f}'
+                         f'{hist["p99_us"]:>10.0f}{hist["max_us"]:>10.0f}')
+        lines.append(f'{"servo":<8}{"packets":>10}{"bytes tx":>10}{"bytes rx":>10}{"retries":>10}{"failures":>10}')
+        for servo_id, counter in stats['per_servo'].items():
+            lines.append(f'{servo_id:<8}{counter["packets"]:>10}{counter["bytes_tx"]:>10}{counter["bytes_rx"]:>10}'
+                         f'{counter["retries"]:>10}{counter["failures"]:>10}')
+        return '\n'.join(lines)
@@ -0,0 +1,80 @@
+import threading
+import time
+
+import numpy as np
+
+
+class LatestValue:
+    """
+    Single-producer, single-consumer channel that only keeps the newest numpy array.
+
+    The producer writes into one of two preallocated buffers while the consumer copies the other, so neither side
+    blocks the other and nothing is allocated per sample. Every published value gets a sequence number and a
+    timestamp, which tells the consumer whether it already saw the value and how old it is.
+    """
+    def __init__(self, shape, dtype=float):
+        """
+        :param shape: shape of the arrays passed through the channel
+        :param dtype: dtype of the arrays passed through the channel
+        """
+        self._buffers = np.zeros((2,) + tuple(np.atleast_1d(shape)), dtype=dtype)
+        self._stamps = [0.0, 0.0]
+        # Sequence number of the newest complete value and of the value being written. Value n is in buffer n % 2.
+        self._sequence = 0
+        self._writing = 0
+        self._event = threading.Event()
+
+    @property
+    def sequence(self):
+        """
+        Sequence number of the newest value, 0 if nothing was published yet.
+        """
+        return self._sequence
+
+    def publish(self, value, stamp=None):
+        """
+        Producer side: replaces the value of the channel.
+        :param value: array of the shape of the channel
+        :param stamp: time.perf_counter() time the value was sampled at, now by default
+        """
+        sequence = self._sequence + 1
+        self._writing = sequence
+        self._buffers[sequence % 2] = value
+        self._stamps[sequence % 2] = time.perf_counter() if stamp is None else stamp
+        self._sequence = sequence
+        self._event.set()
+
+    def read(self, out):
+        """
+        Consumer side: copies the newest value.
+        :param out: array of the shape of the channel to copy the value into
+        :return: sequence number and timestamp of the value, (0, 0.0) if nothing was published yet
+        """
+        while True:
+            sequence = self._sequence
+            if sequence == 0:
+                return 0, 0.0
+            np.copyto(out, self._buffers[sequence % 2])
+            stamp = self._stamps[sequence % 2]
+            # The buffer is only reused for value sequence + 2. If the producer has not started writing that one,
+            # the copy is consistent.
+            if self._writing < sequence + 2:
+                return sequence, stamp
+
+    def wait(self, sequence, timeout=None):
+        """
+        Consumer side: blocks until a value newer than sequence is published.
+        :param sequence: sequence number of the value the consumer has
+        :param timeout: maximum time to wait in seconds
+        :return: True if a newer value is available
+        """
+        deadline = None if timeout is None else time.perf_counter() + timeout
+        while self._sequence <= sequence:
+            self._event.clear()
+            if self._sequence > sequence:
+                break
+            remaining = None if deadline is None else deadline - time.perf_counter()
+            if remaining is not None and remaining <= 0:
+                return False
+            self._event.wait(remaining)
+        return True
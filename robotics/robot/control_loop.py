@@ -0,0 +1,188 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+
+class ControlLoop:
+    """
+    Background thread that owns the bus of a Robot at a fixed rate.
+
+    Every tick it sends the newest goal position (if there is one), reads the full robot state with a single sync
+    read and resolves the future of the active goal as soon as the arm has arrived. Callers block on the future or
+    await it instead of polling the velocity themselves.
+
+    A tick whose bus transaction fails fails the active goal with the exception. Without an active goal, the failure
+    is printed and kept in last_error. In both cases state is reset to None until a read succeeds again, so readers of
+    state never take an old sample for the current one.
+    """
+    def __init__(self, robot, rate_hz=200, position_tolerance=10, velocity_threshold=1, settle_time=0.1,
+                 start_timeout=0.5):
+        """
+        :param robot: Robot instance to drive
+        :param rate_hz: loop rate in Hz
+        :param position_tolerance: maximum per-joint position error (in ticks) for a goal to count as reached
+        :param velocity_threshold: maximum per-joint velocity for the arm to count as stopped
+        :param settle_time: seconds the arm must stay stopped before a goal outside the position tolerance
+                            counts as reached, e.g. when the claw closes on a piece and cannot reach its goal. Only
+                            counted once the arm has started moving toward the goal
+        :param start_timeout: seconds after which a goal outside the position tolerance counts as started even if
+                              the arm has not moved, e.g. when it is blocked from the start
+        """
+        self.robot = robot
+        self.period = 1.0 / rate_hz
+        self.position_tolerance = position_tolerance
+        self.velocity_threshold = velocity_threshold
+        self.settle_time = settle_time
+        self.start_timeout = start_timeout
+        self.state = None
+        # Last exception of a failed tick and the number of failed ticks
+        self.last_error = None
+        self.errors = 0
+
+        self._lock = threading.Lock()
+        self._pending = None
+        self._active = None
+        self._stopped_since = None
+        self._failing = False
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the loop thread.
+        """
+        if self._thread is not None:
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the loop thread and cancels any goal that has not been reached yet.
+        """
+        if self._thread is None:
+            return
+        self._stop_event.set()
+        self._thread.join()
+        self._thread = None
+        with self._lock:
+            for goal in (self._pending, self._active):
+                if goal is not None:
+                    goal['future'].cancel()
+            self._pending = None
+            self._active = None
+
+    def is_running(self):
+        return self._thread is not None
+
+    def move_to(self, action, servo_id=None, velocity_threshold=None) -> Future:
+        """
+        Sends a new goal position on the next tick. A goal that is still in flight is superseded and its future
+        is cancelled.
+        :param action: list or numpy array of target joint positions in range [0, 4096]
+        :param servo_id: servo id to set the goal position if controlling only one servo
+        :param velocity_threshold: overrides the velocity threshold of the loop for this goal
+        :return: future that resolves to the robot state once the goal is reached
+        """
+        goal = np.clip(action, self.robot.min_position_limit, self.robot.max_position_limit)
+        if servo_id is None:
+            mask = np.ones(len(self.robot.servo_ids), dtype=bool)
+        else:
+            mask = np.array(self.robot.servo_ids) == servo_id
+        future = Future()
+        with self._lock:
+            if self._pending is not None:
+                self._pending['future'].cancel()
+            self._pending = {
+                'action': action,
+                'servo_id': servo_id,
+                'goal': goal,
+                'mask': mask,
+                'velocity_threshold': self.velocity_threshold if velocity_threshold is None else velocity_threshold,
+                'future': future,
+            }
+        return future
+
+    async def move_to_async(self, action, servo_id=None, velocity_threshold=None):
+        """
+        Awaitable version of move_to.
+        :return: robot state once the goal is reached
+        """
+        return await asyncio.wrap_future(self.move_to(action, servo_id, velocity_threshold))
+
+    def _run(self):
+        next_tick = time.perf_counter()
+        while not self._stop_event.is_set():
+            self._tick()
+            next_tick += self.period
+            delay = next_tick - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                # Running behind, don't try to catch up with a burst of ticks
+                next_tick = time.perf_counter()
+
+    def _tick(self):
+        with self._lock:
+            pending, self._pending = self._pending, None
+        try:
+            if pending is not None:
+                if self._active is not None:
+                    self._active['future'].cancel()
+                self._active = pending
+                self._stopped_since = None
+                self.robot.set_goal_pos(pending['action'], servo_id=pending['servo_id'])
+                pending['sent'] = time.perf_counter()
+                pending['moved'] = False
+                pending['start'] = None if self.state is None else self.state['position'].copy()
+            self.state = self.robot.read_state()
+            self._failing = False
+            if pending is not None and pending['start'] is None:
+                pending['start'] = self.state['position'].copy()
+        except Exception as e:
+            if not self._failing and self._active is None:
+                # Only the first of a series of failures, the loop keeps trying every tick
+                print(f'control loop: bus error, robot state unavailable: {e!r}')
+            self._failing = True
+            self.state = None
+            self.last_error = e
+            self.errors += 1
+            if self._active is not None:
+                if not self._active['future'].done():
+                    self._active['future'].set_exception(e)
+                self._active = None
+            return
+
+        if self._active is None:
+            return
+        if self._active['future'].done():
+            # Cancelled by the caller
+            self._active = None
+        elif self._goal_reached(self._active):
+            self._active['future'].set_result(self.state)
+            self._active = None
+
+    def _goal_reached(self, goal):
+        mask = goal['mask']
+        stopped = np.all(np.abs(self.state['velocity'][mask]) <= goal['velocity_threshold'])
+        travelled = np.abs(self.state['position'][mask] - goal['start'][mask])
+        if not stopped or np.any(travelled > self.position_tolerance):
+            # The arm has started the move, so stopping from now on means it arrived or is blocked
+            goal['moved'] = True
+        if not stopped:
+            self._stopped_since = None
+            return False
+        error = np.abs(self.state['position'][mask] - goal['goal'][mask])
+        if np.all(error <= self.position_tolerance):
+            return True
+        now = time.perf_counter()
+        if not goal['moved'] and now - goal['sent'] < self.start_timeout:
+            # Still standing where the previous goal left it, the move has not started yet
+            return False
+        if self._stopped_since is None:
+            self._stopped_since = now
+        return now - self._stopped_since >= self.settle_time
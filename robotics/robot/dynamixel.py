@@ -1,8 +1,11 @@
 from __future__ import annotations
 import math
 import os
+import threading
 from dynamixel_sdk import *
-from dataclasses import dataclass
+from robot.bus_stats import BusStats
+from robot.retry import BusReadError, RetryPolicy
+from dataclasses import dataclass, field
 import enum
 
 
@@ -36,6 +39,13 @@ class Dynamixel:
     POSITION_P = 84
     ADDR_ID = 7
     PROFILE_VELOCITY = 112
+    ADDR_PWM_LIMIT = 36
+    # Configuration registers mirrored in the shadow control table. Writes of the value a servo already holds are
+    # skipped. Goal registers are not cached, the servos reset them when the torque is enabled. Torque enable is not
+    # cached either: a reboot, brown-out or overload shutdown switches it off behind the shadow's back, and a skipped
+    # enable could never switch it back on.
+    CACHED_ADDRESSES = (OPERATING_MODE_ADDR, POSITION_I, POSITION_P, PROFILE_VELOCITY, ADDR_PWM_LIMIT,
+                        ADDR_VELOCITY_LIMIT, ReadAttribute.HOMING_OFFSET.value)
 
     @dataclass
     class Config:
@@ -45,18 +55,37 @@ class Dynamixel:
         protocol_version: float = 2.0
         device_name: str = ''  # /dev/tty.usbserial-1120'
         dynamixel_id: int = 1
+        transport: str = 'serial'  # 'serial' or 'virtual'
+        transport_options: dict = field(default_factory=dict)
+        retry_policy: RetryPolicy = field(default_factory=RetryPolicy)
 
     def __init__(self, config: Config):
         self.config = config
+        # Serializes transactions on the port when several threads share it
+        self.lock = threading.RLock()
+        # Bus traffic statistics, only collected after enable_instrumentation()
+        self.stats = None
+        # Write-through shadow of the cached registers, (motor_id, address) -> raw unsigned value on the servo
+        self.shadow = {}
+        # Writes staged for the next flush(), (address, num_bytes) -> {motor_id: value}
+        self.dirty = {}
         self.connect()
 
     def connect(self):
-        if self.config.device_name == '':
-            for port_name in os.listdir('/dev'):
-                if 'ttyUSB' in port_name or 'ttyACM' in port_name:
-                    self.config.device_name = '/dev/' + port_name
-                    print(f'using device {self.config.device_name}')
-        self.portHandler = PortHandler(self.config.device_name)
+        if self.config.transport == 'virtual':
+            # Emulated servo chain, see robot/virtual_bus.py
+            from robot.virtual_bus import VirtualPortHandler
+            self.portHandler = VirtualPortHandler(self.config.device_name or 'virtual',
+                                                  **self.config.transport_options)
+        elif self.config.transport == 'serial':
+            if self.config.device_name == '':
+                for port_name in os.listdir('/dev'):
+                    if 'ttyUSB' in port_name or 'ttyACM' in port_name:
+                        self.config.device_name = '/dev/' + port_name
+                        print(f'using device {self.config.device_name}')
+            self.portHandler = PortHandler(self.config.device_name)
+        else:
+            raise Exception(f'unknown transport {self.config.transport}')
         # self.portHandler.LA
         self.packetHandler = PacketHandler(self.config.protocol_version)
         if not self.portHandler.openPort():
@@ -71,11 +100,24 @@ class Dynamixel:
 
         self.operating_modes = [None for _ in range(32)]
         self.torque_enabled = [None for _ in range(32)]
+        self.invalidate()
         return True
 
     def disconnect(self):
         self.portHandler.closePort()
 
+    def enable_instrumentation(self) -> BusStats:
+        """
+        starts counting packets, bytes, retries, failures and latencies of the transactions on this port
+        @return: the BusStats collecting the statistics
+        """
+        if self.stats is None:
+            self.stats = BusStats()
+        return self.stats
+
+    def disable_instrumentation(self):
+        self.stats = None
+
     def set_goal_position(self, motor_id, goal_position):
         # if self.operating_modes[motor_id] is not OperatingMode.POSITION:
         #     self._disable_torque(motor_id)
@@ -85,12 +127,11 @@ class Dynamixel:
         #     self._enable_torque(motor_id)
 
         # self._enable_torque(motor_id)
-        dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, motor_id,
-                                                                       self.ADDR_GOAL_POSITION, goal_position)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_GOAL_POSITION, 4, goal_position)
         # self._process_response(dxl_comm_result, dxl_error)
         # print(f'set position of motor {motor_id} to {goal_position}')
 
-    def set_pwm_value(self, motor_id: int, pwm_value, tries=3):
+    def set_pwm_value(self, motor_id: int, pwm_value):
         if self.operating_modes[motor_id] is not OperatingMode.PWM:
             self._disable_torque(motor_id)
             self.set_operating_mode(motor_id, OperatingMode.PWM)
@@ -98,19 +139,17 @@ class Dynamixel:
         if not self.torque_enabled[motor_id]:
             self._enable_torque(motor_id)
             # print(f'enabling torque')
-        dxl_comm_result, dxl_error = self.packetHandler.write2ByteTxRx(self.portHandler, motor_id,
-                                                                       self.ADDR_GOAL_PWM, pwm_value)
-        # self._process_response(dxl_comm_result, dxl_error)
         # print(f'set pwm of motor {motor_id} to {pwm_value}')
+        for attempt in self.config.retry_policy.attempts():
+            dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_GOAL_PWM, 2, pwm_value,
+                                                           retry=attempt > 0)
+            if dxl_comm_result == COMM_SUCCESS:
+                break
         if dxl_comm_result != COMM_SUCCESS:
-            if tries <= 1:
-                raise ConnectionError(f"dxl_comm_result: {self.packetHandler.getTxRxResult(dxl_comm_result)}")
-            else:
-                print(f'dynamixel pwm setting failure trying again with {tries - 1} tries')
-                self.set_pwm_value(motor_id, pwm_value, tries=tries - 1)
+            raise ConnectionError(f"dxl_comm_result: {self.packetHandler.getTxRxResult(dxl_comm_result)}")
         elif dxl_error != 0:
             print(f'dxl error {dxl_error}')
-            raise ConnectionError(f"dynamixel error: {self.packetHandler.getTxRxResult(dxl_error)}")
+            raise ConnectionError(f"dynamixel error: {self.packetHandler.getRxPacketError(dxl_error)}")
 
     def read_temperature(self, motor_id: int):
         return self._read_value(motor_id, ReadAttribute.TEMPERATURE, 1)
@@ -163,22 +202,17 @@ class Dynamixel:
             current_id = 254
         else:
             current_id = old_id
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler,
-                                                                       current_id, self.ADDR_ID, new_id)
+        dxl_comm_result, dxl_error = self._write_value(current_id, self.ADDR_ID, 1, new_id)
         self._process_response(dxl_comm_result, dxl_error, old_id)
         self.config.id = id
 
     def _enable_torque(self, motor_id):
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, motor_id,
-                                                                       self.ADDR_TORQUE_ENABLE, 1)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_TORQUE_ENABLE, 1, 1)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
-        self.torque_enabled[motor_id] = True
 
     def _disable_torque(self, motor_id):
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, motor_id,
-                                                                       self.ADDR_TORQUE_ENABLE, 0)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_TORQUE_ENABLE, 1, 0)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
-        self.torque_enabled[motor_id] = False
 
     def _process_response(self, dxl_comm_result: int, dxl_error: int, motor_id: int):
         if dxl_comm_result != COMM_SUCCESS:
@@ -190,36 +224,125 @@ class Dynamixel:
                 f"dynamixel error for motor {motor_id}: {self.packetHandler.getTxRxResult(dxl_error)}")
 
     def set_operating_mode(self, motor_id: int, operating_mode: OperatingMode):
-        dxl_comm_result, dxl_error = self.packetHandler.write2ByteTxRx(self.portHandler, motor_id,
-                                                                       self.OPERATING_MODE_ADDR, operating_mode.value)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.OPERATING_MODE_ADDR, 1, operating_mode.value)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
-        self.operating_modes[motor_id] = operating_mode
 
     def set_pwm_limit(self, motor_id: int, limit: int):
-        dxl_comm_result, dxl_error = self.packetHandler.write2ByteTxRx(self.portHandler, motor_id,
-                                                                       36, limit)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_PWM_LIMIT, 2, limit)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
 
     def set_velocity_limit(self, motor_id: int, velocity_limit):
-        dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, motor_id,
-                                                                       self.ADDR_VELOCITY_LIMIT, velocity_limit)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.ADDR_VELOCITY_LIMIT, 4, velocity_limit)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
     
     def set_profile_velocity(self, motor_id: int, velocity_limit):
-        dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, motor_id,
-                                                                       self.PROFILE_VELOCITY, velocity_limit)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.PROFILE_VELOCITY, 4, velocity_limit)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
 
     def set_P(self, motor_id: int, P: int):
-        dxl_comm_result, dxl_error = self.packetHandler.write2ByteTxRx(self.portHandler, motor_id,
-                                                                       self.POSITION_P, P)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.POSITION_P, 2, P)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
 
     def set_I(self, motor_id: int, I: int):
-        dxl_comm_result, dxl_error = self.packetHandler.write2ByteTxRx(self.portHandler, motor_id,
-                                                                       self.POSITION_I, I)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, self.POSITION_I, 2, I)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
 
+    def sync_write(self, address: int, num_bytes: int, values: dict):
+        """
+        writes the same register of several servos with a single sync write packet
+        @param address: control table address of the register
+        @param num_bytes: width of the register, 1, 2 or 4
+        @param values: dictionary mapping servo ids to the value to write
+        @return:
+        """
+        with self.lock:
+            values = {motor_id: value for motor_id, value in values.items()
+                      if not self._is_cached(motor_id, address, num_bytes, value)}
+            if not values:
+                return
+            writer = GroupSyncWrite(self.portHandler, self.packetHandler, address, num_bytes)
+            for motor_id, value in values.items():
+                value = int(value)
+                writer.addParam(motor_id, [(value >> (8 * i)) & 0xFF for i in range(num_bytes)])
+            start = time.perf_counter()
+            dxl_comm_result = writer.txPacket()
+            if self.stats is not None:
+                self.stats.record('sync_write', list(values), address, num_bytes, time.perf_counter() - start,
+                                  success=dxl_comm_result == COMM_SUCCESS)
+            for motor_id, value in values.items():
+                # A sync write has no status packet, so a failed one leaves the servos in an unknown state
+                self._remember(motor_id, address, num_bytes, value if dxl_comm_result == COMM_SUCCESS else None)
+        if dxl_comm_result != COMM_SUCCESS:
+            raise ConnectionError(
+                f"dxl_comm_result for sync write to address {address}: {self.packetHandler.getTxRxResult(dxl_comm_result)}")
+
+    def stage(self, address: int, num_bytes: int, values: dict):
+        """
+        queues writes of a register for the next flush(). Values the servos already hold are dropped
+        @param address: control table address of the register
+        @param num_bytes: width of the register, 1, 2 or 4
+        @param values: dictionary mapping servo ids to the value to write
+        """
+        with self.lock:
+            staged = self.dirty.setdefault((address, num_bytes), {})
+            for motor_id, value in values.items():
+                if self._is_cached(motor_id, address, num_bytes, value):
+                    staged.pop(motor_id, None)
+                else:
+                    staged[motor_id] = value
+            if not staged:
+                del self.dirty[(address, num_bytes)]
+
+    def flush(self):
+        """
+        writes the staged registers with one sync write per register, in the order they were first staged
+        @return: True if anything was written
+        """
+        with self.lock:
+            dirty, self.dirty = self.dirty, {}
+            for (address, num_bytes), values in dirty.items():
+                self.sync_write(address, num_bytes, values)
+        return bool(dirty)
+
+    def invalidate(self, motor_id: int = None):
+        """
+        forgets the shadowed register values, e.g. after a servo rebooted or was changed by another program. Called
+        on a hardware error status and on failed reads, since a servo that reset has lost its RAM registers
+        @param motor_id: servo to forget, all servos if None
+        """
+        with self.lock:
+            if motor_id is None:
+                self.shadow.clear()
+                self.torque_enabled = [None for _ in self.torque_enabled]
+            else:
+                for key in [key for key in self.shadow if key[0] == motor_id]:
+                    del self.shadow[key]
+                self.torque_enabled[motor_id] = None
+
+    def _is_cached(self, motor_id: int, address: int, num_bytes: int, value) -> bool:
+        if address not in self.CACHED_ADDRESSES:
+            return False
+        return self.shadow.get((motor_id, address)) == int(value) & ((1 << (8 * num_bytes)) - 1)
+
+    def _remember(self, motor_id: int, address: int, num_bytes: int, value):
+        """
+        updates the shadow after a register was written or read. value None marks it as unknown
+        """
+        if motor_id == BROADCAST_ID:
+            return
+        if value is not None:
+            value = int(value) & ((1 << (8 * num_bytes)) - 1)
+        if address == self.ADDR_TORQUE_ENABLE:
+            self.torque_enabled[motor_id] = None if value is None else bool(value)
+        elif address == self.OPERATING_MODE_ADDR:
+            self.operating_modes[motor_id] = None if value is None else OperatingMode(value)
+        if address not in self.CACHED_ADDRESSES:
+            return
+        if value is None:
+            self.shadow.pop((motor_id, address), None)
+        else:
+            self.shadow[(motor_id, address)] = value
+
     def read_home_offset(self, motor_id: int):
         self._disable_torque(motor_id)
         # dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, motor_id,
@@ -231,8 +354,7 @@ class Dynamixel:
 
     def set_home_offset(self, motor_id: int, home_position: int):
         self._disable_torque(motor_id)
-        dxl_comm_result, dxl_error = self.packetHandler.write4ByteTxRx(self.portHandler, motor_id,
-                                                                       ReadAttribute.HOMING_OFFSET.value, home_position)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, ReadAttribute.HOMING_OFFSET.value, 4, home_position)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
         self._enable_torque(motor_id)
 
@@ -252,44 +374,75 @@ class Dynamixel:
             raise Exception('baudrate not implemented')
 
         self._disable_torque(motor_id)
-        dxl_comm_result, dxl_error = self.packetHandler.write1ByteTxRx(self.portHandler, motor_id,
-                                                                       ReadAttribute.BAUDRATE.value, baudrate_id)
+        dxl_comm_result, dxl_error = self._write_value(motor_id, ReadAttribute.BAUDRATE.value, 1, baudrate_id)
         self._process_response(dxl_comm_result, dxl_error, motor_id)
 
-    def _read_value(self, motor_id, attribute: ReadAttribute, num_bytes: int, tries=10):
-        try:
-            if num_bytes == 1:
-                value, dxl_comm_result, dxl_error = self.packetHandler.read1ByteTxRx(self.portHandler,
-                                                                                     motor_id,
-                                                                                     attribute.value)
-            elif num_bytes == 2:
-                value, dxl_comm_result, dxl_error = self.packetHandler.read2ByteTxRx(self.portHandler,
-                                                                                     motor_id,
-                                                                                     attribute.value)
-            elif num_bytes == 4:
-                value, dxl_comm_result, dxl_error = self.packetHandler.read4ByteTxRx(self.portHandler,
-                                                                                     motor_id,
-                                                                                     attribute.value)
-        except Exception:
-            if tries == 0:
-                raise Exception
-            else:
-                return self._read_value(motor_id, attribute, num_bytes, tries=tries - 1)
-        if dxl_comm_result != COMM_SUCCESS:
-            if tries <= 1:
-                # print("%s" % self.packetHandler.getTxRxResult(dxl_comm_result))
-                raise ConnectionError(f'dxl_comm_result {dxl_comm_result} for servo {motor_id} value {value}')
-            else:
-                print(f'dynamixel read failure for servo {motor_id} trying again with {tries - 1} tries')
-                time.sleep(0.02)
-                return self._read_value(motor_id, attribute, num_bytes, tries=tries - 1)
-        elif dxl_error != 0:  # # print("%s" % self.packetHandler.getRxPacketError(dxl_error))
-            # raise ConnectionError(f'dxl_error {dxl_error} binary ' + "{0:b}".format(37))
-            if tries == 0 and dxl_error != 128:
-                raise Exception(f'Failed to read value from motor {motor_id} error is {dxl_error}')
-            else:
-                return self._read_value(motor_id, attribute, num_bytes, tries=tries - 1)
-        return value
+    def _write_value(self, motor_id, address: int, num_bytes: int, value, retry=False):
+        """
+        writes a register of a single servo and waits for its status packet. Writes of the value a servo already
+        holds in one of the CACHED_ADDRESSES are skipped
+        @param motor_id: id of the servo
+        @param address: control table address of the register
+        @param num_bytes: width of the register, 1, 2 or 4
+        @param value: value to write
+        @param retry: whether this write is a retry of a failed one, for the bus statistics
+        @return: dxl_comm_result, dxl_error
+        """
+        if num_bytes == 1:
+            write = self.packetHandler.write1ByteTxRx
+        elif num_bytes == 2:
+            write = self.packetHandler.write2ByteTxRx
+        else:
+            write = self.packetHandler.write4ByteTxRx
+        with self.lock:
+            if self._is_cached(motor_id, address, num_bytes, value):
+                return COMM_SUCCESS, 0
+            start = time.perf_counter()
+            dxl_comm_result, dxl_error = write(self.portHandler, motor_id, address, value)
+            success = dxl_comm_result == COMM_SUCCESS and dxl_error == 0
+            if self.stats is not None:
+                self.stats.record('write', [motor_id], address, num_bytes, time.perf_counter() - start,
+                                  success=success, retry=retry)
+            self._remember(motor_id, address, num_bytes, value if success else None)
+        return dxl_comm_result, dxl_error
+
+    def _read_value(self, motor_id, attribute: ReadAttribute, num_bytes: int):
+        """
+        reads a register of a single servo, retrying according to config.retry_policy
+        @raise BusReadError: if no attempt succeeded
+        """
+        if num_bytes == 1:
+            read = self.packetHandler.read1ByteTxRx
+        elif num_bytes == 2:
+            read = self.packetHandler.read2ByteTxRx
+        else:
+            read = self.packetHandler.read4ByteTxRx
+        dxl_comm_result, dxl_error = None, None
+        attempts = 0
+        for attempt in self.config.retry_policy.attempts():
+            attempts += 1
+            with self.lock:
+                start = time.perf_counter()
+                value, dxl_comm_result, dxl_error = read(self.portHandler, motor_id, attribute.value)
+                # The hardware alert bit (128) only flags a hardware error status, the value itself is valid
+                success = dxl_comm_result == COMM_SUCCESS and dxl_error & ~128 == 0
+                self._record_read(motor_id, attribute, num_bytes, start, success, attempt > 0)
+                if not success or dxl_error & 128:
+                    # The servo shut down on a hardware error, which switches off its torque, or it does not answer
+                    # and may be rebooting. Either way its registers can no longer be trusted
+                    self.invalidate(motor_id)
+                if success:
+                    self._remember(motor_id, attribute.value, num_bytes, value)
+                    return value
+        raise BusReadError(f'failed to read {attribute.name} of servo {motor_id} after {attempts} attempts, '
+                           f'dxl_comm_result {dxl_comm_result} dxl_error {dxl_error}',
+                           [motor_id], attribute.value, attempts, dxl_comm_result, dxl_error)
+
+    def _record_read(self, motor_id, attribute: ReadAttribute, num_bytes: int, start: float, success: bool,
+                     retry: bool):
+        if self.stats is not None:
+            self.stats.record('read', [motor_id], attribute.value, num_bytes, time.perf_counter() - start,
+                              success=success, retry=retry)
 
     def set_home_position(self, motor_id: int):
         print(f'setting home position for motor {motor_id}')
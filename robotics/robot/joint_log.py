@@ -0,0 +1,159 @@
+import os
+import time
+
+import numpy as np
+
+MAGIC = b'JLOG'
+VERSION = 1
+# File header, padded to 32 bytes. start_time is the time.time() of the first record.
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'),
+    ('version', '<u2'),
+    ('joints', '<u2'),
+    ('start_time', '<f8'),
+    ('reserved', 'V16'),
+])
+
+
+def record_dtype(joints):
+    """
+    Layout of one record: seconds since the first record, the leader joint positions and the goal positions sent to
+    the follower, in ticks.
+    :param joints: number of joints of the arms
+    """
+    return np.dtype([('time', '<f8'), ('leader', '<i2', (joints,)), ('follower', '<i2', (joints,))])
+
+
+class JointLogWriter:
+    """
+    Appends timestamped joint positions to a binary log of fixed-width records.
+
+    Records are packed into a preallocated chunk and written to the file a chunk at a time, so logging at the control
+    rate costs neither an allocation nor a system call per sample. A log cut short by a crash loses at most the last
+    chunk and can still be read.
+    """
+    def __init__(self, path, joints, chunk=256):
+        """
+        :param path: file to write, an existing file is overwritten
+        :param joints: number of joints of the arms
+        :param chunk: number of records buffered before they are written
+        """
+        self.path = path
+        self.joints = joints
+        self._file = open(path, 'wb')
+        self._buffer = np.zeros(chunk, dtype=record_dtype(joints))
+        self._size = 0
+        self._start = None
+        self.count = 0
+
+    def append(self, stamp, leader, follower):
+        """
+        :param stamp: time.perf_counter() time of the sample
+        :param leader: joint positions of the leader
+        :param follower: goal positions sent to the follower
+        """
+        if self._start is None:
+            self._start = stamp
+            self._write_header(time.time())
+        record = self._buffer[self._size]
+        record['time'] = stamp - self._start
+        record['leader'] = leader
+        record['follower'] = follower
+        self._size += 1
+        self.count += 1
+        if self._size == len(self._buffer):
+            self.flush()
+
+    def flush(self):
+        self._file.write(self._buffer[:self._size].tobytes())
+        self._file.flush()
+        self._size = 0
+
+    def close(self):
+        if self._file.closed:
+            return
+        if self._start is None:
+            self._write_header(time.time())
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _write_header(self, start_time):
+        header = np.zeros(1, dtype=HEADER_DTYPE)
+        header['magic'] = MAGIC
+        header['version'] = VERSION
+        header['joints'] = self.joints
+        header['start_time'] = start_time
+        self._file.write(header.tobytes())
+
+
+def read_joint_log(path):
+    """
+    Maps a joint log into memory without reading it.
+    :param path: file written by JointLogWriter
+    :return: header record and read-only numpy record array with fields time, leader and follower
+    """
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header['magic'][0] != MAGIC:
+        raise ValueError(f'{path} is not a joint log')
+    if header['version'][0] != VERSION:
+        raise ValueError(f'{path} has joint log version {header["version"][0]}, expected {VERSION}')
+    dtype = record_dtype(int(header['joints'][0]))
+    # Ignore a partial record at the end of a log that was cut short
+    count = (os.path.getsize(path) - HEADER_DTYPE.itemsize) // dtype.itemsize
+    if count == 0:
+        return header[0], np.zeros(0, dtype=dtype)
+    return header[0], np.memmap(path, dtype=dtype, mode='r', offset=HEADER_DTYPE.itemsize, shape=(count,))
+
+
+class JointLogPlayer:
+    """
+    Streams the positions of a joint log to a robot with Robot.set_goal_pos, following the recorded timestamps.
+
+    If sending falls behind, the records that are already due are skipped and only the newest is sent, so the motion
+    keeps its timing instead of lagging further and further behind.
+    """
+    def __init__(self, robot, path, speed=1.0, source='follower'):
+        """
+        :param robot: Robot or SimRobot to drive
+        :param path: file written by JointLogWriter
+        :param speed: playback speed, 2 replays the motion twice as fast
+        :param source: 'follower' to replay the goals the follower got, 'leader' to replay the leader positions
+        """
+        self.robot = robot
+        self.speed = speed
+        self.header, records = read_joint_log(path)
+        self.times = np.asarray(records['time'])
+        self.positions = records[source]
+        self.sent = 0
+        # A simulated robot brings its own clock, so the replay runs in simulated time
+        self.clock = getattr(robot, 'clock', time.perf_counter)
+        self.sleep = getattr(robot, 'sleep', time.sleep)
+
+    def play(self):
+        """
+        Moves the robot to the first recorded pose, then replays the log.
+        """
+        if len(self.times) == 0:
+            return
+        self.robot.set_and_wait_goal_pos(self.positions[0])
+        self.sent = 0
+        start = self.clock()
+        last = 0
+        while last < len(self.times) - 1:
+            now = (self.clock() - start) * self.speed
+            index = min(np.searchsorted(self.times, now, side='right') - 1, len(self.times) - 1)
+            if index > last:
+                self.robot.set_goal_pos(self.positions[index])
+                self.sent += 1
+                last = index
+            if last < len(self.times) - 1:
+                delay = (self.times[last + 1] - now) / self.speed
+                if delay > 0:
+                    self.sleep(delay)
+        self.robot.set_and_wait_goal_pos(self.positions[-1])
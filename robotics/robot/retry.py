@@ -0,0 +1,46 @@
+import time
+from dataclasses import dataclass
+
+
+class BusReadError(ConnectionError):
+    """
+    Raised when a read from the servos still fails after the retry policy gave up.
+    """
+    def __init__(self, message, servo_ids, address, attempts, comm_result=None, dxl_error=None):
+        super().__init__(message)
+        self.servo_ids = servo_ids
+        self.address = address
+        self.attempts = attempts
+        self.comm_result = comm_result
+        self.dxl_error = dxl_error
+
+
+@dataclass
+class RetryPolicy:
+    """
+    Bounds how long a bus transaction is retried.
+
+    Attempts are made until one succeeds, max_tries is used up or the next attempt would start after the deadline.
+    The wait between attempts starts at initial_backoff_us and doubles up to max_backoff_us, so a single corrupted
+    packet is retried almost immediately while a dead servo is given up on after about deadline_us.
+    """
+    max_tries: int = 5
+    deadline_us: int = 50000
+    initial_backoff_us: int = 200
+    max_backoff_us: int = 5000
+    backoff_factor: float = 2.0
+
+    def attempts(self):
+        """
+        Yields the index of each attempt, sleeping with exponential backoff in between. Stop iterating on success.
+        """
+        start = time.perf_counter()
+        deadline = start + self.deadline_us * 1e-6
+        backoff = self.initial_backoff_us * 1e-6
+        for attempt in range(self.max_tries):
+            if attempt > 0:
+                if time.perf_counter() + backoff > deadline:
+                    return
+                time.sleep(backoff)
+                backoff = min(backoff * self.backoff_factor, self.max_backoff_us * 1e-6)
+            yield attempt
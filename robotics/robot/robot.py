@@ -3,7 +3,10 @@ import numpy as np
 from typing import Union
 from enum import Enum, auto
 from robot.dynamixel import Dynamixel, OperatingMode, ReadAttribute
-from dynamixel_sdk import GroupSyncRead, GroupSyncWrite, DXL_LOBYTE, DXL_HIBYTE, DXL_LOWORD, DXL_HIWORD
+from robot.control_loop import ControlLoop
+from robot.bus_stats import BusStats
+from robot.retry import BusReadError
+from dynamixel_sdk import GroupSyncRead, COMM_SUCCESS
 
 class MotorControlType(Enum):
     PWM = auto()
@@ -11,6 +14,23 @@ class MotorControlType(Enum):
     DISABLED = auto()
     UNKNOWN = auto()
 
+# Layout of the contiguous present-value block of the control table, from
+# Present PWM (124) up to and including Present Temperature (146).
+STATE_DTYPE = np.dtype([
+    ('pwm', '<i2'),
+    ('current', '<i2'),
+    ('velocity', '<i4'),
+    ('position', '<i4'),
+    ('velocity_trajectory', '<i4'),
+    ('position_trajectory', '<i4'),
+    ('voltage', '<u2'),
+    ('temperature', 'u1'),
+])
+
+# Layout of the parameters of a goal position and a goal PWM sync write packet: servo id followed by the value
+GOAL_POSITION_DTYPE = np.dtype([('id', 'u1'), ('goal', '<i4')])
+GOAL_PWM_DTYPE = np.dtype([('id', 'u1'), ('goal', '<i2')])
+
 class Robot:
     def __init__(self, 
                  device_name: str, 
@@ -21,6 +41,8 @@ class Robot:
                  min_position_limit: Union[int, list, np.ndarray]=[1024, 1650, 1100, 600, 0, 2020],
                  position_p_gain: Union[int, list, np.ndarray]=[640, 640, 640, 400, 400, 400],
                  position_i_gain: Union[int, list, np.ndarray]=[10, 10, 10, 10, 10, 10],
+                 transport: str='serial',
+                 transport_options: dict=None,
                 ) -> None:
         self.servo_ids = servo_ids
         self.velocity_limit = self._int_to_list(velocity_limit, len(servo_ids))
@@ -30,8 +52,27 @@ class Robot:
         self.position_i_gain = self._int_to_list(position_i_gain, len(servo_ids))
         
         # Initialize motors
-        self.dynamixel = Dynamixel.Config(baudrate=baudrate, device_name=device_name).instantiate()
+        self.dynamixel = Dynamixel.Config(baudrate=baudrate,
+                                          device_name=device_name,
+                                          transport=transport,
+                                          transport_options=transport_options or {}).instantiate()
         self._init_motors()
+        self.control_loop = None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Creates a Robot from an arm section of config.json. Keys that are missing keep their default value.
+        Set "transport": "virtual" to run against an emulated servo chain instead of the serial port, or
+        "backend": "sim" to get a SimRobot that drives the MuJoCo model of the arm instead of a bus.
+        :param config: dictionary with device_name and optionally baudrate, servo_ids, limits, gains and transport
+        """
+        if config.get('backend', 'hardware') == 'sim':
+            from simulation.sim_robot import SimRobot
+            return SimRobot.from_config(config)
+        keys = ['baudrate', 'servo_ids', 'velocity_limit', 'max_position_limit', 'min_position_limit',
+                'position_p_gain', 'position_i_gain', 'transport', 'transport_options']
+        return cls(config['device_name'], **{key: config[key] for key in keys if key in config})
 
     def _int_to_list(self, val, length):
         if isinstance(val, int):
@@ -55,37 +96,37 @@ class Robot:
         for id in self.servo_ids:
             self.velocity_reader.addParam(id)
 
-        self.pos_writer = GroupSyncWrite(
+        self.state_reader = GroupSyncRead(
             self.dynamixel.portHandler,
             self.dynamixel.packetHandler,
-            self.dynamixel.ADDR_GOAL_POSITION,
-            4)
+            ReadAttribute.PWM.value,
+            STATE_DTYPE.itemsize)
         for id in self.servo_ids:
-            self.pos_writer.addParam(id, [2048])
+            self.state_reader.addParam(id)
 
-        self.pwm_writer = GroupSyncWrite(
-            self.dynamixel.portHandler,
-            self.dynamixel.packetHandler,
-            self.dynamixel.ADDR_GOAL_PWM,
-            2)
-        for id in self.servo_ids:
-            self.pwm_writer.addParam(id, [2048])
+        # Preallocated sync write parameters, the goals are packed into them in place through a structured view
+        self.pos_param = bytearray(len(self.servo_ids) * GOAL_POSITION_DTYPE.itemsize)
+        pos_records = np.frombuffer(self.pos_param, dtype=GOAL_POSITION_DTYPE)
+        pos_records['id'] = self.servo_ids
+        self.pos_goal = pos_records['goal']
+
+        self.pwm_param = bytearray(len(self.servo_ids) * GOAL_PWM_DTYPE.itemsize)
+        pwm_records = np.frombuffer(self.pwm_param, dtype=GOAL_PWM_DTYPE)
+        pwm_records['id'] = self.servo_ids
+        self.pwm_goal = pwm_records['goal']
         self._disable_torque()
 
         self.motor_control_state = MotorControlType.DISABLED
 
-    def read_position(self, tries=2):
+    def read_position(self):
         """
         Reads the joint positions of the robot. 2048 is the center position. 0 and 4096 are 180 degrees in each direction.
-        :param tries: maximum number of tries to read the position
         :return: list of joint positions in range [0, 4096]
+        :raise BusReadError: if the sync read still fails after the retry policy of the bus gave up
         """
-        result = self.position_reader.txRxPacket()
-        if result != 0:
-            if tries > 0:
-                return self.read_position(tries=tries - 1)
-            else:
-                print(f'failed to read position!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
+        return self._sync_read(self.position_reader, ReadAttribute.POSITION.value, 4, self._decode_position)
+
+    def _decode_position(self):
         positions = []
         for id in self.servo_ids:
             position = self.position_reader.getData(id, ReadAttribute.POSITION.value, 4)
@@ -94,32 +135,23 @@ class Robot:
             positions.append(position)
         return np.array(positions)
 
-    def read_position_dict(self, tries=2):
-            """
-            Reads the joint positions of the robot. 2048 is the center position. 0 and 4096 are 180 degrees in each direction.
-            :param tries: maximum number of tries to read the position
-            :return: list of joint positions in range [0, 4096]
-            """
-            result = self.position_reader.txRxPacket()
-            if result != 0:
-                if tries > 0:
-                    return self.read_position(tries=tries - 1)
-                else:
-                    print(f'failed to read position!!!!!!!!!!!!!!!!!!!!!!!!!!!!!')
-            positions = {}
-            for id in self.servo_ids:
-                position = self.position_reader.getData(id, ReadAttribute.POSITION.value, 4)
-                if position > 2 ** 31:
-                    position -= 2 ** 32
-                positions[id] = position
-            return positions
-    
+    def read_position_dict(self):
+        """
+        Reads the joint positions of the robot. 2048 is the center position. 0 and 4096 are 180 degrees in each direction.
+        :return: dictionary mapping servo id to joint position in range [0, 4096]
+        :raise BusReadError: if the sync read still fails after the retry policy of the bus gave up
+        """
+        return dict(zip(self.servo_ids, self.read_position().tolist()))
+
     def read_velocity(self):
         """
         Reads the joint velocities of the robot.
         :return: list of joint velocities,
+        :raise BusReadError: if the sync read still fails after the retry policy of the bus gave up
         """
-        self.velocity_reader.txRxPacket()
+        return self._sync_read(self.velocity_reader, ReadAttribute.VELOCITY.value, 4, self._decode_velocity)
+
+    def _decode_velocity(self):
         velocties = []
         for id in self.servo_ids:
             velocity = self.velocity_reader.getData(id, ReadAttribute.VELOCITY.value, 4)
@@ -128,25 +160,40 @@ class Robot:
             velocties.append(velocity)
         return np.array(velocties)
 
+    def read_state(self):
+        """
+        Reads PWM, current, velocity, position, voltage and temperature of every servo in a single sync read.
+        :return: numpy record array of dtype STATE_DTYPE with one record per servo, in servo_ids order
+        :raise BusReadError: if the sync read still fails after the retry policy of the bus gave up
+        """
+        return self._sync_read(self.state_reader, ReadAttribute.PWM.value, STATE_DTYPE.itemsize, self._decode_state)
+
+    def _decode_state(self):
+        data = []
+        for id in self.servo_ids:
+            data.extend(self.state_reader.data_dict[id])
+        return np.array(data, dtype=np.uint8).view(STATE_DTYPE)
+
     def set_goal_pos(self, action, servo_id=None):
         """
         :param action: list or numpy array of target joint positions in range [0, 4096]
         :param servo_id: servo id to set the goal position if controlling only one servo
         """
-        # Clip the action to the limits
-        action = np.clip(action, self.min_position_limit, self.max_position_limit)
-        if not self.motor_control_state is MotorControlType.POSITION_CONTROL:
-            self._set_position_control()
-        for i, motor_id in enumerate(self.servo_ids):
-            if servo_id is not None and servo_id != motor_id:
-                continue
-            data_write = [DXL_LOBYTE(DXL_LOWORD(action[i])),
-                          DXL_HIBYTE(DXL_LOWORD(action[i])),
-                          DXL_LOBYTE(DXL_HIWORD(action[i])),
-                          DXL_HIBYTE(DXL_HIWORD(action[i]))]
-            self.pos_writer.changeParam(motor_id, data_write)
-
-        self.pos_writer.txPacket()
+        with self.dynamixel.lock:
+            if not self.motor_control_state is MotorControlType.POSITION_CONTROL:
+                self._set_position_control()
+            # Clip the action to the limits and round it, straight into the sync write parameters
+            goal = np.rint(np.clip(action, self.min_position_limit, self.max_position_limit))
+            if servo_id is None:
+                self.pos_goal[:] = goal
+                param = self.pos_param
+            else:
+                # Only the one servo is written, the others keep the goals they were last sent
+                index = self.servo_ids.index(servo_id)
+                self.pos_goal[index] = goal[index]
+                i = index * GOAL_POSITION_DTYPE.itemsize
+                param = self.pos_param[i:i + GOAL_POSITION_DTYPE.itemsize]
+            self._send_goal(self.dynamixel.ADDR_GOAL_POSITION, 4, param)
     
     def set_and_wait_goal_pos(self, action, threshold=1, servo_id=None):
         """
@@ -155,6 +202,9 @@ class Robot:
         :param threshold: threshold for the velocity to consider the robot has reached the goal position
         :param servo_id: servo id to set the goal position if controlling only one servo
         """
+        if self.control_loop is not None:
+            self.control_loop.move_to(action, servo_id=servo_id, velocity_threshold=threshold).result()
+            return
         self.set_goal_pos(action, servo_id=servo_id)
         while True:
             time.sleep(0.1)
@@ -162,27 +212,45 @@ class Robot:
             if np.all(np.abs(vel) <= threshold):
                 break
 
+    def start_control_loop(self, rate_hz=200, **kwargs):
+        """
+        Starts a background control loop that owns the bus at a fixed rate. While it runs, set_and_wait_goal_pos
+        blocks on the loop's goal-reached future instead of polling the velocity.
+        :param rate_hz: loop rate in Hz
+        :param kwargs: goal-reached criterion, see ControlLoop
+        :return: the running ControlLoop
+        """
+        if self.control_loop is None:
+            self.control_loop = ControlLoop(self, rate_hz=rate_hz, **kwargs)
+            self.control_loop.start()
+        return self.control_loop
+
+    def stop_control_loop(self):
+        """
+        Stops the background control loop, if one is running.
+        """
+        if self.control_loop is not None:
+            self.control_loop.stop()
+            self.control_loop = None
+
     def set_pwm(self, action):
         """
         Sets the pwm values for the servos.
         :param action: list or numpy array of pwm values in range [0, 885]
         """
-        if not self.motor_control_state is MotorControlType.PWM:
-            self._set_pwm_control()
-        for i, motor_id in enumerate(self.servo_ids):
-            data_write = [DXL_LOBYTE(DXL_LOWORD(action[i])),
-                          DXL_HIBYTE(DXL_LOWORD(action[i])),
-                          ]
-            self.pwm_writer.changeParam(motor_id, data_write)
-
-        self.pwm_writer.txPacket()
+        with self.dynamixel.lock:
+            if not self.motor_control_state is MotorControlType.PWM:
+                self._set_pwm_control()
+            self.pwm_goal[:] = np.rint(action)
+            self._send_goal(self.dynamixel.ADDR_GOAL_PWM, 2, self.pwm_param)
 
     def set_trigger_torque(self):
         """
         Sets a constant torque torque for the last servo in the chain. This is useful for the trigger of the leader arm
         """
-        self.dynamixel._enable_torque(self.servo_ids[-1])
-        self.dynamixel.set_pwm_value(self.servo_ids[-1], 200)
+        with self.dynamixel.lock:
+            self.dynamixel._enable_torque(self.servo_ids[-1])
+            self.dynamixel.set_pwm_value(self.servo_ids[-1], 200)
 
     def limit_pwm(self, limit: Union[int, list, np.ndarray]):
         """
@@ -190,14 +258,7 @@ class Robot:
         @param limit: 0 ~ 885
         @return:
         """
-        if isinstance(limit, int):
-            limits = [limit, ] * len(self.servo_ids)
-        else:
-            limits = limit
-        self._disable_torque()
-        for motor_id, limit in zip(self.servo_ids, limits):
-            self.dynamixel.set_pwm_limit(motor_id, limit)
-        self._enable_torque()
+        self._write_eeprom(self.dynamixel.ADDR_PWM_LIMIT, 2, limit)
 
     def limit_velocity(self, limit: Union[int, list, np.ndarray]):
         """
@@ -205,42 +266,114 @@ class Robot:
         @param limit: 0 ~ 2047
         @return:
         """
-        if isinstance(limit, int):
-            limits = [limit, ] * len(self.servo_ids)
-        else:
-            limits = limit
-        self._disable_torque()
-        for motor_id, limit in zip(self.servo_ids, limits):
-            self.dynamixel.set_velocity_limit(motor_id, limit)
-        self._enable_torque()
+        self._write_eeprom(self.dynamixel.ADDR_VELOCITY_LIMIT, 4, limit)
+
+    def enable_instrumentation(self) -> BusStats:
+        """
+        Starts collecting packet, byte, retry, failure and latency statistics of the bus of the robot.
+        :return: the BusStats collecting the statistics, print its summary() or save it with to_json()
+        """
+        return self.dynamixel.enable_instrumentation()
+
+    def _record(self, kind: str, address: int, num_bytes: int, start: float, result: int, retry=False):
+        if self.dynamixel.stats is not None:
+            self.dynamixel.stats.record(kind, self.servo_ids, address, num_bytes, time.perf_counter() - start,
+                                        success=result == COMM_SUCCESS, retry=retry)
+
+    def _send_goal(self, address: int, num_bytes: int, param: bytearray):
+        """
+        Sends packed sync write parameters, without the per-servo bookkeeping of GroupSyncWrite.
+        :param param: servo id and little-endian value of each servo, num_bytes + 1 bytes per servo
+        """
+        start = time.perf_counter()
+        result = self.dynamixel.packetHandler.syncWriteTxOnly(self.dynamixel.portHandler, address, num_bytes,
+                                                              param, len(param))
+        self._record('sync_write', address, num_bytes, start, result)
+
+    def _sync_read(self, reader: GroupSyncRead, address: int, num_bytes: int, decode):
+        """
+        Runs a sync read, retrying according to the retry policy of the bus. The lock of the bus is held during each
+        attempt and the decoding of its data, not while backing off.
+        :param decode: function reading the received data out of the reader
+        :return: result of decode
+        """
+        result = None
+        attempts = 0
+        for attempt in self.dynamixel.config.retry_policy.attempts():
+            attempts += 1
+            with self.dynamixel.lock:
+                start = time.perf_counter()
+                result = reader.txRxPacket()
+                self._record('sync_read', address, num_bytes, start, result, attempt > 0)
+                if result == COMM_SUCCESS:
+                    return decode()
+                # A servo that does not answer may be rebooting, which resets its RAM registers
+                for motor_id in self.servo_ids:
+                    self.dynamixel.invalidate(motor_id)
+        raise BusReadError(f'failed to sync read address {address} of servos {self.servo_ids} after {attempts} '
+                           f'attempts, dxl_comm_result {result}', self.servo_ids, address, attempts, result)
+
+    def _sync_write(self, address: int, num_bytes: int, values: Union[int, list, np.ndarray]):
+        """
+        Writes one register of every servo in a single sync write packet.
+        :param address: control table address of the register
+        :param num_bytes: width of the register in bytes
+        :param values: value for all servos, or list of values in servo_ids order
+        """
+        values = self._int_to_list(values, len(self.servo_ids))
+        self.dynamixel.sync_write(address, num_bytes, dict(zip(self.servo_ids, values)))
+
+    def _stage(self, address: int, num_bytes: int, values: Union[int, list, np.ndarray]):
+        """
+        Queues a write of one register of every servo for the next dynamixel.flush().
+        :param values: value for all servos, or list of values in servo_ids order
+        """
+        values = self._int_to_list(values, len(self.servo_ids))
+        self.dynamixel.stage(address, num_bytes, dict(zip(self.servo_ids, values)))
+
+    def _write_eeprom(self, address: int, num_bytes: int, values: Union[int, list, np.ndarray]):
+        """
+        Writes a register in the EEPROM area, which requires the torque to be disabled. Nothing is written and the
+        torque is left alone if the servos already hold the values.
+        """
+        with self.dynamixel.lock:
+            self._stage(address, num_bytes, values)
+            if not self.dynamixel.dirty:
+                return
+            self._disable_torque()
+            self.dynamixel.flush()
+            self._enable_torque()
 
     def _disable_torque(self):
         print(f'disabling torque for servos {self.servo_ids}')
-        for motor_id in self.servo_ids:
-            self.dynamixel._disable_torque(motor_id)
+        self._sync_write(self.dynamixel.ADDR_TORQUE_ENABLE, 1, 0)
 
     def _enable_torque(self):
         print(f'enabling torque for servos {self.servo_ids}')
-        for motor_id in self.servo_ids:
-            self.dynamixel._enable_torque(motor_id)
+        self._sync_write(self.dynamixel.ADDR_TORQUE_ENABLE, 1, 1)
 
-    def _set_pwm_control(self):
+    def _set_operating_mode(self, operating_mode: OperatingMode):
+        """
+        Switches the operating mode of the servos that are not in it yet. The operating mode is in the EEPROM area,
+        so the torque is disabled first if any servo has to switch.
+        """
+        if all(self.dynamixel.operating_modes[motor_id] is operating_mode for motor_id in self.servo_ids):
+            return
         self._disable_torque()
-        for motor_id in self.servo_ids:
-            self.dynamixel.set_operating_mode(motor_id, OperatingMode.PWM)
+        self._sync_write(self.dynamixel.OPERATING_MODE_ADDR, 1, operating_mode.value)
+
+    def _set_pwm_control(self):
+        self._set_operating_mode(OperatingMode.PWM)
         self._enable_torque()
         self.motor_control_state = MotorControlType.PWM
 
     def _set_position_control(self):
-        self._disable_torque()
-        for motor_id in self.servo_ids:
-            self.dynamixel.set_operating_mode(motor_id, OperatingMode.POSITION)
+        self._set_operating_mode(OperatingMode.POSITION)
         # Set velocity limits
-        for motor_id, limit in zip(self.servo_ids, self.velocity_limit):
-            self.dynamixel.set_profile_velocity(motor_id, limit)
+        self._stage(self.dynamixel.PROFILE_VELOCITY, 4, self.velocity_limit)
         # Set PID gains
-        for motor_id, p_gain, i_gain in zip(self.servo_ids, self.position_p_gain, self.position_i_gain):
-            self.dynamixel.set_P(motor_id, p_gain)
-            self.dynamixel.set_I(motor_id, i_gain)
+        self._stage(self.dynamixel.POSITION_P, 2, self.position_p_gain)
+        self._stage(self.dynamixel.POSITION_I, 2, self.position_i_gain)
+        self.dynamixel.flush()
         self._enable_torque()
         self.motor_control_state = MotorControlType.POSITION_CONTROL
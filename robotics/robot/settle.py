@@ -0,0 +1,100 @@
+import time
+
+import numpy as np
+
+
+class SettleDetector:
+    """
+    Waits until the arm and, optionally, what the camera sees of it have come to rest.
+
+    The arm counts as still when every joint velocity is under a threshold and no joint position changed by more than
+    a tolerance since the previous sample (and, if a goal is given, every joint is within the tolerance of it). A
+    vision target, e.g. BoardVision.get_handle_info, only changes when the camera processed a new frame, so it is
+    sampled once per new frame: it counts as still when no value changed by more than its tolerance between the last
+    target_frames + 1 frames. Both must hold for the hold time, which replaces a fixed sleep by the time the physics
+    actually needs, with the timeout as an upper bound. A camera that stops delivering frames never settles.
+    """
+    def __init__(self, robot, velocity_threshold=1, position_tolerance=2, target_tolerance=5, hold_time=0.2,
+                 period=0.02, timeout=2.0, target_frames=3):
+        """
+        :param robot: Robot or SimRobot to watch
+        :param velocity_threshold: maximum per-joint velocity for the arm to count as still
+        :param position_tolerance: maximum per-joint position change between samples (and error to the goal), in ticks
+        :param target_tolerance: maximum change of each value of the vision target between samples
+        :param hold_time: seconds both signals must stay still
+        :param period: seconds between samples
+        :param timeout: seconds after which wait gives up
+        :param target_frames: number of consecutive new frames the vision target must stay still for
+        """
+        self.robot = robot
+        self.velocity_threshold = velocity_threshold
+        self.position_tolerance = position_tolerance
+        self.target_tolerance = target_tolerance
+        self.hold_time = hold_time
+        self.period = period
+        self.timeout = timeout
+        self.target_frames = target_frames
+        # A simulated robot brings its own clock, so settling happens in simulated time
+        self.clock = getattr(robot, 'clock', time.perf_counter)
+        self.sleep = getattr(robot, 'sleep', time.sleep)
+        # Seconds the last wait took
+        self.last_duration = None
+
+    def wait(self, goal=None, target=None, frame=None):
+        """
+        Blocks until the arm and the vision target are still, or the timeout has passed.
+        :param goal: joint positions the arm must be within the position tolerance of, None to only require it to be still
+        :param target: function returning a tuple of numbers to watch, e.g. the position and area of a detection
+        :param frame: function returning the sequence number of the frame the target was computed from, e.g.
+                      lambda: vision.frame_sequence. None if the target is computed anew on every call
+        :return: True if everything settled, False on timeout
+        """
+        start = self.clock()
+        still_since = None
+        last_position = None
+        last_target = None
+        last_frame = None
+        # Consecutive new frames in which the target did not move
+        still_frames = 0
+        while True:
+            now = self.clock()
+            position, velocity = self._read_arm()
+            still = np.all(np.abs(velocity) <= self.velocity_threshold)
+            if last_position is not None:
+                still &= np.all(np.abs(position - last_position) <= self.position_tolerance)
+            if goal is not None:
+                still &= np.all(np.abs(position - np.asarray(goal)) <= self.position_tolerance)
+            last_position = position
+
+            if target is not None:
+                sequence = frame() if frame is not None else None
+                if frame is None or sequence != last_frame:
+                    # Only a new frame tells anything new, repeated readings of the same frame are not evidence
+                    value = np.asarray(target(), dtype=float)
+                    if last_target is not None and np.all(np.abs(value - last_target) <= self.target_tolerance):
+                        still_frames += 1
+                    else:
+                        still_frames = 0
+                    last_target = value
+                    last_frame = sequence
+                still &= still_frames >= self.target_frames
+
+            if not still:
+                still_since = None
+            elif still_since is None:
+                still_since = now
+            if still_since is not None and now - still_since >= self.hold_time:
+                self.last_duration = now - start
+                return True
+            if now - start >= self.timeout:
+                self.last_duration = now - start
+                return False
+            self.sleep(self.period)
+
+    def _read_arm(self):
+        # A running control loop already samples the state every tick, reuse it instead of adding bus traffic
+        control_loop = getattr(self.robot, 'control_loop', None)
+        state = control_loop.state if control_loop is not None else None
+        if state is None:
+            state = self.robot.read_state()
+        return state['position'].astype(float), state['velocity'].astype(float)
@@ -0,0 +1,166 @@
+import threading
+import time
+
+import numpy as np
+
+from robot.bus_stats import LatencyHistogram
+from robot.channel import LatestValue
+
+
+class TeleopEngine:
+    """
+    Mirrors the joint positions of a leader arm onto a follower arm.
+
+    A reader thread samples the leader at a fixed rate on the leader's port while a writer thread sends each new
+    sample to the follower on the follower's port, so reading the next sample overlaps with writing the previous one.
+    The writer optionally smooths the signal with an exponential filter and ignores changes inside a deadband. Both
+    the achieved rates and the leader-to-follower latency (from the start of the leader read to the end of the
+    follower write) are measured. A recorder, e.g. a JointLogWriter, gets every leader sample with the goal sent to
+    the follower.
+    """
+    def __init__(self, leader, follower, rate_hz=200, alpha=1.0, deadband=0, recorder=None):
+        """
+        :param leader: Robot whose joint positions are read
+        :param follower: Robot the joint positions are sent to
+        :param rate_hz: target rate of the leader reads in Hz
+        :param alpha: weight of a new sample in the exponential filter, 1 disables the filter
+        :param deadband: per-joint change in ticks below which the follower goal is left unchanged. With a deadband
+                         no goal is sent while the leader stands still, 0 sends every sample
+        :param recorder: object with an append(stamp, leader, follower) method, called from the writer thread
+        """
+        self.leader = leader
+        self.follower = follower
+        self.period = 1.0 / rate_hz
+        self.alpha = alpha
+        self.deadband = deadband
+        self.recorder = recorder
+
+        # Newest leader sample and the goal last sent to the follower
+        self.leader_position = None
+        self.goal = None
+        self.error = None
+
+        self.latency = LatencyHistogram()
+        self.reads = 0
+        self.writes = 0
+        self._started_at = None
+        self._stopped_at = None
+
+        # Leader samples, stamped with the start time of their read
+        self._samples = LatestValue(len(leader.servo_ids))
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def start(self):
+        """
+        Starts the reader and writer threads.
+        """
+        if self._threads:
+            return
+        self._stop_event.clear()
+        self.error = None
+        self._samples = LatestValue(len(self.leader.servo_ids))
+        self.latency = LatencyHistogram()
+        self.reads = 0
+        self.writes = 0
+        self._started_at = time.perf_counter()
+        self._stopped_at = None
+        self._threads = [threading.Thread(target=self._read_leader, daemon=True),
+                         threading.Thread(target=self._write_follower, daemon=True)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the threads and reads the leader once more.
+        :return: the leader joint positions at the time of the stop
+        :raise BusReadError: if the final read of the leader fails
+        """
+        self._stop_event.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        self._stopped_at = time.perf_counter()
+        if self.error is not None:
+            raise self.error
+        # The reader may not have finished a read yet, e.g. right after the start. The port is free now, so read
+        # the leader directly instead of returning a sample that may be missing or old
+        self.leader_position = self.leader.read_position()
+        return self.leader_position
+
+    def is_running(self):
+        return bool(self._threads) and not self._stop_event.is_set()
+
+    def stats(self):
+        """
+        :return: dictionary with the achieved read and write rates in Hz and the latency statistics
+        """
+        end = self._stopped_at or time.perf_counter()
+        elapsed = end - self._started_at if self._started_at is not None else 0.0
+        return {
+            'read_hz': self.reads / elapsed if elapsed > 0 else 0.0,
+            'write_hz': self.writes / elapsed if elapsed > 0 else 0.0,
+            'latency': self.latency.to_dict(),
+        }
+
+    def summary(self):
+        """
+        :return: one line with the achieved rates and the leader-to-follower latency
+        """
+        stats = self.stats()
+        latency = stats['latency']
+        return (f'teleop: leader {stats["read_hz"]:.0f} Hz, follower {stats["write_hz"]:.0f} Hz, '
+                f'latency mean {latency["mean_us"] / 1000:.1f} ms, p99 {latency["p99_us"] / 1000:.1f} ms')
+
+    def _read_leader(self):
+        next_tick = time.perf_counter()
+        try:
+            while not self._stop_event.is_set():
+                start = time.perf_counter()
+                positions = self.leader.read_position()
+                self.reads += 1
+                self.leader_position = positions
+                self._samples.publish(positions, start)
+                next_tick += self.period
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    # Running behind, don't try to catch up with a burst of reads
+                    next_tick = time.perf_counter()
+        except Exception as e:
+            self._fail(e)
+
+    def _write_follower(self):
+        sequence = 0
+        positions = np.zeros(len(self.leader.servo_ids))
+        filtered = None
+        try:
+            while not self._stop_event.is_set():
+                # Wake up now and then to notice a stop while the leader is not being read
+                if not self._samples.wait(sequence, timeout=0.1):
+                    continue
+                sequence, start = self._samples.read(positions)
+
+                if filtered is None:
+                    filtered = positions.copy()
+                else:
+                    filtered = self.alpha * positions + (1 - self.alpha) * filtered
+                goal = np.rint(filtered).astype(int)
+                if self.deadband > 0 and self.goal is not None:
+                    goal = np.where(np.abs(goal - self.goal) > self.deadband, goal, self.goal)
+                    if np.array_equal(goal, self.goal):
+                        continue
+
+                self.follower.set_goal_pos(goal)
+                self.goal = goal
+                self.writes += 1
+                self.latency.add((time.perf_counter() - start) * 1e6)
+                if self.recorder is not None:
+                    self.recorder.append(start, positions, goal)
+        except Exception as e:
+            self._fail(e)
+
+    def _fail(self, error):
+        self.error = error
+        self._stop_event.set()
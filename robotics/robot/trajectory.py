@@ -0,0 +1,162 @@
+import time
+import numpy as np
+
+# One unit of the Profile Velocity register is 0.229 rev/min, expressed here in position ticks per second
+PROFILE_VELOCITY_UNIT = 0.229 * 4096 / 60
+# Joint speed (ticks per second) used for servos whose velocity limit is 0, which the servos treat as unlimited
+DEFAULT_MAX_VELOCITY = 1000
+# Seconds a joint takes to reach its velocity limit from rest, sets the acceleration of the blends
+ACCELERATION_TIME = 0.15
+# Poses where the arm has to stand still, because the claw has to finish closing or opening there. Picking, the claw
+# closes at the grasp pose. Placing, it lets go at the grasp pose and opens wide at the pre-grasp pose, and lifting
+# toward the hover pose before it has opened could drag the piece along
+PICK_STOP_POSES = ('grasp',)
+PLACE_STOP_POSES = ('grasp', 'pre-grasp')
+
+
+def pick_and_place_waypoints(positions, start, end, home_pos):
+    """
+    Builds the pose sequence of a pick-and-place move from the recorded positions.
+    :param positions: recorded positions, as loaded from actions.json
+    :param start: square to pick the piece from
+    :param end: square to place the piece on
+    :param home_pos: pose to return to at the end of the move
+    :return: list of waypoints and list of flags telling which waypoints are full stops
+    """
+    valid_poses = ['hover', 'pre-grasp', 'grasp', 'post-grasp']
+    sequence = [(start, pose) for pose in valid_poses] + [(end, pose) for pose in reversed(valid_poses)]
+
+    waypoints = [positions[square][pose] for square, pose in sequence] + [home_pos]
+    stops = ([pose in PICK_STOP_POSES for pose in valid_poses]
+             + [pose in PLACE_STOP_POSES for pose in reversed(valid_poses)] + [True])
+    return waypoints, stops
+
+
+class BlendedPath:
+    """
+    Moves through a sequence of joint positions on straight lines at the velocity limit, joined by parabolic blends,
+    starting and ending at rest (linear segments with parabolic blends).
+
+    Every segment runs at the highest speed that keeps each joint under its velocity limit. Around each intermediate
+    point the velocity changes from one segment to the next at the acceleration limit, centered on the time the
+    straight path would pass the point, so the arm rounds the corner instead of stopping there. The first and last
+    points are reached exactly.
+    """
+    def __init__(self, points, max_velocity, max_acceleration, min_segment_time=0.0):
+        """
+        :param points: list of joint positions to move through, at least two
+        :param max_velocity: per-joint speed limit in ticks per second
+        :param max_acceleration: per-joint acceleration limit in ticks per second squared
+        :param min_segment_time: shortest duration of a segment in seconds
+        """
+        self.points = [np.asarray(point, dtype=float) for point in points]
+        steps = [q1 - q0 for q0, q1 in zip(self.points[:-1], self.points[1:])]
+        durations = np.array([max(np.max(np.abs(step) / max_velocity), min_segment_time, 1e-9) for step in steps])
+        zero = np.zeros_like(self.points[0])
+        while True:
+            # Segment velocities, with the arm at rest before the first and after the last point
+            self.velocities = [zero] + [step / duration for step, duration in zip(steps, durations)] + [zero]
+            self.blends = np.array([np.max(np.abs(v1 - v0) / max_acceleration)
+                                    for v0, v1 in zip(self.velocities[:-1], self.velocities[1:])])
+            # A segment must be long enough to hold half of the blend at each of its ends, else it is slowed down
+            needed = (self.blends[:-1] + self.blends[1:]) / 2
+            if np.all(durations >= needed - 1e-9):
+                break
+            durations = np.maximum(durations, needed)
+        self.durations = durations
+        # The straight path passes the first point after half of the first blend
+        self.times = self.blends[0] / 2 + np.concatenate([[0.0], np.cumsum(durations)])
+        self.duration = self.times[-1] + self.blends[-1] / 2
+
+    def position(self, t):
+        """
+        :param t: seconds since the start of the path
+        :return: joint positions at time t
+        """
+        if t <= 0:
+            return self.points[0].copy()
+        if t >= self.duration:
+            return self.points[-1].copy()
+        # Point whose time is nearest, then either its blend or the straight part of the adjacent segment
+        k = int(np.clip(np.searchsorted(self.times, t), 1, len(self.times) - 1))
+        if t - self.times[k - 1] < self.times[k] - t:
+            k -= 1
+        dt = t - self.times[k]
+        v_in, v_out, blend = self.velocities[k], self.velocities[k + 1], self.blends[k]
+        if abs(dt) < blend / 2:
+            return self.points[k] + v_in * dt + (v_out - v_in) / (2 * blend) * (dt + blend / 2) ** 2
+        return self.points[k] + (v_out if dt > 0 else v_in) * dt
+
+
+class TrajectoryExecutor:
+    """
+    Streams a time-parameterized joint trajectory through a sequence of waypoints with Robot.set_goal_pos.
+
+    The waypoints between two stops form one BlendedPath, which runs every segment at the velocity limit and rounds
+    the intermediate waypoints at the acceleration limit. The arm only comes to a full stop at the waypoints flagged
+    as stops, where set_and_wait_goal_pos makes sure it has arrived before moving on.
+    """
+    def __init__(self, robot, rate_hz=100, max_velocity=None, max_acceleration=None, min_segment_time=0.05):
+        """
+        :param robot: Robot instance to drive
+        :param rate_hz: rate at which goal positions are streamed
+        :param max_velocity: per-joint speed limit in ticks per second, derived from robot.velocity_limit by default
+        :param max_acceleration: per-joint acceleration limit in ticks per second squared, by default the velocity
+                                 limit is reached in ACCELERATION_TIME seconds
+        :param min_segment_time: shortest duration of a segment in seconds
+        """
+        self.robot = robot
+        # A simulated robot brings its own clock, so the trajectory runs in simulated time
+        self.clock = getattr(robot, 'clock', time.perf_counter)
+        self.sleep = getattr(robot, 'sleep', time.sleep)
+        self.period = 1.0 / rate_hz
+        self.min_segment_time = min_segment_time
+        if max_velocity is None:
+            max_velocity = [v * PROFILE_VELOCITY_UNIT if v > 0 else DEFAULT_MAX_VELOCITY
+                            for v in robot.velocity_limit]
+        self.max_velocity = np.array(max_velocity, dtype=float)
+        if max_acceleration is None:
+            max_acceleration = self.max_velocity / ACCELERATION_TIME
+        self.max_acceleration = np.array(max_acceleration, dtype=float)
+
+    def plan(self, start, waypoints, stops):
+        """
+        Splits a trajectory into blended paths that each end at a stop.
+        :param start: current joint positions
+        :param waypoints: list of joint positions to move through
+        :param stops: list of flags, True where the arm must stop at the waypoint. The last waypoint always is a stop
+        :return: list of (path, waypoint) with the BlendedPath to each stop and the waypoint it stops at
+        """
+        points = [np.asarray(start, dtype=float)]
+        paths = []
+        for i, waypoint in enumerate(waypoints):
+            points.append(np.clip(np.asarray(waypoint, dtype=float),
+                                  self.robot.min_position_limit, self.robot.max_position_limit))
+            if stops[i] or i == len(waypoints) - 1:
+                path = BlendedPath(points, self.max_velocity, self.max_acceleration, self.min_segment_time)
+                paths.append((path, waypoint))
+                points = [points[-1]]
+        return paths
+
+    def execute(self, waypoints, stops=None):
+        """
+        Moves the arm through the waypoints.
+        :param waypoints: list of joint positions in range [0, 4096]
+        :param stops: list of flags, True where the arm must stop at the waypoint. Only the last waypoint by default
+        """
+        if stops is None:
+            stops = [False] * len(waypoints)
+
+        for path, waypoint in self.plan(self.robot.read_position(), waypoints, stops):
+            path_start = self.clock()
+            next_tick = path_start
+            while True:
+                t = self.clock() - path_start
+                self.robot.set_goal_pos(np.rint(path.position(t)).astype(int))
+                if t >= path.duration:
+                    break
+                next_tick += self.period
+                delay = next_tick - self.clock()
+                if delay > 0:
+                    self.sleep(delay)
+            self.robot.set_and_wait_goal_pos(waypoint)
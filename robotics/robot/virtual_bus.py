@@ -0,0 +1,274 @@
+import time
+from collections import deque
+from dynamixel_sdk import PortHandler, Protocol2PacketHandler
+from dynamixel_sdk.robotis_def import *
+
+# Control table addresses the virtual servos give a meaning to, on top of plain register storage
+ADDR_MODEL_NUMBER = 0
+ADDR_ID = 7
+ADDR_BAUDRATE = 8
+ADDR_OPERATING_MODE = 11
+ADDR_HOMING_OFFSET = 20
+ADDR_PWM_LIMIT = 36
+ADDR_VELOCITY_LIMIT = 44
+ADDR_MAX_POSITION_LIMIT = 48
+ADDR_MIN_POSITION_LIMIT = 52
+ADDR_TORQUE_ENABLE = 64
+ADDR_POSITION_I = 82
+ADDR_POSITION_P = 84
+ADDR_GOAL_PWM = 100
+ADDR_PROFILE_VELOCITY = 112
+ADDR_GOAL_POSITION = 116
+ADDR_PRESENT_PWM = 124
+ADDR_PRESENT_CURRENT = 126
+ADDR_PRESENT_VELOCITY = 128
+ADDR_PRESENT_POSITION = 132
+ADDR_PRESENT_VOLTAGE = 144
+ADDR_PRESENT_TEMPERATURE = 146
+CONTROL_TABLE_SIZE = 147
+# Registers below this address live in EEPROM and can only be written with torque disabled
+EEPROM_END = 64
+
+ERROR_DATA_RANGE = 4
+ERROR_ACCESS = 7
+
+# One unit of the velocity registers is 0.229 rev/min, expressed here in position ticks per second
+VELOCITY_UNIT = 0.229 * 4096 / 60
+
+# Register width of everything the virtual servos initialize, by address
+REGISTER_SIZES = {
+    ADDR_MODEL_NUMBER: 2, ADDR_ID: 1, ADDR_BAUDRATE: 1, ADDR_OPERATING_MODE: 1, ADDR_HOMING_OFFSET: 4,
+    ADDR_PWM_LIMIT: 2, ADDR_VELOCITY_LIMIT: 4, ADDR_MAX_POSITION_LIMIT: 4, ADDR_MIN_POSITION_LIMIT: 4,
+    ADDR_TORQUE_ENABLE: 1, ADDR_POSITION_I: 2, ADDR_POSITION_P: 2, ADDR_GOAL_PWM: 2, ADDR_PROFILE_VELOCITY: 4,
+    ADDR_GOAL_POSITION: 4, ADDR_PRESENT_PWM: 2, ADDR_PRESENT_CURRENT: 2, ADDR_PRESENT_VELOCITY: 4,
+    ADDR_PRESENT_POSITION: 4, ADDR_PRESENT_VOLTAGE: 2, ADDR_PRESENT_TEMPERATURE: 1,
+}
+
+
+class VirtualServo:
+    """
+    Control table of a single emulated XL330 servo, with a simple kinematic model: in position mode the present
+    position moves toward the goal position at the profile velocity, in PWM mode at a speed proportional to the
+    goal PWM.
+    """
+    def __init__(self, servo_id, model_number=1200, position=2048):
+        self.table = bytearray(CONTROL_TABLE_SIZE)
+        defaults = {
+            ADDR_MODEL_NUMBER: model_number, ADDR_ID: servo_id, ADDR_BAUDRATE: 3, ADDR_OPERATING_MODE: 3,
+            ADDR_PWM_LIMIT: 885, ADDR_VELOCITY_LIMIT: 2047, ADDR_MAX_POSITION_LIMIT: 4095,
+            ADDR_MIN_POSITION_LIMIT: 0, ADDR_POSITION_P: 400, ADDR_GOAL_POSITION: position,
+            ADDR_PRESENT_POSITION: position, ADDR_PRESENT_VOLTAGE: 50, ADDR_PRESENT_TEMPERATURE: 30,
+        }
+        for address, value in defaults.items():
+            self._set(address, value)
+        self.position = float(position)
+        self.last_update = time.perf_counter()
+
+    def _get(self, address, signed=True):
+        size = REGISTER_SIZES[address]
+        return int.from_bytes(self.table[address:address + size], 'little', signed=signed)
+
+    def _set(self, address, value):
+        size = REGISTER_SIZES[address]
+        self.table[address:address + size] = int(value).to_bytes(size, 'little', signed=value < 0)
+
+    def update(self, now):
+        """
+        Advances the kinematic model to time now and refreshes the present-value registers.
+        """
+        dt = now - self.last_update
+        self.last_update = max(now, self.last_update)
+        velocity = 0.0
+        pwm = 0
+        if self._get(ADDR_TORQUE_ENABLE) and dt > 0:
+            mode = self._get(ADDR_OPERATING_MODE)
+            max_speed = self._get(ADDR_VELOCITY_LIMIT) * VELOCITY_UNIT
+            if mode in (3, 4, 5):
+                goal = self._get(ADDR_GOAL_POSITION)
+                if mode == 3:
+                    goal = min(max(goal, self._get(ADDR_MIN_POSITION_LIMIT)), self._get(ADDR_MAX_POSITION_LIMIT))
+                profile_velocity = self._get(ADDR_PROFILE_VELOCITY)
+                speed = profile_velocity * VELOCITY_UNIT if profile_velocity > 0 else max_speed
+                step = min(max(goal - self.position, -speed * dt), speed * dt)
+                velocity = step / dt
+                pwm = self._get(ADDR_PWM_LIMIT) if step > 0 else -self._get(ADDR_PWM_LIMIT) if step < 0 else 0
+            elif mode == 16:
+                pwm = self._get(ADDR_GOAL_PWM)
+                velocity = max_speed * pwm / max(self._get(ADDR_PWM_LIMIT), 1)
+            self.position += velocity * dt
+        self._set(ADDR_PRESENT_POSITION, round(self.position))
+        self._set(ADDR_PRESENT_VELOCITY, round(velocity / VELOCITY_UNIT))
+        self._set(ADDR_PRESENT_PWM, pwm)
+
+    def read(self, address, length, now):
+        """
+        :return: status error and the register bytes
+        """
+        if address + length > CONTROL_TABLE_SIZE:
+            return ERROR_DATA_RANGE, b''
+        self.update(now)
+        return 0, bytes(self.table[address:address + length])
+
+    def write(self, address, data, now):
+        """
+        :return: status error
+        """
+        if address + len(data) > CONTROL_TABLE_SIZE:
+            return ERROR_DATA_RANGE
+        if address < EEPROM_END and self._get(ADDR_TORQUE_ENABLE):
+            return ERROR_ACCESS
+        self.update(now)
+        homing_offset = self._get(ADDR_HOMING_OFFSET)
+        self.table[address:address + len(data)] = data
+        # The present position is reported relative to the homing offset
+        self.position += self._get(ADDR_HOMING_OFFSET) - homing_offset
+        return 0
+
+
+class VirtualPortHandler(PortHandler):
+    """
+    Drop-in replacement for dynamixel_sdk.PortHandler that talks Protocol 2.0 to a chain of VirtualServo objects
+    instead of a serial port.
+
+    Instruction packets written to the port are decoded and answered by the addressed servos. Status packets only
+    become readable after the configured per-packet latency plus the time the bytes would take on the wire at the
+    port's baud rate, so the SDK's packet timeouts and the loop rates of the code above behave like on hardware.
+    """
+    def __init__(self, port_name='virtual', servo_ids=None, latency=0.0005, model_number=1200):
+        """
+        :param port_name: name reported by getPortName
+        :param servo_ids: ids of the servos on the chain. If None, a servo is created for every id that is addressed
+        :param latency: fixed delay in seconds between the end of an instruction packet and its status packet
+        :param model_number: model number reported by the servos
+        """
+        super().__init__(port_name)
+        self.latency = latency
+        self.model_number = model_number
+        self.auto_create = servo_ids is None
+        self.servos = {servo_id: VirtualServo(servo_id, model_number) for servo_id in (servo_ids or [])}
+        self.packets_tx = 0
+        self.packets_rx = 0
+        self.bytes_tx = 0
+        self.bytes_rx = 0
+        self._crc = Protocol2PacketHandler()
+        self._rx = deque()  # (ready time, status packet bytes)
+        self._rx_partial = b''
+        self._bus_free = 0.0
+
+    def openPort(self):
+        return self.setBaudRate(self.baudrate)
+
+    def closePort(self):
+        self.is_open = False
+
+    def clearPort(self):
+        pass
+
+    def setupPort(self, cflag_baud):
+        self.is_open = True
+        self._rx.clear()
+        self._rx_partial = b''
+        self.tx_time_per_byte = (1000.0 / self.baudrate) * 10.0
+        return True
+
+    def getBytesAvailable(self):
+        now = time.perf_counter()
+        return len(self._rx_partial) + sum(len(packet) for ready, packet in self._rx if ready <= now)
+
+    def readPort(self, length):
+        now = time.perf_counter()
+        while self._rx and self._rx[0][0] <= now and len(self._rx_partial) < length:
+            self._rx_partial += self._rx.popleft()[1]
+        data, self._rx_partial = self._rx_partial[:length], self._rx_partial[length:]
+        return data
+
+    def writePort(self, packet):
+        packet = bytes(packet)
+        self.packets_tx += 1
+        self.bytes_tx += len(packet)
+        # The instruction packet goes out once the bus is free and occupies it for its transmission time
+        now = max(time.perf_counter(), self._bus_free) + self._wire_time(len(packet))
+        self._bus_free = max(now, self._handle(packet, now))
+        return len(packet)
+
+    def _wire_time(self, num_bytes):
+        return num_bytes * 10.0 / self.baudrate
+
+    def _servo(self, servo_id):
+        if servo_id not in self.servos and self.auto_create and servo_id <= MAX_ID:
+            self.servos[servo_id] = VirtualServo(servo_id, self.model_number)
+        return self.servos.get(servo_id)
+
+    def _handle(self, packet, now):
+        """
+        Executes an instruction packet that finished transmitting at time now.
+        :return: time at which the last status packet has been transmitted
+        """
+        if len(packet) < 10 or packet[0:4] != b'\xff\xff\xfd\x00':
+            return now
+        length = DXL_MAKEWORD(packet[5], packet[6])
+        if len(packet) < 7 + length:
+            return now
+        crc = DXL_MAKEWORD(packet[5 + length], packet[6 + length])
+        if self._crc.updateCRC(0, list(packet), 5 + length) != crc:
+            return now
+        servo_id = packet[4]
+        instruction = packet[7]
+        params = _unstuff(packet[8:5 + length])
+
+        ready = now + self.latency
+        if instruction == INST_PING:
+            servo = self._servo(servo_id)
+            if servo is not None:
+                ready = self._respond(servo_id, 0, servo.table[0:2] + bytes([0]), ready)
+        elif instruction == INST_READ:
+            servo = self._servo(servo_id)
+            if servo is not None:
+                error, data = servo.read(DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3]), now)
+                ready = self._respond(servo_id, error, data, ready)
+        elif instruction == INST_WRITE and servo_id == BROADCAST_ID:
+            for servo in self.servos.values():
+                servo.write(DXL_MAKEWORD(params[0], params[1]), params[2:], now)
+        elif instruction == INST_WRITE:
+            servo = self._servo(servo_id)
+            if servo is not None:
+                error = servo.write(DXL_MAKEWORD(params[0], params[1]), params[2:], now)
+                ready = self._respond(servo_id, error, b'', ready)
+        elif instruction == INST_SYNC_READ:
+            address, data_length = DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3])
+            for sync_id in params[4:]:
+                servo = self._servo(sync_id)
+                if servo is not None:
+                    error, data = servo.read(address, data_length, now)
+                    ready = self._respond(sync_id, error, data, ready)
+        elif instruction == INST_SYNC_WRITE:
+            address, data_length = DXL_MAKEWORD(params[0], params[1]), DXL_MAKEWORD(params[2], params[3])
+            for i in range(4, len(params), data_length + 1):
+                servo = self._servo(params[i])
+                if servo is not None:
+                    servo.write(address, params[i + 1:i + 1 + data_length], now)
+        return ready
+
+    def _respond(self, servo_id, error, data, ready):
+        """
+        Queues a status packet that becomes readable once it has been transmitted after time ready.
+        :return: time at which the status packet has been fully transmitted
+        """
+        body = _stuff(bytes([INST_STATUS, error]) + bytes(data))
+        length = len(body) + 2
+        packet = bytes([0xFF, 0xFF, 0xFD, 0x00, servo_id, DXL_LOBYTE(length), DXL_HIBYTE(length)]) + body
+        crc = self._crc.updateCRC(0, list(packet), len(packet))
+        packet += bytes([DXL_LOBYTE(crc), DXL_HIBYTE(crc)])
+        ready += self._wire_time(len(packet))
+        self._rx.append((ready, packet))
+        self.packets_rx += 1
+        self.bytes_rx += len(packet)
+        return ready
+
+
+def _stuff(data):
+    return data.replace(b'\xff\xff\xfd', b'\xff\xff\xfd\xfd')
+
+
+def _unstuff(data):
+    return data.replace(b'\xff\xff\xfd\xfd', b'\xff\xff\xfd')
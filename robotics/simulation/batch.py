@@ -0,0 +1,121 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import mujoco
+import numpy as np
+
+from simulation.interface import END_EFFECTOR_GEOM
+
+SCENE_PATH = Path(__file__).resolve().parent / 'low_cost_robot_6dof' / 'scene.xml'
+
+
+class BatchSimulator:
+    """
+    Steps N independent copies of a MuJoCo model in parallel, for offline evaluation of many trajectories or gains.
+
+    All copies share one MjModel and each has its own MjData. The copies are split into one contiguous chunk per
+    worker thread; mj_step releases the GIL, so the chunks step in parallel. Results are written into preallocated
+    stacked arrays.
+    """
+    def __init__(self, m, n, workers=None, ee_geom=END_EFFECTOR_GEOM):
+        """
+        :param m: mujoco model
+        :param n: number of copies
+        :param workers: number of worker threads, the number of CPUs by default
+        :param ee_geom: name of the geom whose position is reported as the end effector position
+        """
+        self.m = m
+        self.n = n
+        self.datas = [mujoco.MjData(m) for _ in range(n)]
+        self.ee_geom_id = m.geom(ee_geom).id
+
+        workers = min(workers or os.cpu_count() or 1, n)
+        bounds = np.linspace(0, n, workers + 1).astype(int)
+        self._chunks = [range(start, end) for start, end in zip(bounds[:-1], bounds[1:])]
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+
+        self.qpos = np.zeros((n, m.nq))
+        self.qvel = np.zeros((n, m.nv))
+        self.ee_pos = np.zeros((n, 3))
+        self._ctrl = np.zeros((n, m.nu))
+        self._collect(range(n))
+
+    @classmethod
+    def from_xml(cls, n, path=SCENE_PATH, **kwargs):
+        """
+        :param n: number of copies
+        :param path: scene to load, the 6 dof robot scene by default
+        """
+        return cls(mujoco.MjModel.from_xml_path(str(path)), n, **kwargs)
+
+    def reset(self, qpos=None):
+        """
+        Resets all copies to the initial state of the model.
+        :param qpos: leading joint positions to start from, e.g. the 6 robot joints, shape (k,) for all copies or
+                     (N, k) per copy. The remaining joints, like the free joint of the piece, keep their initial value
+        """
+        if qpos is not None:
+            qpos = np.atleast_2d(qpos)
+            qpos = np.broadcast_to(qpos, (self.n, qpos.shape[1]))
+        for i, d in enumerate(self.datas):
+            mujoco.mj_resetData(self.m, d)
+            if qpos is not None:
+                d.qpos[:qpos.shape[1]] = qpos[i]
+                d.ctrl[:] = d.qpos[:self.m.nu]
+            mujoco.mj_forward(self.m, d)
+        self._collect(range(self.n))
+
+    def step(self, ctrl, nsteps=1):
+        """
+        Applies the controls and advances every copy.
+        :param ctrl: control array of shape (N, nu), or (nu,) for all copies
+        :param nsteps: number of physics steps to hold the controls for
+        :return: stacked qpos (N, nq), qvel (N, nv) and end effector positions (N, 3). The arrays are reused by the
+                 next call, copy them to keep them
+        """
+        self._ctrl[:] = ctrl
+        futures = [self._pool.submit(self._step_chunk, chunk, nsteps) for chunk in self._chunks]
+        for future in futures:
+            future.result()
+        return self.qpos, self.qvel, self.ee_pos
+
+    def rollout(self, ctrls, nsteps=1):
+        """
+        Runs a control sequence on every copy.
+        :param ctrls: control array of shape (T, N, nu) or (T, nu)
+        :param nsteps: number of physics steps each control is held for
+        :return: qpos (T, N, nq), qvel (T, N, nv) and end effector positions (T, N, 3) after each control
+        """
+        qpos = np.zeros((len(ctrls), self.n, self.m.nq))
+        qvel = np.zeros((len(ctrls), self.n, self.m.nv))
+        ee_pos = np.zeros((len(ctrls), self.n, 3))
+        for t, ctrl in enumerate(ctrls):
+            qpos[t], qvel[t], ee_pos[t] = self.step(ctrl, nsteps)
+        return qpos, qvel, ee_pos
+
+    def close(self):
+        self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _step_chunk(self, chunk, nsteps):
+        for i in chunk:
+            d = self.datas[i]
+            d.ctrl[:] = self._ctrl[i]
+            for _ in range(nsteps):
+                mujoco.mj_step(self.m, d)
+        self._collect(chunk)
+
+    def _collect(self, chunk):
+        for i in chunk:
+            d = self.datas[i]
+            # mj_step leaves the geom positions at the start of the step, bring them up to the new qpos
+            mujoco.mj_kinematics(self.m, d)
+            self.qpos[i] = d.qpos
+            self.qvel[i] = d.qvel
+            self.ee_pos[i] = d.geom_xpos[self.ee_geom_id]
@@ -0,0 +1,229 @@
+import sys, os
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import argparse
+import json
+import time
+from pathlib import Path
+
+import mujoco
+import numpy as np
+
+from simulation.interface import ARM_JOINTS, END_EFFECTOR_GEOM, SimulatedRobot, radians_to_ticks, ticks_to_radians
+
+ROBOTICS = Path(__file__).resolve().parents[1]
+SCENE_PATH = Path(__file__).resolve().parent / 'low_cost_robot_6dof' / 'scene.xml'
+GEOMETRY_PATH = ROBOTICS / 'board_geometry.json'
+TABLE_PATH = ROBOTICS / 'ik_table.npz'
+ACTIONS_PATH = ROBOTICS / 'actions.json'
+BOARD_SQUARES = [str(i) for i in range(9)]
+POSE_TYPES = ['hover', 'pre-grasp', 'grasp', 'post-grasp']
+# Index of the wrist roll among the arm joints, it turns the fingers about the gripper axis
+WRIST_ROLL = 4
+
+
+def square_position(geometry, square, pose_type):
+    """
+    Position of the end effector for a pose at a square, in the model frame.
+    :param geometry: board geometry, as loaded from board_geometry.json
+    :param square: board square '0' - '8' (row by row, starting at the row on the +y side of the board) or stash
+                   'A' - 'F'
+    :param pose_type: one of POSE_TYPES, selects the height above the board
+    :return: numpy array x, y, z in meters
+    """
+    if square in geometry['stash']:
+        offset = np.array(geometry['stash'][square], dtype=float)
+    else:
+        row, col = divmod(int(square), 3)
+        offset = np.array([col - 1, 1 - row], dtype=float) * geometry['square_size']
+    yaw = geometry['board_yaw']
+    rotation = np.array([[np.cos(yaw), -np.sin(yaw)], [np.sin(yaw), np.cos(yaw)]])
+    center = np.array(geometry['board_center'], dtype=float)
+    x, y = center[:2] + rotation @ offset
+    return np.array([x, y, center[2] + geometry['pose_heights'][pose_type]])
+
+
+def taught_seeds(m, taught):
+    """
+    Joint positions of the taught poses and where they put the end effector.
+    :param m: mujoco model
+    :param taught: taught poses in the layout of actions.json
+    :return: numpy array of shape (n, 3) of end effector positions in meters and numpy array of shape
+             (n, ARM_JOINTS) of joint positions in radians, of the poses of every square and pose type
+    """
+    d = mujoco.MjData(m)
+    geom_id = m.geom(END_EFFECTOR_GEOM).id
+    positions, seeds = [], []
+    for square in list('ABCDEF') + BOARD_SQUARES:
+        for pose_type in POSE_TYPES:
+            if pose_type not in taught.get(square, {}):
+                continue
+            d.qpos[:ARM_JOINTS] = ticks_to_radians(taught[square][pose_type][:ARM_JOINTS])
+            mujoco.mj_kinematics(m, d)
+            positions.append(d.geom_xpos[geom_id].copy())
+            seeds.append(d.qpos[:ARM_JOINTS].copy())
+    return np.array(positions).reshape(-1, 3), np.array(seeds).reshape(-1, ARM_JOINTS)
+
+
+class IKTable:
+    """
+    Joint positions of the arm for a regular grid of end effector positions above the board.
+
+    The table is generated offline with the inverse kinematics of the MuJoCo model and stored in a .npz file. A lookup
+    interpolates trilinearly between the 8 grid points around the requested position. The players do not load it,
+    they move through the taught poses of actions.json; the table is a check of those poses against the model.
+    """
+    def __init__(self, axes, ticks, converged, geometry):
+        """
+        :param axes: x, y and z grid coordinates in meters, in the model frame
+        :param ticks: float32 array of shape (nx, ny, nz, ARM_JOINTS) with the servo positions at each grid point
+        :param converged: bool array of shape (nx, ny, nz), False where the position is out of reach
+        :param geometry: board geometry the table was generated for
+        """
+        self.axes = [np.asarray(axis, dtype=float) for axis in axes]
+        self.ticks = ticks
+        self.converged = converged
+        self.geometry = geometry
+
+    @classmethod
+    def generate(cls, geometry, taught=None, m=None, tol=1e-4):
+        """
+        Solves the inverse kinematics for every grid point of the geometry, with the gripper pointing along the
+        gripper axis of the geometry and the wrist roll held at its wrist roll.
+
+        Every solve starts from the taught pose closest to the grid point, so the table stays on the branch of the
+        redundant arm the poses were taught on. If that start does not reach the grid point, the solution of an
+        adjacent grid point is tried next. Neither start falls back to random poses, which could end up on another
+        branch that cannot be interpolated with its neighbours.
+        :param geometry: board geometry, as loaded from board_geometry.json
+        :param taught: taught poses in the layout of actions.json, the arm starts from the zero pose without them
+        :param m: mujoco model, the 6 dof robot scene by default
+        :param tol: position tolerance of the solver in meters
+        """
+        if m is None:
+            m = mujoco.MjModel.from_xml_path(str(SCENE_PATH))
+        robot = SimulatedRobot(m, mujoco.MjData(m))
+        grid = geometry['grid']
+        center = np.array(geometry['board_center'], dtype=float)
+        axes = [center[i] + np.arange(low, high + grid['resolution'] / 2, grid['resolution'])
+                for i, (low, high) in enumerate((grid['x'], grid['y'], grid['z']))]
+        shape = tuple(len(axis) for axis in axes)
+        solutions = np.zeros(shape + (ARM_JOINTS,))
+        converged = np.zeros(shape, dtype=bool)
+
+        axis = geometry['gripper_axis']
+        roll = ticks_to_radians(np.full(ARM_JOINTS, geometry['wrist_roll']))[WRIST_ROLL]
+        seed_positions, seeds = taught_seeds(m, taught or {})
+        seeds[:, WRIST_ROLL] = roll
+        zero = np.zeros(ARM_JOINTS)
+        zero[WRIST_ROLL] = roll
+
+        for k in range(shape[2]):
+            for j in range(shape[1]):
+                for i in range(shape[0]):
+                    target = np.array([axes[0][i], axes[1][j], axes[2][k]])
+                    if len(seeds):
+                        starts = [seeds[np.argmin(np.linalg.norm(seed_positions - target, axis=1))]]
+                    else:
+                        starts = [zero]
+                    starts += [solutions[index] for index in ((i - 1, j, k), (i, j - 1, k), (i, j, k - 1))
+                               if min(index) >= 0 and converged[index]]
+                    for q_init in starts:
+                        solution = robot.solve_ik(target, q_init=q_init, ee_target_axis=axis, tol=tol, restarts=0,
+                                                  fixed_joints=[WRIST_ROLL])
+                        if not solution.converged and solution.reason != 'out of reach':
+                            # Pointing straight along the axis is out of reach, tilt as little as the tolerance allows
+                            solution = robot.solve_ik(target, q_init=solution.q, ee_target_axis=axis, tol=tol,
+                                                      axis_tol=geometry['gripper_axis_tolerance'], restarts=0,
+                                                      axis_weight=0.005, max_iter=200, fixed_joints=[WRIST_ROLL])
+                        solutions[i, j, k], converged[i, j, k] = solution.q, solution.converged
+                        if solution.converged:
+                            break
+        return cls(axes, radians_to_ticks(solutions).astype(np.float32), converged, geometry)
+
+    @classmethod
+    def load(cls, path=TABLE_PATH):
+        with np.load(path) as data:
+            return cls([data['x'], data['y'], data['z']], data['ticks'], data['converged'],
+                       json.loads(str(data['geometry'])))
+
+    def save(self, path=TABLE_PATH):
+        np.savez_compressed(path, x=self.axes[0], y=self.axes[1], z=self.axes[2], ticks=self.ticks,
+                            converged=self.converged, geometry=json.dumps(self.geometry))
+
+    def lookup(self, position):
+        """
+        :param position: end effector position x, y, z in meters, in the model frame
+        :return: numpy array of servo positions of the arm joints, interpolated trilinearly
+        """
+        lower = np.zeros(3, dtype=int)
+        weight = np.zeros(3)
+        for d, (axis, value) in enumerate(zip(self.axes, position)):
+            if not axis[0] <= value <= axis[-1]:
+                raise ValueError(f'position {position} is outside of the IK table')
+            lower[d] = min(np.searchsorted(axis, value, side='right') - 1, len(axis) - 2)
+            weight[d] = (value - axis[lower[d]]) / (axis[lower[d] + 1] - axis[lower[d]])
+
+        cell = (slice(lower[0], lower[0] + 2), slice(lower[1], lower[1] + 2), slice(lower[2], lower[2] + 2))
+        if not self.converged[cell].all():
+            raise ValueError(f'position {position} is out of reach of the arm')
+        # Weights of the 8 corners of the cell, shape (2, 2, 2)
+        wx, wy, wz = [np.array([1 - w, w]) for w in weight]
+        corner_weights = wx[:, None, None] * wy[None, :, None] * wz[None, None, :]
+        return np.tensordot(corner_weights, self.ticks[cell], axes=3)
+
+    def pose(self, square, pose_type):
+        """
+        :param square: board square '0' - '8' or stash 'A' - 'F'
+        :param pose_type: one of POSE_TYPES
+        :return: list of servo positions of all joints including the gripper, like the entries of actions.json
+        """
+        ticks = self.lookup(square_position(self.geometry, square, pose_type))
+        return [int(round(t)) for t in ticks] + [self.geometry['gripper'][pose_type]]
+
+    def poses(self):
+        """
+        :return: poses of every square in the layout of actions.json
+        """
+        squares = list(self.geometry['stash']) + BOARD_SQUARES
+        return {square: {pose_type: self.pose(square, pose_type) for pose_type in POSE_TYPES}
+                for square in squares}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Precompute the inverse kinematics of the board positions.')
+    parser.add_argument('--geometry', default=str(GEOMETRY_PATH), help='Board geometry file.')
+    parser.add_argument('--actions', default=str(ACTIONS_PATH),
+                        help='Taught poses, every solve starts from the closest one.')
+    parser.add_argument('--output', default=str(TABLE_PATH), help='IK table file to write.')
+    parser.add_argument('--export-actions', default=None,
+                        help='Also write the poses of all squares to this file, in the format of actions.json, and '
+                             'print how far they are from the taught poses. For comparison, not a replacement of '
+                             'the taught poses.')
+    args = parser.parse_args()
+
+    with open(args.geometry) as f:
+        geometry = json.load(f)
+    taught = {}
+    if Path(args.actions).exists():
+        with open(args.actions) as f:
+            taught = json.load(f)
+    start = time.perf_counter()
+    table = IKTable.generate(geometry, taught)
+    print(f'solved {table.converged.size} grid points in {time.perf_counter() - start:.1f} s, '
+          f'{np.count_nonzero(~table.converged)} out of reach')
+    table.save(args.output)
+    if args.export_actions is not None:
+        poses = table.poses()
+        with open(args.export_actions, 'w') as f:
+            json.dump(poses, f, indent=4)
+        for square, square_poses in poses.items():
+            for pose_type, pose in square_poses.items():
+                if pose_type in taught.get(square, {}):
+                    difference = np.array(pose) - taught[square][pose_type]
+                    print(f'{square} {pose_type}: {pose}, taught {taught[square][pose_type]}, '
+                          f'largest difference {np.abs(difference).max()} ticks')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,42 @@
+from collections import namedtuple
+
 import mujoco
 import numpy as np
 
+# The model has no end effector body, the pad of the static finger of the gripper stands in for it
+END_EFFECTOR_GEOM = 'static_finger_pad'
+# Direction the gripper points in, in the frame of the end effector geom (along the forearm, past the fingers)
+GRIPPER_AXIS = np.array([0.0, 1.0, 0.0])
+# Number of arm joints that position the end effector, the sixth joint is the gripper
+ARM_JOINTS = 5
+# Per-joint sign mapping from the servo positions of the hardware to the MuJoCo model joints.
+# Joint 3 is kept positive so elbow direction matches the real robot.
+JOINT_SIGNS = np.array([1, -1, 1, 1, -1, -1], dtype=float)
+
+
+def ticks_to_radians(ticks: np.ndarray) -> np.ndarray:
+    """
+    :param ticks: numpy array of servo positions in range [0, 4096], for the first len(ticks) joints
+    :return: numpy array of model joint positions in range [-pi, pi]
+    """
+    ticks = np.asarray(ticks, dtype=float)
+    return (ticks / 2048 - 1) * 3.14 * JOINT_SIGNS[:ticks.shape[-1]]
+
+
+def radians_to_ticks(q: np.ndarray) -> np.ndarray:
+    """
+    :param q: numpy array of model joint positions in range [-pi, pi], for the first len(q) joints
+    :return: numpy array of servo positions in range [0, 4096]
+    """
+    q = np.asarray(q, dtype=float)
+    return (q * JOINT_SIGNS[:q.shape[-1]] / 3.14 + 1) * 2048
+
+
+# Result of SimulatedRobot.solve_ik. reason is 'converged', or why the best attempt failed: 'out of reach' (the arm
+# is stretched toward the target), 'joint limit' (a joint is stuck at its limit), 'max iterations' (the error was
+# still shrinking) or 'local minimum' (the error stopped shrinking elsewhere)
+IKSolution = namedtuple('IKSolution', ['q', 'converged', 'error', 'reason'])
+
 
 class SimulatedRobot:
     def __init__(self, m, d) -> None:
@@ -10,6 +46,9 @@ class SimulatedRobot:
         """
         self.m = m
         self.d = d
+        # Scratch data for inverse kinematics, so solving never disturbs the simulation
+        self._ik_data = None
+        self._ik_solution = None
 
     def _pos2pwm(self, pos: np.ndarray) -> np.ndarray:
         """
@@ -78,5 +117,133 @@ class SimulatedRobot:
         q_target_pos = qpos + qdot * 0.2
         return q_target_pos
 
+    def solve_ik(self, ee_target_pos, q_init=None, ee_target_axis=None, tol=1e-4, axis_tol=1e-3, max_iter=100,
+                 restarts=8, damping=3e-3, max_step=0.5, axis_weight=0.05, fixed_joints=(), ee_geom=END_EFFECTOR_GEOM):
+        """
+        Damped least-squares inverse kinematics of the arm joints for an end effector position and, optionally, the
+        direction the gripper points in.
+
+        Iterates on a scratch copy of the data with forward kinematics only. Each iteration computes the jacobian of
+        the position (and of the gripper axis) from the joint axes, takes a damped least-squares step and clamps the
+        joints to their range. The solver starts from q_init, else from the previous solution (fast for nearby
+        targets). If that start does not converge it tries the zero pose and then random poses, always the same ones.
+        :param ee_target_pos: numpy array of the target end effector position in meters
+        :param q_init: numpy array of joint positions in radians to start from
+        :param ee_target_axis: unit vector the gripper axis (GRIPPER_AXIS) should point along, e.g. [0, 0, -1] for a
+                               gripper pointing down. None to only solve for the position
+        :param tol: position error in meters at which the solution is accepted
+        :param axis_tol: error of the gripper axis (length of the difference of the unit vectors, about the angle in
+                         radians) at which the solution is accepted
+        :param max_iter: maximum number of iterations per start
+        :param restarts: number of random starts tried after the given start and the zero pose
+        :param damping: damping factor, trades convergence speed for stability near singularities
+        :param max_step: maximum change of a joint per iteration in radians
+        :param axis_weight: meters of position error one unit of axis error counts as
+        :param fixed_joints: indices of joints held at their start position, e.g. [4] to keep the wrist roll
+        :param ee_geom: name of the geom standing in for the end effector
+        :return: IKSolution with the joint positions of the arm joints in radians, whether the solver converged, the
+                 remaining position error in meters and the reason it did not converge
+        """
+        if self._ik_data is None:
+            self._ik_data = mujoco.MjData(self.m)
+        self._ik_data.qpos[:] = self.d.qpos
+
+        if q_init is None:
+            q_init = self._ik_solution if self._ik_solution is not None else self.d.qpos[:ARM_JOINTS]
+        q_init = np.array(q_init, dtype=float)
+        target = np.asarray(ee_target_pos, dtype=float)
+        target_axis = None if ee_target_axis is None else np.asarray(ee_target_axis, dtype=float)
+        active = np.ones(ARM_JOINTS, dtype=bool)
+        active[list(fixed_joints)] = False
+        lower, upper = self._joint_range()
+
+        geom_id = self.m.geom(ee_geom).id
+        distance, reach = self._reach(target, geom_id)
+        if distance > reach:
+            # Beyond the stretched arm, no start can get there
+            return IKSolution(q_init, False, float(distance - reach), 'out of reach')
+
+        # Random starts keep the fixed joints where q_init has them
+        rng = np.random.default_rng(0)
+        starts = [q_init, np.where(active, 0.0, q_init)]
+        for _ in range(restarts):
+            starts.append(np.where(active, rng.uniform(np.maximum(lower, -np.pi), np.minimum(upper, np.pi)), q_init))
+        best = None
+        for start in starts:
+            solution = self._ik_iterate(start, target, target_axis, tol, axis_tol, max_iter, damping, max_step,
+                                        axis_weight, active, geom_id)
+            if best is None or solution.converged or solution.error < best.error and not best.converged:
+                best = solution
+            if solution.converged:
+                break
+
+        self._ik_solution = best.q
+        return best
+
+    def _reach(self, target, geom_id):
+        """
+        :return: distance of the target from the shoulder (the anchor of the first joint after the base rotation) and
+                 the length of the stretched arm from there, which no joint configuration exceeds
+        """
+        mujoco.mj_kinematics(self.m, self._ik_data)
+        anchors = self._ik_data.xanchor[1:ARM_JOINTS]
+        points = np.vstack([anchors, self._ik_data.geom_xpos[geom_id]])
+        reach = np.sum(np.linalg.norm(np.diff(points, axis=0), axis=1))
+        return np.linalg.norm(target - anchors[0]), reach
+
+    def _joint_range(self):
+        joints = np.arange(ARM_JOINTS)
+        limited = self.m.jnt_limited[joints].astype(bool)
+        return (np.where(limited, self.m.jnt_range[joints, 0], -np.inf),
+                np.where(limited, self.m.jnt_range[joints, 1], np.inf))
+
+    def _ik_iterate(self, q, target, target_axis, tol, axis_tol, max_iter, damping, max_step, axis_weight, active,
+                    geom_id):
+        m, data = self.m, self._ik_data
+        joints = np.arange(ARM_JOINTS)
+        lower, upper = self._joint_range()
+        rows = 3 if target_axis is None else 6
+        damping_matrix = damping ** 2 * np.eye(rows)
+        jac = np.zeros((rows, ARM_JOINTS))
+        residual = np.zeros(rows)
+        errors = []
+
+        for i in range(max_iter + 1):
+            data.qpos[:ARM_JOINTS] = q
+            mujoco.mj_kinematics(m, data)
+            ee_pos = data.geom_xpos[geom_id]
+            residual[:3] = target - ee_pos
+            error = np.linalg.norm(residual[:3])
+            axis_error = 0.0
+            # Position jacobian of the hinge joints: axis x (point - anchor)
+            jac[:3] = np.cross(data.xaxis[joints], ee_pos - data.xanchor[joints]).T
+            if target_axis is not None:
+                # The gripper axis turns with every joint: d axis / dq = joint axis x gripper axis
+                axis = data.geom_xmat[geom_id].reshape(3, 3) @ GRIPPER_AXIS
+                residual[3:] = axis_weight * (target_axis - axis)
+                axis_error = np.linalg.norm(target_axis - axis)
+                jac[3:] = axis_weight * np.cross(data.xaxis[joints], axis).T
+            jac[:, ~active] = 0
+            errors.append(error + axis_weight * axis_error)
+            if error < tol and axis_error < axis_tol:
+                return IKSolution(q, True, float(error), 'converged')
+            if i == max_iter:
+                break
+            dq = jac.T @ np.linalg.solve(jac @ jac.T + damping_matrix, residual)
+            q = np.clip(q + np.clip(dq, -max_step, max_step), lower, upper)
+
+        # Why the last iterate is still off
+        at_limit = active & ((q <= lower + 1e-6) | (q >= upper - 1e-6))
+        singular = np.linalg.svd(jac[:3, active], compute_uv=False)[-1] < 1e-3
+        if np.any(at_limit):
+            reason = 'joint limit'
+        elif singular:
+            reason = 'out of reach'
+        elif errors[-1] < 0.9 * errors[-min(10, len(errors))]:
+            reason = 'max iterations'
+        else:
+            reason = 'local minimum'
+        return IKSolution(q, False, float(error), reason)
+
     def set_target_pos(self, target_pos):
         self.d.ctrl = target_pos
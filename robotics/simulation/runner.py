@@ -0,0 +1,100 @@
+import math
+import time
+
+import mujoco
+
+
+class SimRunner:
+    """
+    Steps a MuJoCo simulation against the wall clock and renders it at a capped display rate.
+
+    Physics steps run in batches: each iteration computes how far the simulation is behind the wall clock (scaled by
+    the target real-time factor) and catches up with as many steps as needed, then syncs the viewer if a frame is due.
+    Rendering therefore no longer slows the physics down, and the simulation does not drift from real time. Without a
+    viewer the runner is headless.
+    """
+    def __init__(self, m, d, viewer=None, display_hz=60, realtime_factor=1.0, max_lag=0.1):
+        """
+        :param m: mujoco model
+        :param d: mujoco data
+        :param viewer: passive viewer from mujoco.viewer.launch_passive, None to run headless
+        :param display_hz: maximum rate of viewer syncs
+        :param realtime_factor: target simulated seconds per wall-clock second, None to step as fast as possible
+        :param max_lag: if the simulation falls further behind than this many wall-clock seconds, it skips ahead
+                        instead of trying to catch up with a long burst of steps
+        """
+        self.m = m
+        self.d = d
+        self.viewer = viewer
+        self.display_period = 1.0 / display_hz
+        self.realtime_factor = realtime_factor
+        self.max_lag = max_lag
+
+        self.steps = 0
+        self.frames = 0
+        self._wall_start = None
+        self._sim_start = None
+
+    def achieved_realtime_factor(self):
+        """
+        :return: simulated seconds per wall-clock second since the runner started
+        """
+        if self._wall_start is None:
+            return 0.0
+        elapsed = time.perf_counter() - self._wall_start
+        return (self.d.time - self._sim_start) / elapsed if elapsed > 0 else 0.0
+
+    def run(self, control=None, duration=None, on_frame=None):
+        """
+        Runs the simulation until the viewer is closed or the duration has passed.
+        :param control: function called with the mujoco data before every physics step, e.g. to set d.ctrl
+        :param duration: wall-clock seconds to run for, None to run until the viewer is closed
+        :param on_frame: function called with the runner after every viewer sync, or every display period headless
+        """
+        timestep = self.m.opt.timestep
+        self._wall_start = time.perf_counter()
+        self._sim_start = self.d.time
+        # Wall-clock time and simulation time that are in sync
+        wall_ref, sim_ref = self._wall_start, self.d.time
+        next_frame = self._wall_start
+
+        while self.viewer is None or self.viewer.is_running():
+            now = time.perf_counter()
+            if duration is not None and now - self._wall_start >= duration:
+                break
+
+            if self.realtime_factor is None:
+                # As fast as possible, one display period worth of wall-clock time per batch
+                batch_end = now + self.display_period
+                while time.perf_counter() < batch_end:
+                    self._step(control)
+            else:
+                behind = sim_ref + (now - wall_ref) * self.realtime_factor - self.d.time
+                if behind > self.max_lag * self.realtime_factor:
+                    # Too slow to keep up, restart the clock from here
+                    wall_ref, sim_ref = now, self.d.time
+                    behind = 0.0
+                for _ in range(math.ceil(behind / timestep)):
+                    self._step(control)
+
+            now = time.perf_counter()
+            if now >= next_frame:
+                if self.viewer is not None:
+                    self.viewer.sync()
+                self.frames += 1
+                if on_frame is not None:
+                    on_frame(self)
+                next_frame = max(next_frame + self.display_period, now)
+
+            if self.realtime_factor is not None:
+                # Sleep until the next physics step or frame is due
+                next_step = wall_ref + (self.d.time + timestep - sim_ref) / self.realtime_factor
+                delay = min(next_step, next_frame) - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+    def _step(self, control):
+        if control is not None:
+            control(self.d)
+        mujoco.mj_step(self.m, self.d)
+        self.steps += 1
@@ -0,0 +1,252 @@
+import threading
+import time
+from pathlib import Path
+from typing import Union
+
+import mujoco
+import numpy as np
+
+from robot.robot import STATE_DTYPE
+from robot.trajectory import PROFILE_VELOCITY_UNIT
+from simulation.interface import radians_to_ticks, ticks_to_radians, JOINT_SIGNS
+
+SCENE_PATH = Path(__file__).resolve().parent / 'low_cost_robot_6dof' / 'scene.xml'
+# Joint position offset in radians that a goal PWM of 885 (the PWM limit) commands in the position actuators
+PWM_OFFSET = 0.5
+# Radians per second of one velocity unit of the servos (0.229 rev/min)
+VELOCITY_UNIT = PROFILE_VELOCITY_UNIT / 2048 * 3.14
+
+
+class SimRobot:
+    """
+    Drop-in replacement for Robot that drives the MuJoCo model of the arm instead of the servos.
+
+    Goal positions are converted to joint angles and tracked by the position actuators of the model, ramped at the
+    velocity limit like the servo profile velocity. The simulation only advances in sleep() and the waiting calls, in
+    simulated time, so code that waits through the robot (set_and_wait_goal_pos, TrajectoryExecutor) runs as fast as
+    the physics steps unless a real-time factor is set.
+    """
+    def __init__(self,
+                 device_name: str='sim',
+                 servo_ids: list=[1, 2, 3, 4, 5, 6],
+                 velocity_limit: Union[int, list, np.ndarray]=0,
+                 max_position_limit: Union[int, list, np.ndarray]=[3072, 2800, 3000, 3500, 4096, 2800],
+                 min_position_limit: Union[int, list, np.ndarray]=[1024, 1650, 1100, 600, 0, 2020],
+                 scene_path: str=SCENE_PATH,
+                 realtime_factor: float=None,
+                 settle_timeout: float=5.0,
+                 **kwargs,
+                ) -> None:
+        """
+        Takes the arguments of Robot, the ones that only concern the bus (baudrate, gains, transport) are ignored.
+        :param scene_path: MuJoCo scene of the arm
+        :param realtime_factor: simulated seconds per wall-clock second, None to step as fast as possible
+        :param settle_timeout: simulated seconds set_and_wait_goal_pos waits for the arm to stand still
+        """
+        self.servo_ids = servo_ids
+        self.velocity_limit = self._int_to_list(velocity_limit, len(servo_ids))
+        self.max_position_limit = self._int_to_list(max_position_limit, len(servo_ids))
+        self.min_position_limit = self._int_to_list(min_position_limit, len(servo_ids))
+        self.pwm_limit = [885] * len(servo_ids)
+        self.realtime_factor = realtime_factor
+        self.settle_timeout = settle_timeout
+
+        self.m = mujoco.MjModel.from_xml_path(str(scene_path))
+        self.d = mujoco.MjData(self.m)
+        mujoco.mj_forward(self.m, self.d)
+        self.n = len(servo_ids)
+        self.timestep = self.m.opt.timestep
+
+        # Goal of the servos and the profile-limited position currently commanded on the way to it, both in ticks
+        self.goal = radians_to_ticks(self.d.qpos[:self.n])
+        self.ctrl_ticks = self.goal.copy()
+        self.pwm_goal = None
+        self.torque_enabled = False
+        self.lock = threading.RLock()
+        # Wall-clock time and simulation time that are in sync, for pacing at the real-time factor
+        self._wall_ref = None
+        self._sim_ref = None
+        self.control_loop = None
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Creates a SimRobot from an arm section of config.json, see Robot.from_config.
+        :param config: dictionary with optionally servo_ids, limits, scene_path, realtime_factor and settle_timeout
+        """
+        keys = ['servo_ids', 'velocity_limit', 'max_position_limit', 'min_position_limit', 'scene_path',
+                'realtime_factor', 'settle_timeout']
+        return cls(config.get('device_name', 'sim'), **{key: config[key] for key in keys if key in config})
+
+    def _int_to_list(self, val, length):
+        if isinstance(val, int):
+            return [val] * length
+        return val
+
+    def clock(self):
+        """
+        :return: simulated time in seconds, the counterpart of time.perf_counter()
+        """
+        return self.d.time
+
+    def sleep(self, seconds):
+        """
+        Advances the simulation, the counterpart of time.sleep().
+        :param seconds: simulated time to step for
+        """
+        with self.lock:
+            for _ in range(max(int(round(seconds / self.timestep)), 1)):
+                self._step()
+        self._pace()
+
+    def read_position(self):
+        """
+        Reads the joint positions of the robot. 2048 is the center position. 0 and 4096 are 180 degrees in each direction.
+        :return: list of joint positions in range [0, 4096]
+        """
+        with self.lock:
+            return np.rint(radians_to_ticks(self.d.qpos[:self.n])).astype(int)
+
+    def read_position_dict(self):
+        """
+        Reads the joint positions of the robot. 2048 is the center position. 0 and 4096 are 180 degrees in each direction.
+        :return: dictionary mapping servo id to joint position in range [0, 4096]
+        """
+        return dict(zip(self.servo_ids, self.read_position().tolist()))
+
+    def read_velocity(self):
+        """
+        Reads the joint velocities of the robot.
+        :return: list of joint velocities in units of 0.229 rev/min
+        """
+        with self.lock:
+            return np.rint(self.d.qvel[:self.n] * JOINT_SIGNS[:self.n] / VELOCITY_UNIT).astype(int)
+
+    def read_state(self):
+        """
+        Reads PWM, velocity and position of every servo. Current, voltage and temperature are nominal values.
+        :return: numpy record array of dtype STATE_DTYPE with one record per servo, in servo_ids order
+        """
+        with self.lock:
+            state = np.zeros(self.n, dtype=STATE_DTYPE)
+            q = self.d.qpos[:self.n]
+            state['position'] = np.rint(radians_to_ticks(q))
+            state['velocity'] = np.rint(self.d.qvel[:self.n] * JOINT_SIGNS[:self.n] / VELOCITY_UNIT)
+            state['position_trajectory'] = np.rint(self.ctrl_ticks)
+            state['pwm'] = np.clip((self.d.ctrl[:self.n] - q) * JOINT_SIGNS[:self.n] / PWM_OFFSET * 885, -885, 885)
+            state['voltage'] = 120
+            state['temperature'] = 30
+            return state
+
+    def set_goal_pos(self, action, servo_id=None):
+        """
+        :param action: list or numpy array of target joint positions in range [0, 4096]
+        :param servo_id: servo id to set the goal position if controlling only one servo
+        """
+        with self.lock:
+            if servo_id is None:
+                self.goal[:] = np.clip(action, self.min_position_limit, self.max_position_limit)
+            else:
+                index = self.servo_ids.index(servo_id)
+                self.goal[index] = np.clip(action[index], self.min_position_limit[index],
+                                           self.max_position_limit[index])
+            if self.pwm_goal is not None or not self.torque_enabled:
+                # Switching to position control, start the profile from where the arm is
+                self.ctrl_ticks[:] = radians_to_ticks(self.d.qpos[:self.n])
+            self.pwm_goal = None
+            self.torque_enabled = True
+
+    def set_and_wait_goal_pos(self, action, threshold=1, servo_id=None):
+        """
+        Sets the goal position and steps the simulation until the robot reaches the goal position.
+        :param action: list or numpy array of target joint positions in range [0, 4096]
+        :param threshold: threshold for the velocity to consider the robot has reached the goal position
+        :param servo_id: servo id to set the goal position if controlling only one servo
+        """
+        self.set_goal_pos(action, servo_id=servo_id)
+        deadline = self.clock() + self.settle_timeout
+        while self.clock() < deadline:
+            self.sleep(0.01)
+            if np.allclose(self.ctrl_ticks, self.goal, atol=0.5) and np.all(np.abs(self.read_velocity()) <= threshold):
+                break
+
+    def start_control_loop(self, rate_hz=200, **kwargs):
+        """
+        The simulation has no bus to own, set_and_wait_goal_pos steps it directly.
+        """
+        return None
+
+    def stop_control_loop(self):
+        pass
+
+    def set_pwm(self, action):
+        """
+        Sets the pwm values for the servos. The model only has position actuators, so a PWM is approximated by a
+        position target offset from the current joint position, proportionally to the PWM.
+        :param action: list or numpy array of pwm values in range [0, 885]
+        """
+        with self.lock:
+            self.pwm_goal = np.clip(np.asarray(action, dtype=float), -np.asarray(self.pwm_limit),
+                                    self.pwm_limit)
+            self.torque_enabled = True
+
+    def set_trigger_torque(self):
+        """
+        The trigger torque only matters for a leader arm, which is never simulated.
+        """
+        pass
+
+    def limit_pwm(self, limit: Union[int, list, np.ndarray]):
+        """
+        Limits the pwm values for the servos in for position control
+        @param limit: 0 ~ 885
+        @return:
+        """
+        self.pwm_limit = self._int_to_list(limit, self.n)
+
+    def limit_velocity(self, limit: Union[int, list, np.ndarray]):
+        """
+        Limits the velocity values for the servos in for velocity control
+        @param limit: 0 ~ 2047
+        @return:
+        """
+        self.velocity_limit = self._int_to_list(limit, self.n)
+
+    def _disable_torque(self):
+        with self.lock:
+            self.torque_enabled = False
+            self.pwm_goal = None
+
+    def _enable_torque(self):
+        with self.lock:
+            if not self.torque_enabled:
+                self.goal[:] = radians_to_ticks(self.d.qpos[:self.n])
+                self.ctrl_ticks[:] = self.goal
+                self.torque_enabled = True
+
+    def _step(self):
+        q = self.d.qpos[:self.n]
+        if not self.torque_enabled:
+            # Limp joints, the actuators follow whatever the arm does
+            self.d.ctrl[:self.n] = q
+        elif self.pwm_goal is not None:
+            self.d.ctrl[:self.n] = q + self.pwm_goal / 885 * PWM_OFFSET * JOINT_SIGNS[:self.n]
+        else:
+            # Profile velocity: move the commanded position towards the goal at most at the velocity limit
+            max_delta = np.array(self.velocity_limit, dtype=float) * PROFILE_VELOCITY_UNIT * self.timestep
+            delta = self.goal - self.ctrl_ticks
+            self.ctrl_ticks += np.where(max_delta > 0, np.clip(delta, -max_delta, max_delta), delta)
+            self.d.ctrl[:self.n] = ticks_to_radians(self.ctrl_ticks)
+        mujoco.mj_step(self.m, self.d)
+
+    def _pace(self):
+        if self.realtime_factor is None:
+            return
+        now = time.perf_counter()
+        if self._wall_ref is None or now - self._wall_ref > (self.d.time - self._sim_ref) / self.realtime_factor + 0.1:
+            # First step, or too far behind to catch up: restart the clock from here
+            self._wall_ref, self._sim_ref = now, self.d.time
+            return
+        delay = self._wall_ref + (self.d.time - self._sim_ref) / self.realtime_factor - now
+        if delay > 0:
+            time.sleep(delay)
@@ -1,4 +1,5 @@
 from pathlib import Path
+import argparse
 import sys
 import threading
 import time
@@ -13,21 +14,58 @@ if str(ROOT) not in sys.path:
 if str(ROBOTICS) not in sys.path:
     sys.path.insert(0, str(ROBOTICS))
 
+from robot.channel import LatestValue
 from robot.robot import Robot
-from simulation.interface import SimulatedRobot
+from simulation.interface import SimulatedRobot, ticks_to_radians
+from simulation.runner import SimRunner
 
-# Per-joint sign mapping from leader hardware to MuJoCo model joints.
-# Joint 3 is kept positive so elbow direction matches the real robot.
-JOINT_SIGNS = np.array([1, -1, 1, 1, -1, -1], dtype=float)
+# Rate at which the leader is read, the bus can't deliver much more and the sim doesn't need more
+LEADER_RATE_HZ = 200
+# Interval at which the staleness of the consumed leader samples is printed
+REPORT_INTERVAL = 5.0
 
 
 def read_leader_position():
-    global target_pos
+    period = 1.0 / LEADER_RATE_HZ
+    next_tick = time.perf_counter()
     while True:
-        target_pos = np.array(leader.read_position())
-        target_pos = (target_pos / 2048 - 1) * 3.14
-        target_pos = target_pos * JOINT_SIGNS
+        start = time.perf_counter()
+        leader_channel.publish(ticks_to_radians(leader.read_position()), start)
 
+        next_tick += period
+        delay = next_tick - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            next_tick = time.perf_counter()
+
+
+def consume_leader_sample(d):
+    # Use the latest leader sample, and keep the previous target until the first one arrives.
+    sequence, stamp = leader_channel.read(target_pos)
+    if sequence:
+        staleness.append(time.perf_counter() - stamp)
+    r.set_target_pos(target_pos)
+
+
+def report(runner):
+    global last_report
+    if staleness and time.perf_counter() - last_report >= REPORT_INTERVAL:
+        print(f'leader sample age: mean {np.mean(staleness) * 1000:.1f} ms, '
+              f'max {np.max(staleness) * 1000:.1f} ms, {leader_channel.sequence} samples, '
+              f'real-time factor {runner.achieved_realtime_factor():.2f}')
+        staleness.clear()
+        last_report = time.perf_counter()
+
+
+parser = argparse.ArgumentParser(description='Teleoperate the simulated robot with the leader arm.')
+parser.add_argument('--headless', action='store_true', default=False,
+                    help='Run the simulation without the viewer.')
+parser.add_argument('--display-hz', type=float, default=60,
+                    help='Maximum rate at which the viewer is redrawn.')
+parser.add_argument('--realtime-factor', type=float, default=1.0,
+                    help='Simulated seconds per wall-clock second, 0 to simulate as fast as possible.')
+args = parser.parse_args()
 
 leader = Robot('/dev/ttyACM0', servo_ids=[1, 2, 3, 4, 5, 6])
 
@@ -37,23 +75,22 @@ d = mujoco.MjData(m)
 
 r = SimulatedRobot(m, d)
 
+# Newest leader joint angles, handed from the leader thread to the sim loop
+leader_channel = LatestValue(6)
 target_pos = np.zeros(6)
 
 # Start the thread for reading leader position.
 leader_thread = threading.Thread(target=read_leader_position, daemon=True)
 leader_thread.start()
 
-with mujoco.viewer.launch_passive(m, d) as viewer:
-    while viewer.is_running():
-        # Use the latest target_pos.
-        step_start = time.time()
-        target_pos_local = target_pos.copy()
-
-        r.set_target_pos(target_pos_local)
-        mujoco.mj_step(m, d)
-        viewer.sync()
+staleness = []
+last_report = time.perf_counter()
 
-        # Rudimentary time keeping, will drift relative to wall clock.
-        time_until_next_step = m.opt.timestep - (time.time() - step_start)
-        if time_until_next_step > 0:
-            time.sleep(time_until_next_step)
\ No newline at end of file
+# Physics runs in real time, the viewer is only redrawn at the display rate.
+if args.headless:
+    SimRunner(m, d, realtime_factor=args.realtime_factor or None,
+              display_hz=args.display_hz).run(control=consume_leader_sample, on_frame=report)
+else:
+    with mujoco.viewer.launch_passive(m, d) as viewer:
+        SimRunner(m, d, viewer=viewer, realtime_factor=args.realtime_factor or None,
+                  display_hz=args.display_hz).run(control=consume_leader_sample, on_frame=report)
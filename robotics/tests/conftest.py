@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+# The robotics scripts import their modules relative to the robotics directory, e.g. `from robot.robot import Robot`
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+SERVO_IDS = [1, 2, 3]
+
+
+class PacketLog:
+    """
+    Records the instruction packets written to a port: (servo id, instruction, unstuffed parameters).
+    """
+    def __init__(self, port):
+        from robot.virtual_bus import _unstuff
+
+        self.packets = []
+        write = port.writePort
+
+        def write_port(packet):
+            packet = bytes(packet)
+            length = packet[5] | packet[6] << 8
+            self.packets.append((packet[4], packet[7], _unstuff(packet[8:5 + length])))
+            return write(packet)
+
+        port.writePort = write_port
+
+    def clear(self):
+        self.packets.clear()
+
+    def writes(self, address=None):
+        """
+        :return: (instruction, servo id, address, data) of the write and sync write packets, to address if given
+        """
+        from dynamixel_sdk import INST_SYNC_WRITE, INST_WRITE
+
+        writes = []
+        for servo_id, instruction, params in self.packets:
+            if instruction not in (INST_WRITE, INST_SYNC_WRITE):
+                continue
+            write_address = params[0] | params[1] << 8
+            if address is None or write_address == address:
+                data = params[2:] if instruction == INST_WRITE else params[4:]
+                writes.append((instruction, servo_id, write_address, data))
+        return writes
+
+
+@pytest.fixture
+def virtual_robot():
+    """
+    Robot with three servos on an emulated bus.
+    """
+    from robot.robot import Robot
+
+    robot = Robot('virtual', servo_ids=SERVO_IDS, max_position_limit=[4095] * 3, min_position_limit=[0] * 3,
+                  position_p_gain=[640] * 3, position_i_gain=[10] * 3, transport='virtual',
+                  transport_options={'servo_ids': SERVO_IDS, 'latency': 0.0001})
+    yield robot
+    robot.dynamixel.disconnect()
+
+
+@pytest.fixture
+def packets(virtual_robot):
+    return PacketLog(virtual_robot.dynamixel.portHandler)
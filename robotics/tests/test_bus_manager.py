@@ -0,0 +1,62 @@
+import threading
+
+import numpy as np
+import pytest
+
+from robot.bus_manager import BusManager
+from robot.robot import Robot
+from conftest import SERVO_IDS
+
+
+def virtual_robot():
+    return Robot('virtual', servo_ids=SERVO_IDS, max_position_limit=[4095] * 3, min_position_limit=[0] * 3,
+                 position_p_gain=[640] * 3, position_i_gain=[10] * 3, transport='virtual',
+                 transport_options={'servo_ids': SERVO_IDS, 'latency': 0.0001})
+
+
+@pytest.fixture
+def bus():
+    bus = BusManager({'arm1': virtual_robot(), 'arm2': virtual_robot()})
+    yield bus
+    bus.close()
+    for robot in bus.robots.values():
+        robot.dynamixel.disconnect()
+
+
+def test_coordinated_goals_and_reads(bus):
+    bus.set_goal_pos({'arm1': [1000, 2000, 3000], 'arm2': [3000, 2000, 1000]})
+    np.testing.assert_array_equal(bus.robots['arm1'].pos_goal, [1000, 2000, 3000])
+    np.testing.assert_array_equal(bus.robots['arm2'].pos_goal, [3000, 2000, 1000])
+    positions = bus.read_position()
+    assert set(positions) == {'arm1', 'arm2'}
+
+
+def test_each_port_has_its_own_thread(bus):
+    # Both jobs have to run at the same time to get past the barrier
+    barrier = threading.Barrier(2, timeout=1)
+    names = bus.map(lambda robot: (barrier.wait(), threading.current_thread().name)[1])
+    assert names == {'arm1': 'bus-arm1', 'arm2': 'bus-arm2'}
+
+
+def test_job_errors_reach_the_caller(bus):
+    with pytest.raises(ZeroDivisionError):
+        bus.submit('arm1', lambda: 1 / 0).result()
+    # The port thread keeps running
+    assert bus.submit('arm1', lambda: 1).result() == 1
+
+
+def test_closed_bus_refuses_jobs(bus):
+    bus.close()
+    with pytest.raises(RuntimeError):
+        bus.submit('arm1', lambda: None)
+
+
+def test_robot_with_a_control_loop_is_refused():
+    robot = virtual_robot()
+    robot.start_control_loop()
+    try:
+        with pytest.raises(ValueError, match='control loop'):
+            BusManager({'arm1': robot})
+    finally:
+        robot.stop_control_loop()
+        robot.dynamixel.disconnect()
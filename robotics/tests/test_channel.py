@@ -0,0 +1,75 @@
+import threading
+
+import numpy as np
+
+from robot.channel import LatestValue
+
+
+def test_read_before_publish():
+    channel = LatestValue(3)
+    out = np.full(3, 7.0)
+    assert channel.read(out) == (0, 0.0)
+    assert channel.sequence == 0
+    np.testing.assert_array_equal(out, 7.0)
+
+
+def test_read_returns_the_newest_value():
+    channel = LatestValue(3, dtype=np.int32)
+    channel.publish([1, 2, 3], stamp=1.5)
+    channel.publish([4, 5, 6], stamp=2.5)
+    out = np.zeros(3, dtype=np.int32)
+    assert channel.read(out) == (2, 2.5)
+    np.testing.assert_array_equal(out, [4, 5, 6])
+
+
+def test_read_copies_the_value():
+    channel = LatestValue(2)
+    value = np.array([1.0, 2.0])
+    channel.publish(value)
+    value[:] = 0
+    out = np.zeros(2)
+    channel.read(out)
+    channel.publish([3.0, 4.0])
+    np.testing.assert_array_equal(out, [1.0, 2.0])
+
+
+def test_wait_times_out_without_a_newer_value():
+    channel = LatestValue(1)
+    channel.publish([1.0])
+    assert channel.wait(0)
+    assert not channel.wait(1, timeout=0.01)
+
+
+def test_wait_wakes_up_on_publish():
+    channel = LatestValue(1)
+    producer = threading.Timer(0.01, channel.publish, args=([1.0],))
+    producer.start()
+    assert channel.wait(0, timeout=5)
+    producer.join()
+    assert channel.sequence == 1
+
+
+def test_consumer_never_sees_a_torn_value():
+    # Every value has all elements equal, a copy mixing two values would not
+    channel = LatestValue(4096, dtype=np.int64)
+    count = 20000
+    done = threading.Event()
+
+    def produce():
+        for i in range(1, count + 1):
+            channel.publish(np.full(4096, i))
+        done.set()
+
+    producer = threading.Thread(target=produce)
+    producer.start()
+    out = np.zeros(4096, dtype=np.int64)
+    last = 0
+    while not done.is_set() or last < count:
+        sequence, _ = channel.read(out)
+        if sequence == 0:
+            continue
+        assert np.all(out == out[0])
+        assert out[0] == sequence
+        assert sequence >= last
+        last = sequence
+    producer.join()
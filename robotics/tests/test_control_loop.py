@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+
+from robot.control_loop import ControlLoop
+
+
+class FlakyRobot:
+    """
+    Arm standing still at its goal whose bus fails while failing is set.
+    """
+    def __init__(self):
+        self.servo_ids = [1, 2]
+        self.min_position_limit = np.zeros(2)
+        self.max_position_limit = np.full(2, 4095)
+        self.position = np.array([2048, 2048])
+        self.failing = False
+
+    def set_goal_pos(self, action, servo_id=None):
+        if self.failing:
+            raise ConnectionError('no status packet')
+        self.position = np.array(action)
+
+    def read_state(self):
+        if self.failing:
+            raise ConnectionError('no status packet')
+        return {'position': self.position.copy(), 'velocity': np.zeros(2)}
+
+
+def test_failed_read_without_a_goal_is_kept_and_clears_the_state(capsys):
+    robot = FlakyRobot()
+    loop = ControlLoop(robot)
+    loop._tick()
+    assert loop.state is not None
+
+    robot.failing = True
+    loop._tick()
+    loop._tick()
+    assert loop.state is None
+    assert isinstance(loop.last_error, ConnectionError)
+    assert loop.errors == 2
+    # Printed once for the series of failures
+    assert capsys.readouterr().out.count('bus error') == 1
+
+    robot.failing = False
+    loop._tick()
+    np.testing.assert_array_equal(loop.state['position'], [2048, 2048])
+
+
+def test_failed_tick_fails_the_active_goal():
+    robot = FlakyRobot()
+    loop = ControlLoop(robot)
+    loop._tick()
+    robot.failing = True
+    future = loop.move_to([1000, 1000])
+    loop._tick()
+    with pytest.raises(ConnectionError):
+        future.result(timeout=0)
+    assert loop.state is None and loop.errors == 1
@@ -0,0 +1,114 @@
+import pytest
+
+from robot.dynamixel import Dynamixel, ReadAttribute
+from robot.retry import BusReadError, RetryPolicy
+
+
+@pytest.fixture
+def dxl(virtual_robot):
+    return virtual_robot.dynamixel
+
+
+def test_repeated_writes_of_cached_registers_are_skipped(dxl, packets):
+    dxl.set_P(1, 500)
+    dxl.set_P(1, 500)
+    dxl.sync_write(Dynamixel.PROFILE_VELOCITY, 4, {1: 100, 2: 100})
+    dxl.sync_write(Dynamixel.PROFILE_VELOCITY, 4, {1: 100, 2: 100})
+    dxl.stage(Dynamixel.POSITION_P, 2, {1: 500})
+    assert not dxl.dirty
+    assert not dxl.flush()
+    assert len(packets.writes(Dynamixel.POSITION_P)) == 1
+    assert len(packets.writes(Dynamixel.PROFILE_VELOCITY)) == 1
+
+    # A different value is written, and only to the servo that needs it
+    dxl.sync_write(Dynamixel.PROFILE_VELOCITY, 4, {1: 100, 2: 200})
+    # Sync write parameters are the servo id followed by the value
+    assert [data[0] for *_, data in packets.writes(Dynamixel.PROFILE_VELOCITY)[1:]] == [2]
+
+
+def test_torque_enable_is_always_written(dxl, packets):
+    dxl._enable_torque(1)
+    dxl._enable_torque(1)
+    dxl.sync_write(Dynamixel.ADDR_TORQUE_ENABLE, 1, {1: 1, 2: 1})
+    dxl.sync_write(Dynamixel.ADDR_TORQUE_ENABLE, 1, {1: 1, 2: 1})
+    assert len(packets.writes(Dynamixel.ADDR_TORQUE_ENABLE)) == 4
+    assert dxl.torque_enabled[1] is True
+
+
+def test_goal_registers_are_not_cached(dxl, packets):
+    dxl.set_goal_position(1, 1000)
+    dxl.set_goal_position(1, 1000)
+    assert len(packets.writes(Dynamixel.ADDR_GOAL_POSITION)) == 2
+
+
+def test_failed_read_drops_the_shadow_of_the_servo(dxl, packets):
+    dxl.set_P(1, 500)
+    dxl.set_P(2, 500)
+    dxl.config.retry_policy = RetryPolicy(max_tries=2)
+    # Servo 1 stops answering, e.g. while it reboots
+    servo = dxl.portHandler.servos.pop(1)
+    with pytest.raises(BusReadError):
+        dxl.read_position(1)
+    assert (1, Dynamixel.POSITION_P) not in dxl.shadow
+    assert (2, Dynamixel.POSITION_P) in dxl.shadow
+    assert dxl.torque_enabled[1] is None
+
+    # Back again, the same value is written instead of skipped
+    dxl.portHandler.servos[1] = servo
+    packets.clear()
+    dxl.set_P(1, 500)
+    assert len(packets.writes(Dynamixel.POSITION_P)) == 1
+
+
+def test_failed_sync_read_drops_the_shadow_of_the_robot(virtual_robot, dxl):
+    dxl.set_P(1, 500)
+    dxl.config.retry_policy = RetryPolicy(max_tries=1)
+    dxl.portHandler.servos.pop(3)
+    with pytest.raises(BusReadError):
+        virtual_robot.read_position()
+    assert not dxl.shadow
+
+
+def test_hardware_alert_drops_the_shadow_but_keeps_the_value(dxl, monkeypatch):
+    dxl.set_P(1, 500)
+    dxl._enable_torque(1)
+    servo = dxl.portHandler.servos[1]
+    read = servo.read
+
+    def read_with_alert(address, length, now):
+        error, data = read(address, length, now)
+        return error | 128, data
+
+    monkeypatch.setattr(servo, 'read', read_with_alert)
+    assert dxl.read_position(1) == 2048
+    assert (1, Dynamixel.POSITION_P) not in dxl.shadow
+    assert dxl.torque_enabled[1] is None
+
+
+def test_eeprom_flush_disables_and_reenables_the_torque(virtual_robot, dxl, packets):
+    virtual_robot.set_goal_pos([2048, 2048, 2048])
+    packets.clear()
+    virtual_robot.limit_pwm(500)
+    addresses = [address for _, _, address, _ in packets.writes()]
+    assert addresses == [Dynamixel.ADDR_TORQUE_ENABLE, Dynamixel.ADDR_PWM_LIMIT, Dynamixel.ADDR_TORQUE_ENABLE]
+    torque = packets.writes(Dynamixel.ADDR_TORQUE_ENABLE)
+    # Id and value of each servo
+    assert torque[0][3] == bytes([1, 0, 2, 0, 3, 0]) and torque[1][3] == bytes([1, 1, 2, 1, 3, 1])
+    for servo in dxl.portHandler.servos.values():
+        # The EEPROM write was accepted, which the servos only do with the torque off
+        assert servo._get(Dynamixel.ADDR_PWM_LIMIT) == 500
+        assert servo._get(Dynamixel.ADDR_TORQUE_ENABLE) == 1
+
+    # Already set: neither the register nor the torque is touched
+    packets.clear()
+    virtual_robot.limit_pwm(500)
+    assert packets.writes() == []
+
+
+def test_reads_fill_the_shadow(dxl, packets):
+    dxl.portHandler.servos[2]._set(ReadAttribute.HOMING_OFFSET.value, 100)
+    assert dxl._read_value(2, ReadAttribute.HOMING_OFFSET, 4) == 100
+    dxl._disable_torque(2)
+    packets.clear()
+    dxl.sync_write(ReadAttribute.HOMING_OFFSET.value, 4, {2: 100})
+    assert packets.writes() == []
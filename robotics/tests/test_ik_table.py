@@ -0,0 +1,93 @@
+import mujoco
+import numpy as np
+import pytest
+
+from simulation.ik_table import POSE_TYPES, SCENE_PATH, IKTable, square_position, taught_seeds
+from simulation.interface import SimulatedRobot
+
+AXES = [np.linspace(-0.1, 0.1, 5), np.linspace(0.1, 0.3, 5), np.linspace(0.0, 0.1, 3)]
+# Servo positions that change linearly with the position, which trilinear interpolation reproduces exactly
+GAIN = np.array([[1000, 0, 0], [0, 2000, 0], [0, 0, -3000], [500, 500, 500], [0, 0, 0]])
+OFFSET = np.array([2048, 1500, 2500, 1000, 2400])
+GEOMETRY = {
+    'board_center': [0.0, 0.2, 0.0],
+    'board_yaw': 0.0,
+    'square_size': 0.04,
+    'stash': {'A': [0.08, 0.04]},
+    'pose_heights': {'hover': 0.06, 'pre-grasp': 0.02, 'grasp': 0.015, 'post-grasp': 0.075},
+    'gripper': {'hover': 2400, 'pre-grasp': 2300, 'grasp': 2100, 'post-grasp': 2100},
+}
+
+
+def linear_ticks(position):
+    return GAIN @ np.asarray(position) + OFFSET
+
+
+@pytest.fixture
+def table():
+    grid = np.stack(np.meshgrid(*AXES, indexing='ij'), axis=-1)
+    ticks = (grid @ GAIN.T + OFFSET).astype(np.float32)
+    return IKTable(AXES, ticks, np.ones(grid.shape[:3], dtype=bool), GEOMETRY)
+
+
+@pytest.mark.parametrize('position', [[0.0, 0.2, 0.05], [0.013, 0.237, 0.021], [-0.1, 0.1, 0.0], [0.1, 0.3, 0.1],
+                                      [0.05, 0.15, 0.1]])
+def test_lookup_interpolates_between_grid_points(table, position):
+    np.testing.assert_allclose(table.lookup(position), linear_ticks(position), atol=1e-2)
+
+
+def test_lookup_at_a_grid_point_returns_its_solution(table):
+    np.testing.assert_allclose(table.lookup([AXES[0][1], AXES[1][3], AXES[2][1]]), table.ticks[1, 3, 1], atol=1e-3)
+
+
+def test_lookup_outside_of_the_grid(table):
+    with pytest.raises(ValueError, match='outside'):
+        table.lookup([0.0, 0.31, 0.05])
+
+
+def test_lookup_next_to_an_unsolved_grid_point(table):
+    table.converged[2, 2, 1] = False
+    with pytest.raises(ValueError, match='out of reach'):
+        table.lookup([0.01, 0.21, 0.06])
+    # Cells that do not touch the grid point are still fine
+    table.lookup([0.08, 0.28, 0.01])
+
+
+def test_square_positions_follow_the_board_layout():
+    # Square 4 is the center, square 0 the first row on the +y side
+    np.testing.assert_allclose(square_position(GEOMETRY, '4', 'grasp'), [0.0, 0.2, 0.015])
+    np.testing.assert_allclose(square_position(GEOMETRY, '0', 'hover'), [-0.04, 0.24, 0.06])
+    np.testing.assert_allclose(square_position(GEOMETRY, 'A', 'post-grasp'), [0.08, 0.24, 0.075])
+    rotated = dict(GEOMETRY, board_yaw=np.pi)
+    np.testing.assert_allclose(square_position(rotated, '0', 'hover'), [0.04, 0.16, 0.06], atol=1e-12)
+
+
+def test_pose_adds_the_gripper(table):
+    pose = table.pose('4', 'grasp')
+    assert pose[-1] == GEOMETRY['gripper']['grasp']
+    assert pose[:-1] == [int(round(t)) for t in linear_ticks([0.0, 0.2, 0.015])]
+    assert set(table.poses()['A']) == set(POSE_TYPES)
+
+
+def test_save_and_load(table, tmp_path):
+    path = tmp_path / 'ik_table.npz'
+    table.save(path)
+    loaded = IKTable.load(path)
+    assert loaded.geometry == GEOMETRY
+    np.testing.assert_array_equal(loaded.ticks, table.ticks)
+    np.testing.assert_allclose(loaded.lookup([0.013, 0.237, 0.021]), table.lookup([0.013, 0.237, 0.021]))
+
+
+def test_taught_seeds():
+    m = mujoco.MjModel.from_xml_path(str(SCENE_PATH))
+    taught = {'4': {'hover': [2025, 2250, 2350, 900, 2400, 2450], 'grasp': [2025, 2200, 1950, 1300, 2400, 2100]},
+              'camera_hover': [2048] * 6}
+    # One seed per pose of a square, other entries of actions.json are skipped
+    positions, seeds = taught_seeds(m, taught)
+    assert positions.shape == (2, 3) and seeds.shape == (2, 5)
+    # Hover is above the grasp
+    assert positions[0][2] > positions[1][2]
+    # The seed of one pose leads the solver to the other
+    robot = SimulatedRobot(m, mujoco.MjData(m))
+    solution = robot.solve_ik(positions[1], q_init=seeds[0])
+    assert solution.converged
@@ -0,0 +1,93 @@
+import os
+
+import numpy as np
+import pytest
+
+from robot.joint_log import HEADER_DTYPE, MAGIC, JointLogPlayer, JointLogWriter, read_joint_log, record_dtype
+
+
+def write_log(path, count, joints=6, chunk=4):
+    leader = np.arange(count * joints).reshape(count, joints) + 1000
+    with JointLogWriter(path, joints, chunk=chunk) as writer:
+        for i in range(count):
+            writer.append(10.0 + i * 0.005, leader[i], leader[i] + 1)
+    return leader
+
+
+def test_round_trip(tmp_path):
+    path = tmp_path / 'motion.jlog'
+    leader = write_log(path, 10)
+    header, records = read_joint_log(path)
+    assert header['magic'] == MAGIC and header['joints'] == 6
+    assert os.path.getsize(path) == HEADER_DTYPE.itemsize + 10 * record_dtype(6).itemsize
+    np.testing.assert_allclose(records['time'], np.arange(10) * 0.005)
+    np.testing.assert_array_equal(records['leader'], leader)
+    np.testing.assert_array_equal(records['follower'], leader + 1)
+
+
+def test_empty_log(tmp_path):
+    path = tmp_path / 'empty.jlog'
+    JointLogWriter(path, 6).close()
+    header, records = read_joint_log(path)
+    assert header['joints'] == 6 and len(records) == 0
+
+
+def test_truncated_log_drops_the_partial_record(tmp_path):
+    path = tmp_path / 'motion.jlog'
+    leader = write_log(path, 10)
+    # Cut short in the middle of the last record, e.g. by a crash while writing
+    os.truncate(path, os.path.getsize(path) - 5)
+    _, records = read_joint_log(path)
+    assert len(records) == 9
+    np.testing.assert_array_equal(records['leader'], leader[:9])
+
+
+def test_log_of_a_crashed_writer_keeps_the_written_chunks(tmp_path):
+    path = tmp_path / 'motion.jlog'
+    writer = JointLogWriter(path, 6, chunk=4)
+    for i in range(10):
+        writer.append(float(i), np.full(6, i), np.full(6, i))
+    # Never closed: the two full chunks are on disk, the last two records are lost
+    _, records = read_joint_log(path)
+    assert records['leader'][:, 0].tolist() == list(range(8))
+    writer.close()
+    assert len(read_joint_log(path)[1]) == 10
+
+
+def test_not_a_joint_log(tmp_path):
+    path = tmp_path / 'other.bin'
+    path.write_bytes(b'\0' * 64)
+    with pytest.raises(ValueError, match='not a joint log'):
+        read_joint_log(path)
+    path.write_bytes(b'')
+    with pytest.raises(ValueError, match='not a joint log'):
+        read_joint_log(path)
+
+
+class ReplayRobot:
+    def __init__(self):
+        self.now = 0.0
+        self.goals = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def set_goal_pos(self, goal):
+        self.goals.append(np.array(goal))
+
+    def set_and_wait_goal_pos(self, goal):
+        self.goals.append(np.array(goal))
+
+
+def test_player_replays_the_follower_goals(tmp_path):
+    path = tmp_path / 'motion.jlog'
+    leader = write_log(path, 10)
+    robot = ReplayRobot()
+    JointLogPlayer(robot, path, speed=2.0).play()
+    np.testing.assert_array_equal(robot.goals[0], leader[0] + 1)
+    np.testing.assert_array_equal(robot.goals[-1], leader[-1] + 1)
+    # Twice as fast as recorded
+    assert robot.now == pytest.approx(9 * 0.005 / 2)
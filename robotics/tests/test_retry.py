@@ -0,0 +1,69 @@
+import pytest
+
+from robot import retry
+from robot.retry import RetryPolicy
+
+
+class FakeClock:
+    """
+    Stands in for the time module, sleeping only advances the clock.
+    """
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(retry, 'time', clock)
+    return clock
+
+
+def test_first_attempt_does_not_wait(clock):
+    policy = RetryPolicy()
+    assert next(policy.attempts()) == 0
+    assert clock.sleeps == []
+
+
+def test_stops_after_max_tries(clock):
+    policy = RetryPolicy(max_tries=4, deadline_us=10 ** 9)
+    assert list(policy.attempts()) == [0, 1, 2, 3]
+    assert len(clock.sleeps) == 3
+
+
+def test_backoff_doubles_up_to_the_maximum(clock):
+    policy = RetryPolicy(max_tries=6, deadline_us=10 ** 9, initial_backoff_us=200, max_backoff_us=1000)
+    list(policy.attempts())
+    assert clock.sleeps == pytest.approx([200e-6, 400e-6, 800e-6, 1000e-6, 1000e-6])
+
+
+def test_gives_up_before_an_attempt_would_start_after_the_deadline(clock):
+    policy = RetryPolicy(max_tries=100, deadline_us=1000, initial_backoff_us=200, max_backoff_us=5000)
+    # Attempts start at 0, 200 and 600 us, the next one would start at 1400 us
+    assert list(policy.attempts()) == [0, 1, 2]
+    assert clock.now <= 1000e-6
+
+
+def test_breaking_out_on_success_stops_retrying(clock):
+    policy = RetryPolicy(max_tries=5, deadline_us=10 ** 9)
+    tries = 0
+    for attempt in policy.attempts():
+        tries += 1
+        if attempt == 1:
+            break
+    assert tries == 2
+    assert len(clock.sleeps) == 1
+
+
+def test_bus_read_error_keeps_the_failed_transaction():
+    error = retry.BusReadError('read failed', [1, 2], 132, 5, comm_result=-3001, dxl_error=0)
+    assert isinstance(error, ConnectionError)
+    assert (error.servo_ids, error.address, error.attempts, error.comm_result) == ([1, 2], 132, 5, -3001)
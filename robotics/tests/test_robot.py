@@ -0,0 +1,42 @@
+import numpy as np
+
+from robot.dynamixel import Dynamixel
+from robot.robot import GOAL_POSITION_DTYPE, GOAL_PWM_DTYPE
+
+
+def sent_goals(packets, address, dtype):
+    """
+    :return: {servo id: goal} of each sync write to address, decoded from the bytes on the bus
+    """
+    return [{int(record['id']): int(record['goal']) for record in np.frombuffer(data, dtype=dtype)}
+            for _, _, _, data in packets.writes(address)]
+
+
+def test_goal_positions_are_rounded(virtual_robot, packets):
+    virtual_robot.set_goal_pos([2047.9, 1000.2, 3000.5])
+    # np.rint rounds halves to even
+    assert sent_goals(packets, Dynamixel.ADDR_GOAL_POSITION, GOAL_POSITION_DTYPE) == [{1: 2048, 2: 1000, 3: 3000}]
+
+
+def test_goal_positions_are_clipped_to_the_limits(virtual_robot, packets):
+    virtual_robot.min_position_limit = [1000, 1000, 1000]
+    virtual_robot.max_position_limit = [3000, 3000, 3000]
+    virtual_robot.set_goal_pos([500, 2000, 3500])
+    assert sent_goals(packets, Dynamixel.ADDR_GOAL_POSITION, GOAL_POSITION_DTYPE) == [{1: 1000, 2: 2000, 3: 3000}]
+
+
+def test_single_servo_write_keeps_the_other_goals(virtual_robot, packets):
+    virtual_robot.set_goal_pos([1000, 2000, 3000])
+    virtual_robot.set_goal_pos([0, 2500.4, 0], servo_id=2)
+    virtual_robot.set_goal_pos([1100, 2100, 3100], servo_id=3)
+    assert sent_goals(packets, Dynamixel.ADDR_GOAL_POSITION, GOAL_POSITION_DTYPE) == [
+        {1: 1000, 2: 2000, 3: 3000}, {2: 2500}, {3: 3100}]
+    # A full write afterwards starts from the goals the servos hold
+    np.testing.assert_array_equal(virtual_robot.pos_goal, [1000, 2500, 3100])
+    goals = [servo._get(Dynamixel.ADDR_GOAL_POSITION) for servo in virtual_robot.dynamixel.portHandler.servos.values()]
+    assert goals == [1000, 2500, 3100]
+
+
+def test_pwm_values_are_rounded(virtual_robot, packets):
+    virtual_robot.set_pwm([99.6, -99.6, 0.4])
+    assert sent_goals(packets, Dynamixel.ADDR_GOAL_PWM, GOAL_PWM_DTYPE) == [{1: 100, 2: -100, 3: 0}]
@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+
+from robot.teleop import TeleopEngine
+
+
+class FakeArm:
+    def __init__(self, positions):
+        self.servo_ids = list(range(1, len(positions) + 1))
+        self.positions = np.array(positions)
+        self.goals = []
+
+    def read_position(self):
+        return self.positions.copy()
+
+    def set_goal_pos(self, goal):
+        self.goals.append(goal)
+
+
+def test_stop_reads_the_leader_when_no_read_finished():
+    # Stopped right away, the reader thread may not have read the leader at all
+    leader = FakeArm([2048, 1000, 3000])
+    teleop = TeleopEngine(leader, FakeArm([0, 0, 0]))
+    teleop.start()
+    assert [int(p) for p in teleop.stop()] == [2048, 1000, 3000]
+    # Also without ever starting the threads
+    assert [int(p) for p in TeleopEngine(leader, FakeArm([0, 0, 0])).stop()] == [2048, 1000, 3000]
+
+
+def test_stop_returns_the_position_at_the_stop():
+    leader = FakeArm([2048, 1000, 3000])
+    follower = FakeArm([0, 0, 0])
+    teleop = TeleopEngine(leader, follower, rate_hz=1000)
+    teleop.start()
+    while not follower.goals:
+        pass
+    leader.positions = np.array([10, 20, 30])
+    assert teleop.stop().tolist() == [10, 20, 30]
+
+
+def test_stop_raises_the_error_of_a_failed_read():
+    class BrokenArm(FakeArm):
+        def read_position(self):
+            raise ConnectionError('no status packet')
+
+    teleop = TeleopEngine(BrokenArm([2048]), FakeArm([0]))
+    teleop.start()
+    with pytest.raises(ConnectionError):
+        teleop.stop()
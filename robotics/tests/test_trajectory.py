@@ -0,0 +1,133 @@
+import numpy as np
+import pytest
+
+from robot.trajectory import BlendedPath, TrajectoryExecutor, pick_and_place_waypoints
+
+MAX_VELOCITY = np.array([1000.0, 800.0, 600.0])
+MAX_ACCELERATION = MAX_VELOCITY / 0.15
+POINTS = [[0, 0, 0], [600, 200, 100], [700, 600, 100], [200, 600, 500], [0, 0, 0]]
+
+
+def sample(path, dt=1e-4):
+    t = np.arange(0, path.duration + dt, dt)
+    return np.array([path.position(ti) for ti in t])
+
+
+def test_path_starts_and_ends_at_the_first_and_last_point():
+    path = BlendedPath(POINTS, MAX_VELOCITY, MAX_ACCELERATION)
+    np.testing.assert_allclose(path.position(0), POINTS[0])
+    np.testing.assert_allclose(path.position(path.duration), POINTS[-1])
+    np.testing.assert_allclose(path.position(-1), POINTS[0])
+    np.testing.assert_allclose(path.position(path.duration + 1), POINTS[-1])
+
+
+def test_path_respects_the_velocity_and_acceleration_limits():
+    path = BlendedPath(POINTS, MAX_VELOCITY, MAX_ACCELERATION)
+    dt = 1e-4
+    q = sample(path, dt)
+    velocity = np.diff(q, axis=0) / dt
+    acceleration = np.diff(velocity, axis=0) / dt
+    assert np.all(np.abs(velocity) <= MAX_VELOCITY * 1.001)
+    assert np.all(np.abs(acceleration) <= MAX_ACCELERATION * 1.01)
+    # At rest at both ends
+    np.testing.assert_allclose(velocity[0], 0, atol=MAX_ACCELERATION.max() * dt)
+    np.testing.assert_allclose(velocity[-1], 0, atol=MAX_ACCELERATION.max() * dt)
+
+
+def test_path_passes_close_to_the_intermediate_points():
+    path = BlendedPath(POINTS, MAX_VELOCITY, MAX_ACCELERATION)
+    q = sample(path)
+    for point, blend in zip(POINTS[1:-1], path.blends[1:-1]):
+        distance = np.min(np.max(np.abs(q - point), axis=1))
+        # A blend cuts the corner by at most an eighth of the speed change times the blend time
+        assert distance <= 2 * np.max(MAX_VELOCITY) * blend / 8
+
+
+def test_straight_segments_run_at_the_velocity_limit():
+    path = BlendedPath([[0, 0, 0], [3000, 0, 0]], MAX_VELOCITY, MAX_ACCELERATION)
+    # 3 s at 1000 ticks per second, plus half of each 0.15 s blend
+    assert path.duration == pytest.approx(3.15)
+    assert path.position(path.duration / 2)[0] == pytest.approx(1500)
+
+
+def test_blending_is_faster_than_stopping_at_every_point():
+    blended = BlendedPath(POINTS, MAX_VELOCITY, MAX_ACCELERATION)
+    stop_and_go = sum(BlendedPath([q0, q1], MAX_VELOCITY, MAX_ACCELERATION).duration
+                      for q0, q1 in zip(POINTS[:-1], POINTS[1:]))
+    assert blended.duration < stop_and_go
+
+
+def test_short_segments_last_at_least_the_min_segment_time():
+    path = BlendedPath([[0, 0, 0], [1, 0, 0], [2, 0, 0]], MAX_VELOCITY, MAX_ACCELERATION, min_segment_time=0.2)
+    assert np.all(path.durations >= 0.2)
+
+
+def test_pick_and_place_stops_where_the_claw_moves():
+    positions = {square: {pose: [i, j] for j, pose in enumerate(['hover', 'pre-grasp', 'grasp', 'post-grasp'])}
+                 for i, square in enumerate(['A', '4'])}
+    waypoints, stops = pick_and_place_waypoints(positions, 'A', '4', [9, 9])
+    assert waypoints == [[0, 0], [0, 1], [0, 2], [0, 3], [1, 3], [1, 2], [1, 1], [1, 0], [9, 9]]
+    # Closing at the pick grasp, letting go at the place grasp, opening at the place pre-grasp, and home
+    assert [i for i, stop in enumerate(stops) if stop] == [2, 5, 6, 8]
+
+
+def test_claw_is_open_before_lifting_off_a_placed_piece():
+    # Joints are the arm lift and the claw: the claw opens at the place pre-grasp, the arm lifts at the hover
+    poses = {'hover': [1000, 2400], 'pre-grasp': [0, 2300], 'grasp': [0, 2100], 'post-grasp': [1000, 2100]}
+    positions = {'A': poses, '4': poses}
+    waypoints, stops = pick_and_place_waypoints(positions, 'A', '4', [1000, 2400])
+    robot = FakeRobot([1000, 2400])
+    TrajectoryExecutor(robot).execute(waypoints, stops)
+    goals = np.array(robot.goals)
+    # From letting go of the piece on, the arm only moves up once the claw has fully opened
+    after_release = goals[np.flatnonzero(goals[:, 1] == 2100)[-1]:]
+    assert np.all(after_release[after_release[:, 0] > 0, 1] >= 2300)
+    assert robot.stops[-2:] == [[0, 2300], [1000, 2400]]
+
+
+class FakeRobot:
+    """
+    Records the goals it is sent and runs on a simulated clock.
+    """
+    def __init__(self, position):
+        self.velocity_limit = [0] * len(position)
+        self.min_position_limit = np.zeros(len(position))
+        self.max_position_limit = np.full(len(position), 4095)
+        self.now = 0.0
+        self.position = np.array(position)
+        self.goals = []
+        self.stops = []
+
+    def clock(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+    def read_position(self):
+        return self.position
+
+    def set_goal_pos(self, goal):
+        self.goals.append(np.array(goal))
+
+    def set_and_wait_goal_pos(self, goal):
+        self.stops.append(list(goal))
+        self.position = np.array(goal)
+
+
+def test_executor_splits_the_trajectory_at_the_stops():
+    executor = TrajectoryExecutor(FakeRobot(POINTS[0]))
+    paths = executor.plan(POINTS[0], POINTS[1:], [False, True, False, False])
+    assert [waypoint for _, waypoint in paths] == [POINTS[2], POINTS[4]]
+    assert [len(path.points) for path, _ in paths] == [3, 3]
+
+
+def test_executor_streams_the_path_and_waits_at_the_stops():
+    robot = FakeRobot(POINTS[0])
+    TrajectoryExecutor(robot, rate_hz=100).execute(POINTS[1:], [False, True, False, False])
+    assert robot.stops == [POINTS[2], POINTS[4]]
+    goals = np.array(robot.goals)
+    assert goals.dtype.kind == 'i'
+    np.testing.assert_array_equal(goals[-1], POINTS[-1])
+    # One goal per tick, never further apart than the default velocity limit allows
+    assert np.all(np.abs(np.diff(goals, axis=0)) <= 1000 * 0.01 + 1)
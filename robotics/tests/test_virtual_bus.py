@@ -0,0 +1,120 @@
+import time
+
+import pytest
+from dynamixel_sdk import COMM_RX_TIMEOUT, COMM_SUCCESS, GroupSyncRead, GroupSyncWrite, PacketHandler
+
+from robot import virtual_bus
+from robot.virtual_bus import VirtualPortHandler
+
+
+@pytest.fixture
+def port():
+    port = VirtualPortHandler(servo_ids=[1, 2, 3], latency=0.0001)
+    port.openPort()
+    port.setBaudRate(1_000_000)
+    yield port
+    port.closePort()
+
+
+@pytest.fixture
+def packet_handler():
+    return PacketHandler(2.0)
+
+
+def test_ping(port, packet_handler):
+    model_number, result, error = packet_handler.ping(port, 2)
+    assert (model_number, result, error) == (1200, COMM_SUCCESS, 0)
+    # No servo with that id on the chain
+    assert packet_handler.ping(port, 9)[1] == COMM_RX_TIMEOUT
+
+
+@pytest.mark.parametrize('address, size, value', [(virtual_bus.ADDR_TORQUE_ENABLE, 1, 1),
+                                                  (virtual_bus.ADDR_POSITION_P, 2, 900),
+                                                  (virtual_bus.ADDR_PROFILE_VELOCITY, 4, 70000),
+                                                  # Parameters with the header sequence must be byte stuffed
+                                                  (virtual_bus.ADDR_GOAL_POSITION, 4, 0x00FDFFFF)])
+def test_write_and_read_back(port, packet_handler, address, size, value):
+    write = {1: packet_handler.write1ByteTxRx, 2: packet_handler.write2ByteTxRx, 4: packet_handler.write4ByteTxRx}
+    read = {1: packet_handler.read1ByteTxRx, 2: packet_handler.read2ByteTxRx, 4: packet_handler.read4ByteTxRx}
+    assert write[size](port, 1, address, value) == (COMM_SUCCESS, 0)
+    assert read[size](port, 1, address) == (value, COMM_SUCCESS, 0)
+    assert port.servos[1].table[address:address + size] == value.to_bytes(size, 'little')
+
+
+def test_eeprom_is_read_only_with_the_torque_on(port, packet_handler):
+    packet_handler.write1ByteTxRx(port, 1, virtual_bus.ADDR_TORQUE_ENABLE, 1)
+    assert packet_handler.write2ByteTxRx(port, 1, virtual_bus.ADDR_PWM_LIMIT, 500)[1] == virtual_bus.ERROR_ACCESS
+    packet_handler.write1ByteTxRx(port, 1, virtual_bus.ADDR_TORQUE_ENABLE, 0)
+    assert packet_handler.write2ByteTxRx(port, 1, virtual_bus.ADDR_PWM_LIMIT, 500) == (COMM_SUCCESS, 0)
+
+
+def test_read_past_the_control_table(port, packet_handler):
+    _, result, error = packet_handler.readTxRx(port, 1, virtual_bus.CONTROL_TABLE_SIZE - 2, 4)
+    # The status packet without data still arrives, flagging the error
+    assert (result, error) == (COMM_SUCCESS, virtual_bus.ERROR_DATA_RANGE)
+
+
+def test_sync_write_and_sync_read(port, packet_handler):
+    writer = GroupSyncWrite(port, packet_handler, virtual_bus.ADDR_GOAL_POSITION, 4)
+    for servo_id, goal in ((1, 1000), (2, 2000), (3, 3000)):
+        writer.addParam(servo_id, list(goal.to_bytes(4, 'little')))
+    assert writer.txPacket() == COMM_SUCCESS
+
+    reader = GroupSyncRead(port, packet_handler, virtual_bus.ADDR_GOAL_POSITION, 4)
+    for servo_id in (1, 2, 3):
+        reader.addParam(servo_id)
+    assert reader.txRxPacket() == COMM_SUCCESS
+    goals = [reader.getData(servo_id, virtual_bus.ADDR_GOAL_POSITION, 4) for servo_id in (1, 2, 3)]
+    assert goals == [1000, 2000, 3000]
+
+
+def test_corrupted_packet_is_not_answered(port):
+    packet = bytearray([0xFF, 0xFF, 0xFD, 0x00, 1, 3, 0, 0x01, 0, 0])
+    port.writePort(packet)
+    assert port.packets_rx == 0
+
+
+def test_status_packet_arrives_after_latency_and_wire_time(packet_handler):
+    latency = 0.01
+    port = VirtualPortHandler(servo_ids=[1], latency=latency)
+    port.openPort()
+    port.setBaudRate(57600)
+    start = time.perf_counter()
+    packet_handler.readTx(port, 1, virtual_bus.ADDR_PRESENT_POSITION, 4)
+    # 14 byte read instruction, 15 byte status packet with 4 bytes of data, 10 bits per byte
+    expected = latency + (14 + 15) * 10 / 57600
+    ready = port._rx[0][0] - start
+    assert expected <= ready < expected + 0.02
+    assert port.getBytesAvailable() == 0
+    while time.perf_counter() - start < ready:
+        pass
+    assert port.getBytesAvailable() == 15
+
+
+def test_transactions_queue_on_the_bus(packet_handler):
+    port = VirtualPortHandler(servo_ids=[1, 2], latency=0.002)
+    port.openPort()
+    port.setBaudRate(1_000_000)
+    packet_handler.readTx(port, 1, virtual_bus.ADDR_PRESENT_POSITION, 4)
+    # Send the second instruction without waiting for the first status packet
+    port.is_using = False
+    packet_handler.readTx(port, 2, virtual_bus.ADDR_PRESENT_POSITION, 4)
+    first, second = (ready for ready, _ in port._rx)
+    # The second instruction only goes out once the first status packet is off the bus
+    assert second - first >= 0.002 + (14 + 15) * 10 / 1_000_000 - 1e-9
+
+
+def test_position_moves_at_the_profile_velocity():
+    servo = virtual_bus.VirtualServo(1, position=2048)
+    now = servo.last_update
+    servo._set(virtual_bus.ADDR_PROFILE_VELOCITY, 100)
+    servo._set(virtual_bus.ADDR_GOAL_POSITION, 3000)
+    servo._set(virtual_bus.ADDR_TORQUE_ENABLE, 1)
+    servo.update(now + 0.5)
+    step = 100 * virtual_bus.VELOCITY_UNIT * 0.5
+    assert servo._get(virtual_bus.ADDR_PRESENT_POSITION) == round(2048 + step)
+    assert servo._get(virtual_bus.ADDR_PRESENT_VELOCITY) == 100
+    servo.update(now + 10)
+    servo.update(now + 11)
+    assert servo._get(virtual_bus.ADDR_PRESENT_POSITION) == 3000
+    assert servo._get(virtual_bus.ADDR_PRESENT_VELOCITY) == 0
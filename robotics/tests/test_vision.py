@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from vision import BoardVision
+
+
+@pytest.fixture
+def board():
+    # Only the tile bookkeeping, without a camera
+    board = BoardVision.__new__(BoardVision)
+    board.x, board.y, board.w, board.h = 100.0, 50.0, 300.0, 240.0
+    board.board_window = np.zeros(9)
+    return board
+
+
+def test_tiles_from_pieces(board):
+    # Centers in the top left, center and bottom right tiles, and left of and below the board
+    boxes = np.array([[110, 60, 20, 20], [240, 160, 20, 20], [380, 260, 10, 10], [40, 100, 20, 20],
+                      [200, 300, 20, 20]], dtype=float)
+    assert board.get_tiles_from_pieces(boxes).tolist() == [0, 4, 8, -1, -1]
+
+
+def test_tiles_from_pieces_go_through_get_tile_from_piece(board, monkeypatch):
+    # The tile of a piece is the Step 1 exercise, a different solution changes the tiles the game sees
+    monkeypatch.setattr(board, 'get_tile_from_piece', lambda px, py, pw, ph: 8 - int(px) % 9 if px < 300 else None)
+    boxes = np.array([[100, 0, 1, 1], [104, 0, 1, 1], [350, 0, 1, 1]], dtype=float)
+    assert board.get_tiles_from_pieces(boxes).tolist() == [7, 3, -1]
+
+
+def test_tiles_from_no_pieces(board):
+    assert board.get_tiles_from_pieces(np.zeros((0, 4))).shape == (0,)
+
+
+def sequential_evidence(window, red_tiles, blue_tiles):
+    # One update per piece, then the decay at the end of the frame
+    window = window.copy()
+    for tile in red_tiles:
+        window[tile] = window[tile] * 0.9 + 0.1
+    for tile in blue_tiles:
+        window[tile] = window[tile] * 0.9 - 0.1
+    return window * 0.9
+
+
+def test_evidence_matches_one_update_per_piece(board):
+    rng = np.random.default_rng(1)
+    window = np.zeros(9)
+    for _ in range(50):
+        # Every tile holds pieces of a single color
+        colors = rng.integers(0, 2, 9)
+        tiles = rng.integers(0, 9, rng.integers(0, 6))
+        red_tiles = tiles[colors[tiles] == 1]
+        blue_tiles = tiles[colors[tiles] == 0]
+        window = sequential_evidence(window, red_tiles, blue_tiles)
+        board.accumulate_tile_evidence(red_tiles, blue_tiles)
+        np.testing.assert_allclose(board.board_window, window)
+
+
+def test_evidence_ignores_pieces_off_the_board(board):
+    board.accumulate_tile_evidence(np.array([-1, 9, 4]), np.array([-1]))
+    expected = np.zeros(9)
+    expected[4] = 0.1 * 0.9
+    np.testing.assert_allclose(board.board_window, expected)
+
+
+def test_evidence_of_both_colors_on_one_tile_cancels(board):
+    board.board_window[:] = 0.5
+    board.accumulate_tile_evidence(np.array([2]), np.array([2]))
+    # Two updates towards the balance 0 of the colors, then the decay
+    assert board.board_window[2] == pytest.approx(0.5 * 0.81 * 0.9)
+    assert board.board_window[0] == pytest.approx(0.45)
+
+
+def test_evidence_converges_to_the_color_of_the_tile(board):
+    for _ in range(200):
+        board.accumulate_tile_evidence(np.array([0, 0]), np.array([8]))
+    # Steady state of w = 0.9 * (0.81 w + 0.19) and of w = 0.9 * (0.9 w - 0.1)
+    assert board.board_window[0] == pytest.approx(0.9 * 0.19 / (1 - 0.9 * 0.81))
+    assert board.board_window[8] == pytest.approx(-0.09 / 0.19)
+    assert board.board_window[0] > 0.2 and board.board_window[8] < -0.2
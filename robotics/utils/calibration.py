@@ -1,5 +1,8 @@
-import os, json, threading, argparse, time
-from robotics.robot.robot import Robot
+import os, json, argparse, sys
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+from robot.robot import Robot
+from robot.teleop import TeleopEngine
+from robot.settle import SettleDetector
 from vision import BoardVision
 
 def parse_arguments():
@@ -16,17 +19,10 @@ def load_robot_settings(args):
     return arm_config, leader_config
 
 def initialize_robots(arm_config, leader_config):
-    arm = Robot(device_name=arm_config['device_name'], 
-                servo_ids=arm_config['servo_ids'],
-                velocity_limit=arm_config['velocity_limit'],
-                max_position_limit=arm_config['max_position_limit'],
-                min_position_limit=arm_config['min_position_limit'],
-                position_p_gain=arm_config['position_p_gain'],
-                position_i_gain=arm_config['position_i_gain'])
+    arm = Robot.from_config(arm_config)
     leader = None
     if leader_config:
-        leader = Robot(device_name=leader_config['device_name'], 
-                       servo_ids=leader_config['servo_ids'])
+        leader = Robot.from_config(leader_config)
         leader.set_trigger_torque()
     return arm, leader
 
@@ -47,18 +43,12 @@ def record_position(arm):
 # Function to record positions with leader arm
 def record_position_with_leader(arm, leader, square, pose_type):
     print(f'Move the arm to the {pose_type} position of square {square}.')
-    # Wait for user input to stop teleoperation
-    stop = threading.Event()
-    def wait_for_input(stop):
-        input('Press enter to record.')
-        stop.set()
-    thread = threading.Thread(target=wait_for_input, args=(stop,))
-    thread.start()
-    # Teleoperation
-    while not stop.is_set():
-        pos = leader.read_position()
-        arm.set_goal_pos(pos)
-    thread.join()
+    # Teleoperation until the user presses enter
+    teleop = TeleopEngine(leader, arm)
+    teleop.start()
+    input('Press enter to record.')
+    pos = teleop.stop()
+    print(teleop.summary())
     # Record position
     pos = [int(p) for p in pos]
     return pos
@@ -67,6 +57,7 @@ def record_deltas(arm, vision, servo, delta):
     delta_x_avg = []
     delta_y_avg = []
     delta_a_avg = []
+    settle = SettleDetector(arm)
 
     for trial in range(3):
         # Record and move to initial position
@@ -76,12 +67,11 @@ def record_deltas(arm, vision, servo, delta):
         root_pos = [int(p) for p in arm.read_position()]
         arm.set_and_wait_goal_pos(root_pos)
 
-        # Capture initial piece info
-        time.sleep(2.0)
+        # Capture initial piece info once the arm and the detection are still
+        settle.wait(target=vision.get_handle_info, frame=lambda: vision.frame_sequence)
         x1, y1, a1 = vision.get_handle_info()
 
         print(x1,y1,a1)
-        time.sleep(2.0)
 
         # Move to new position
         new_pos = root_pos.copy()
@@ -89,10 +79,9 @@ def record_deltas(arm, vision, servo, delta):
         arm.set_and_wait_goal_pos(new_pos)
 
         # Capture new piece info
-        time.sleep(2.0)
+        settle.wait(target=vision.get_handle_info, frame=lambda: vision.frame_sequence)
         x2, y2, a2 = vision.get_handle_info()
         print(x2,y2,a2)
-        time.sleep(2.0)
 
         if all(x != -1 for x in (x1, y1, a1, x2, y2, a2)):
             delta_x_avg.append(x2-x1)
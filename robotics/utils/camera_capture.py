@@ -7,6 +7,7 @@ import threading
 import time
 import argparse
 import sys
+from frame_grabber import FrameGrabber
 
 """
 camera_capture is used to take photos from the USB camera, which can be used as data
@@ -42,6 +43,8 @@ class BoardVision:
         self.confidence_threshold = 100
         self.main = main
         self.cap = cv2.VideoCapture(cam) #Tune this number until you get the USB camera!
+        # Reads the camera on its own thread, so the preview and screenshots always show the newest frame
+        self.grabber = FrameGrabber(self.cap)
 
         # Screenshot settings
         self.use_timer = use_timer
@@ -83,10 +86,11 @@ class BoardVision:
         Don't need to change anything here!
         """
         cap = self.cap
+        self.grabber.start()
 
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            frame = self.grabber.read()
+            if frame is None:
                 break
 
             if self.use_timer:
@@ -104,6 +108,7 @@ class BoardVision:
                 if not self.use_timer and key == ord('c'):
                     self.take_screenshot(frame)
 
+        self.grabber.stop()
         cap.release()
         cv2.destroyAllWindows()
 
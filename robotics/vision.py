@@ -1,7 +1,46 @@
 import cv2
 import numpy as np
 import threading
-import time
+from frame_grabber import FrameGrabber
+
+# Pixel classes of the color segmentation
+BACKGROUND, GREEN, RED, BLUE = 0, 1, 2, 3
+# HSV ranges of each class (OpenCV hue is 0 - 180). Red wraps around the hue circle, so it has two ranges.
+COLOR_RANGES = [
+    (GREEN, (40, 100, 90), (90, 255, 255)),
+    (RED, (0, 70, 50), (15, 255, 255)),
+    (RED, (160, 0, 0), (180, 255, 255)),
+    (BLUE, (100, 170, 80), (120, 255, 255)),
+]
+# Bits kept of each color channel by the lookup table. 6 bits make a 256 KB table, small enough to stay in the cache
+# next to the frame, while a full 24-bit table (16 MB) misses it on nearly every pixel of a noisy frame.
+COLOR_BITS = 6
+_color_lut = None
+
+
+def color_lut():
+    """
+    Classifies every quantized color once, so segmenting a frame is a single table lookup per pixel.
+    Each entry holds the class of the color at the center of its bin. The table is built on first use and shared by
+    all BoardVision instances.
+    :return: uint8 array of 2**(3 * COLOR_BITS) pixel classes, indexed by b | g << COLOR_BITS | r << 2 * COLOR_BITS
+             of the quantized channels
+    """
+    global _color_lut
+    if _color_lut is None:
+        levels = 1 << COLOR_BITS
+        step = 256 // levels
+        center = np.arange(levels, dtype=np.uint8) * step + step // 2
+        # All bin centers as one image, ordered like the index: r, then g, then b
+        r, g, b = np.meshgrid(center, center, center, indexing='ij')
+        colors = np.stack([b, g, r], axis=-1).reshape(1, -1, 3)
+        hsv = cv2.cvtColor(colors, cv2.COLOR_BGR2HSV)
+        lut = np.zeros(levels ** 3, dtype=np.uint8)
+        for label, lower, upper in COLOR_RANGES:
+            lut[cv2.inRange(hsv, lower, upper).ravel() > 0] = label
+        _color_lut = lut
+    return _color_lut
+
 
 class BoardVision:
     """
@@ -15,15 +54,42 @@ class BoardVision:
         self.y = None
         self.w = None
         self.h = None
-        self.board_window = [0]*9
+        self.board_window = np.zeros(9)
         self.board_state = [None]*9
         self.old_board_state = [None]*9
         self.true_board_state = self.board_state.copy()
-        self.confidence = 0
-        self.confidence_threshold = 100
+        # A new board state is confirmed once it was seen unchanged for confirm_frames frames and confirm_time
+        # seconds. Confirmed changes bump board_version and wake up everyone waiting on board_changed.
+        self.confirm_frames = 10
+        self.confirm_time = 0.3
+        self.confirmed = False
+        self.board_version = 0
+        self.board_changed = threading.Condition()
+        self.subscribers = []
+        self.observed_state = self.board_state.copy()
+        self.observed_since = None
+        self.observed_frames = 0
+        self.move_from_version = None
         self.main = main
         self.cap = cv2.VideoCapture(cam) #Tune this number until you get the USB camera!
+        # Reads the camera on its own thread, so processing always works on the newest frame
+        self.grabber = FrameGrabber(self.cap)
+        # Sequence number of the last frame processed, for waiting on detections from new frames
+        self.frame_sequence = 0
         self.use_yolo = use_yolo
+        self.color_lut = color_lut()
+        # Segmentation buffers, grown to the largest region processed so far and reused afterwards
+        self.bgra_buffer = np.empty(0, dtype=np.uint8)
+        self.index_buffer = np.empty(0, dtype=np.uint32)
+        self.shift_buffer = np.empty(0, dtype=np.uint32)
+        self.label_buffer = np.empty(0, dtype=np.uint8)
+        self.mask_buffer = np.empty(0, dtype=np.uint8)
+        # Board tracking: once the board is found, only a padded region around it is processed, and every
+        # reacquire_interval frames the whole view again in case the board moved
+        self.tracking = False
+        self.roi_padding = 0.15
+        self.reacquire_interval = 30
+        self.frames_since_acquire = 0
 
         if main:
             self.cap_board_state()
@@ -112,11 +178,15 @@ class BoardVision:
         """
         Resets the internal vision board state baseline to empty.
         """
-        self.board_window = [0]*9
-        self.board_state = [None]*9
-        self.old_board_state = [None]*9
-        self.true_board_state = [None]*9
-        self.confidence = self.confidence_threshold
+        with self.board_changed:
+            self.board_window = np.zeros(9)
+            self.board_state = [None]*9
+            self.old_board_state = [None]*9
+            self.observed_state = [None]*9
+            self.observed_since = None
+            self.observed_frames = 0
+            self.confirmed = True
+            self.publish_board_state([None]*9)
 
     def get_tile_from_piece(self, px, py, pw, ph):
         """
@@ -163,7 +233,7 @@ class BoardVision:
         Updates the board state list according to camera measurements.
 
         self.board_state : List containing the state of each tile (0-8)
-        self.board_window: List containing the measurements of each tile (0-8)
+        self.board_window: Array containing the measurements of each tile (0-8)
 
         Instructions:
         Loop through self.board_window, which includes the measurements for every tile.
@@ -174,7 +244,6 @@ class BoardVision:
 
         Update each item in self.board_state based on self.board_window!
         """
-        prev_board_state = self.board_state.copy()
         #YOUR CODE GOES HERE!
         for i in range(9):
             if self.board_window[i]>=0.2:
@@ -186,19 +255,46 @@ class BoardVision:
         #print(self.board_state)
         # for each item in self.board_window, update self.board_state accordingly.
 
-        #Ignore code down here
-        if self.board_state != prev_board_state:
-            self.confidence = 0
-            #print("Changed board:", self.board_state)
-        self.confidence += 0.75
-        if self.confidence > self.confidence_threshold:
-            if self.true_board_state != self.board_state:
-                self.true_board_state = self.board_state.copy()
+    def confirm_board_state(self, now):
+        """
+        No changes needed! Called once per frame: confirms the board state once it stayed the same long enough.
+        """
+        if self.board_state != self.observed_state:
+            self.observed_state = self.board_state.copy()
+            self.observed_since = now
+            self.observed_frames = 0
+            self.confirmed = False
+        elif self.observed_since is None:
+            self.observed_since = now
+        self.observed_frames += 1
+        if (not self.confirmed and self.observed_frames >= self.confirm_frames
+                and now - self.observed_since >= self.confirm_time):
+            with self.board_changed:
+                self.confirmed = True
+                self.publish_board_state(self.observed_state)
+
+    def publish_board_state(self, state):
+        """
+        No changes needed! Makes a confirmed state the true board state and notifies waiters and subscribers.
+        """
+        with self.board_changed:
+            if self.true_board_state != state:
+                self.true_board_state = state.copy()
+                self.board_version += 1
                 print("Board state:")
                 for row in range(3):
                     print(" | ".join(" " if x is None else x for x in self.true_board_state[row*3:(row+1)*3]))
                     if row < 2:
                         print("-" * 9)
+                for callback in self.subscribers:
+                    callback(self.true_board_state.copy())
+            self.board_changed.notify_all()
+
+    def subscribe(self, callback):
+        """
+        Calls callback with the new board state, from the camera thread, every time a change is confirmed.
+        """
+        self.subscribers.append(callback)
 
     def get_piece_change(self):
         """
@@ -227,42 +323,59 @@ class BoardVision:
         return changed_tile, new_piece
     
 
-    def get_board(self):
+    def get_board(self, timeout=None):
         """
-        No changes needed!
+        No changes needed! Waits until the board state seen by the camera is confirmed.
+        Returns None if the timeout passes first.
         """
-        while self.confidence < self.confidence_threshold:
-            time.sleep(0.05)
-        return self.true_board_state
+        with self.board_changed:
+            if not self.board_changed.wait_for(lambda: self.confirmed, timeout):
+                return None
+            return self.true_board_state
     
-    def wait_for_move(self):
+    def wait_for_move(self, timeout=None):
         """
-        No changes needed!
+        No changes needed! Waits until a change of the board is confirmed.
+        Returns None if the timeout passes first, a later call keeps waiting for a change since the first call.
         """
-        prev_truth = self.true_board_state.copy()
-        self.old_board_state = prev_truth
-        while self.get_board() == prev_truth:
-            time.sleep(0.1)
+        with self.board_changed:
+            if self.move_from_version is None:
+                self.move_from_version = self.board_version
+                self.old_board_state = self.true_board_state.copy()
+            if not self.board_changed.wait_for(lambda: self.board_version > self.move_from_version, timeout):
+                return None
+            self.move_from_version = None
+            board = self.true_board_state
         print("new board status detected!")
-        return self.get_board()
+        return board
     
     def get_cap(self):
         return self.cap
 
-    def process_detected_piece(self, px, py, pw, ph, is_red):
+    def get_tiles_from_pieces(self, boxes):
         """
-        No changes needed!
+        No changes needed! Finds the tile of every piece of a frame with get_tile_from_piece.
+        boxes: array of shape (n, 4) with x, y, w, h of the bounding rectangle of each piece
+        Returns an array with the tile index of each piece, -1 for pieces outside of the board
         """
-        t = self.get_tile_from_piece(px, py,pw, ph)
-        if t is not None:
-            if t>=9:
-                return
-            if is_red:
-                self.board_window[t] = self.board_window[t] * 0.9 + 0.1
-            else:
-                self.board_window[t] = self.board_window[t] * 0.9 -0.1
-            self.update_board_state()
+        tiles = [self.get_tile_from_piece(px, py, pw, ph) for px, py, pw, ph in boxes]
+        return np.array([-1 if t is None or not 0 <= t < 9 else t for t in tiles], dtype=int)
 
+    def accumulate_tile_evidence(self, red_tiles, blue_tiles):
+        """
+        No changes needed! Adds the pieces seen in one frame to the tile measurements, then lets all of them decay.
+        Every red piece moves the measurement of its tile 10% of the way towards 1, every blue one towards -1.
+        """
+        red = np.bincount(red_tiles[(red_tiles >= 0) & (red_tiles < 9)], minlength=9)
+        blue = np.bincount(blue_tiles[(blue_tiles >= 0) & (blue_tiles < 9)], minlength=9)
+        count = red + blue
+        # n updates towards the same target t leave 0.9^n of the old value and add (1 - 0.9^n) of t. With both
+        # colors on one tile, the target is their balance.
+        keep = 0.9 ** count
+        target = np.divide(red - blue, count, out=np.zeros(9), where=count > 0)
+        self.board_window *= keep
+        self.board_window += (1 - keep) * target
+        self.board_window *= 0.9
 
     def update_board_cam(self, x, y, w, h):
         """
@@ -278,62 +391,113 @@ class BoardVision:
             self.h = self.h * (1 - alpha) + h * alpha
     
     
+    def segment(self, frame):
+        """
+        Classifies every pixel of a BGR frame as BACKGROUND, GREEN, RED or BLUE in a single pass.
+        :return: uint8 image of pixel classes, valid until the next call
+        """
+        height, width = frame.shape[:2]
+        pixels = height * width
+        if self.label_buffer.size < pixels:
+            self.bgra_buffer = np.empty(pixels * 4, dtype=np.uint8)
+            self.index_buffer = np.empty(pixels, dtype=np.uint32)
+            self.shift_buffer = np.empty(pixels, dtype=np.uint32)
+            self.label_buffer = np.empty(pixels, dtype=np.uint8)
+            self.mask_buffer = np.empty(pixels, dtype=np.uint8)
+        bgra = cv2.cvtColor(frame, cv2.COLOR_BGR2BGRA, dst=self.bgra_buffer[:pixels * 4].reshape(height, width, 4))
+        # Each pixel as one 32-bit code b | g << 8 | r << 16 | a << 24. The top COLOR_BITS bits of every channel are
+        # moved next to each other into the table index.
+        codes = bgra.view('<u4')[..., 0]
+        index = self.index_buffer[:pixels].reshape(height, width)
+        shifted = self.shift_buffer[:pixels].reshape(height, width)
+        drop = 8 - COLOR_BITS
+        mask = (1 << COLOR_BITS) - 1
+        np.right_shift(codes, drop, out=index)
+        np.bitwise_and(index, mask, out=index)
+        for channel in (1, 2):
+            np.right_shift(codes, 8 * channel + drop - COLOR_BITS * channel, out=shifted)
+            np.bitwise_and(shifted, mask << COLOR_BITS * channel, out=shifted)
+            np.bitwise_or(index, shifted, out=index)
+        labels = self.label_buffer[:pixels].reshape(height, width)
+        np.take(self.color_lut, index, out=labels)
+        return labels
+
+    def find_blobs(self, labels, label, min_area):
+        """
+        Finds the connected regions of one pixel class.
+        :return: array of shape (n, 4) with the bounding boxes x, y, w, h of the regions with more than min_area pixels
+        """
+        mask = self.mask_buffer[:labels.size].reshape(labels.shape)
+        mask = cv2.compare(labels, label, cv2.CMP_EQ, dst=mask)
+        _, _, stats, _ = cv2.connectedComponentsWithStatsWithAlgorithm(mask, 8, cv2.CV_32S, cv2.CCL_GRANA)
+        # Row 0 is the background of the mask
+        blobs = stats[1:][stats[1:, cv2.CC_STAT_AREA] > min_area]
+        return blobs[:, :4]
+
+    def select_roi(self, frame, scale_x, scale_y):
+        """
+        Picks the part of the frame to process: a padded region around the board while it is tracked, else all of it.
+        :param frame: frame at native resolution
+        :param scale_x, scale_y: scale from the frame to the zoomed view the board position is tracked in
+        :return: x and y offset of the region in the frame, and the region
+        """
+        self.frames_since_acquire += 1
+        if not self.tracking or self.frames_since_acquire >= self.reacquire_interval:
+            self.frames_since_acquire = 0
+            return 0, 0, frame
+        pad = self.roi_padding * self.w
+        height, width = frame.shape[:2]
+        x0 = max(int((self.x - pad) / scale_x), 0)
+        y0 = max(int((self.y - pad) / scale_y), 0)
+        x1 = min(int((self.x + self.w + pad) / scale_x) + 1, width)
+        y1 = min(int((self.y + self.h + pad) / scale_y) + 1, height)
+        return x0, y0, frame[y0:y1, x0:x1]
+
     def cap_board_state(self):
         """
         Don't need to change anything here!
         """
         cap = self.cap
-        lower_red1 = np.array([0, 70, 50])
-        upper_red1 = np.array([15, 255, 255])
-        lower_red2 = np.array([160, 0, 0])
-        upper_red2 = np.array([180, 255, 255])
-        lower_blue = np.array([100, 170, 80])
-        upper_blue = np.array([120, 255, 255])
-
-        lower_blue_close = np.array([111, 197, 70])
-        upper_blue_close = np.array([120, 215, 90])
-
-        lower_green = np.array([40, 100, 90])
-        upper_green = np.array([90, 255, 255])
+        self.grabber.start()
 
         while True:
-            ret, frame = cap.read()
-            if not ret:
+            frame = self.grabber.read()
+            if frame is None:
                 break
 
-            if ret:
-                height, width = frame.shape[:2]
+            height, width = frame.shape[:2]
 
-                # Calculate cropping coordinates for 50% zoom
-                center_x, center_y = width // 2, height // 2
-                new_width, new_height = int(width / 2), int(height / 2)
+            # Calculate cropping coordinates for 50% zoom
+            center_x, center_y = width // 2, height // 2
+            new_width, new_height = int(width / 2), int(height / 2)
 
-                x1 = center_x - new_width // 2
-                y1 = center_y - new_height // 2
-                x2 = center_x + new_width // 2
-                y2 = center_y + new_height // 2
+            x1 = center_x - new_width // 2
+            y1 = center_y - new_height // 2
+            x2 = center_x + new_width // 2
+            y2 = center_y + new_height // 2
+
+            # The crop is processed at native resolution. Positions are tracked in the zoomed view (the crop resized
+            # to the full frame), so detections are scaled instead of resizing every frame.
+            zoomed_frame = frame[y1:y2, x1:x2]
+            scale_x = width / (x2 - x1)
+            scale_y = height / (y2 - y1)
+            area_scale = scale_x * scale_y
+            roi_x, roi_y, roi = self.select_roi(zoomed_frame, scale_x, scale_y)
+
+            def to_view(blobs):
+                return (blobs + [roi_x, roi_y, 0, 0]) * [scale_x, scale_y, scale_x, scale_y]
 
-                # Crop and resize
-                zoomed_frame = frame[y1:y2, x1:x2]
-                frame = cv2.resize(zoomed_frame, (width, height))
             board_seen = False
-            hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
-            red_mask1 = cv2.inRange(hsv, lower_red1, upper_red1)
-            red_mask2 = cv2.inRange(hsv, lower_red2, upper_red2)
-            red_mask = cv2.bitwise_or(red_mask1, red_mask2)
-
-            blue_mask = cv2.inRange(hsv, lower_blue, upper_blue)   
-            blue_mask_close = cv2.inRange(hsv, lower_blue_close, upper_blue_close)     
-            green_mask = cv2.inRange(hsv, lower_green, upper_green)
-
-            contours_green, _ = cv2.findContours(green_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            valid_green = [cnt for cnt in contours_green if cv2.contourArea(cnt) > 100]
-            if valid_green:
-                all_pts = np.vstack(valid_green)
-                x_min = float(np.min(all_pts[:, 0, 0]))
-                x_max = float(np.max(all_pts[:, 0, 0]))
-                y_min = float(np.min(all_pts[:, 0, 1]))
-                y_max = float(np.max(all_pts[:, 0, 1]))
+            drawn = []
+            labels = self.segment(roi)
+
+            green_blobs = self.find_blobs(labels, GREEN, 100 / area_scale)
+            if len(green_blobs):
+                boxes = to_view(green_blobs)
+                x_min = float(np.min(boxes[:, 0]))
+                x_max = float(np.max(boxes[:, 0] + boxes[:, 2] - 1))
+                y_min = float(np.min(boxes[:, 1]))
+                y_max = float(np.max(boxes[:, 1] + boxes[:, 3] - 1))
 
                 w = x_max - x_min
                 # Ensure y_max is at least y_min + w so pieces on bottom row don't block green and pull y_max upward
@@ -345,41 +509,32 @@ class BoardVision:
                 y = y_min
 
                 if w > 50 and h > 50:
-                    cv2.rectangle(frame, (int(x), int(y)), (int(x + w), int(y + h)), (0, 255, 0), 2)
+                    drawn.append(((x, y, w, h), (0, 255, 0)))
                     self.update_board_cam(x, y, w, h)
                     board_seen = True
+            self.tracking = board_seen
 
             if board_seen and self.x is not None and self.w is not None and self.h is not None:
-                def is_inside_board(px, py, pw, ph):
-                    cx = px + pw / 2.0
-                    cy = py + ph / 2.0
-                    return (self.x <= cx <= self.x + self.w) and (self.y <= cy <= self.y + self.h)
-
-                contours_red, _ = cv2.findContours(red_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                for cnt in contours_red:
-                    area = cv2.contourArea(cnt)
-                    if area > 800:
-                        x, y, w, h = cv2.boundingRect(cnt)
-                        if is_inside_board(x, y, w, h):
-                            cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 0, 255), 2)
-                            self.process_detected_piece(x, y, w, h, True)
-
-                contours_blue, _ = cv2.findContours(blue_mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-                for cnt in contours_blue:
-                    area = cv2.contourArea(cnt)
-                    if area > 800:
-                        x, y, w, h = cv2.boundingRect(cnt)
-                        if is_inside_board(x, y, w, h):
-                            cv2.rectangle(frame, (x, y), (x+w, y+h), (255, 0, 0), 2)
-                            self.process_detected_piece(x, y, w, h, False)
-                for n in range(len(self.board_window)):
-                    self.board_window[n] = self.board_window[n]*0.9
+                red_boxes = to_view(self.find_blobs(labels, RED, 800 / area_scale))
+                blue_boxes = to_view(self.find_blobs(labels, BLUE, 800 / area_scale))
+                red_tiles = self.get_tiles_from_pieces(red_boxes)
+                blue_tiles = self.get_tiles_from_pieces(blue_boxes)
+                for boxes, tiles, color in ((red_boxes, red_tiles, (0, 0, 255)), (blue_boxes, blue_tiles, (255, 0, 0))):
+                    drawn.extend((box, color) for box in boxes[tiles >= 0])
+                self.accumulate_tile_evidence(red_tiles, blue_tiles)
                 self.update_board_state()
+                self.confirm_board_state(self.grabber.stamp)
+            self.frame_sequence = self.grabber.sequence
             if self.main:
+                # Only the displayed frame is resized to the zoomed view
+                frame = cv2.resize(zoomed_frame, (width, height))
+                for (x, y, w, h), color in drawn:
+                    cv2.rectangle(frame, (int(x), int(y)), (int(x + w), int(y + h)), color, 2)
                 cv2.imshow("Camera View", frame)
                 if cv2.waitKey(1) & 0xFF == ord('q'):
                     break
                     
+        self.grabber.stop()
         cap.release()
         cv2.destroyAllWindows()
 